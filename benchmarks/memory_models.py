@@ -0,0 +1,83 @@
+"""
+Memory footprint of Chunk / QAPair, compared with the previous plain-dataclass models.
+
+    python benchmarks/memory_models.py --chunks 200000 --files 2000
+
+Chunk texts are created up front and shared by both runs, so the numbers are the
+per-object overhead: instance dicts, repeated path strings and formatted "01/17" indices.
+"""
+import argparse
+import gc
+import tracemalloc
+from dataclasses import dataclass
+
+from alpacagen import Chunk, QAPair
+
+@dataclass
+class LegacyChunk:
+    content: str
+    source: str
+    idx: str
+
+@dataclass
+class LegacyQAPair:
+    instruction: str
+    input: str
+    output: str
+    source: LegacyChunk
+
+def build_legacy(texts, files, pairs_per_chunk):
+    per_file = len(texts) // files
+    objects = []
+    for n, text in enumerate(texts):
+        file, position = divmod(n, per_file)
+        # the path string used to be built per chunk by str(source)
+        chunk = LegacyChunk(
+            content=text,
+            source=str(f"corpus/dept-{file % 7}/document-{file:06d}.pdf"),
+            idx=f"{str(position + 1).zfill(len(str(per_file)))}/{per_file}",
+        )
+        objects.extend(LegacyQAPair("Q", "", "A", chunk) for _ in range(pairs_per_chunk))
+    return objects
+
+def build_compact(texts, files, pairs_per_chunk):
+    per_file = len(texts) // files
+    objects = []
+    for n, text in enumerate(texts):
+        file, position = divmod(n, per_file)
+        chunk = Chunk(
+            content=text,
+            source=f"corpus/dept-{file % 7}/document-{file:06d}.pdf",
+            index=position + 1,
+            count=per_file,
+        )
+        objects.extend(QAPair("Q", "", "A", chunk) for _ in range(pairs_per_chunk))
+    return objects
+
+def measure(build, *args):
+    gc.collect()
+    tracemalloc.start()
+    objects = build(*args)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=200_000)
+    parser.add_argument('--files', type=int, default=2_000)
+    parser.add_argument('--pairs-per-chunk', type=int, default=3)
+    args = parser.parse_args()
+
+    texts = [f"chunk text {n}" for n in range(args.chunks)]
+    legacy = measure(build_legacy, texts, args.files, args.pairs_per_chunk)
+    compact = measure(build_compact, texts, args.files, args.pairs_per_chunk)
+
+    print(f"{args.chunks} chunks, {args.chunks * args.pairs_per_chunk} pairs, {args.files} files")
+    print(f"{'legacy dataclasses':<20} {legacy / 2**20:8.1f} MiB  {legacy / args.chunks:6.0f} B/chunk")
+    print(f"{'slotted models':<20} {compact / 2**20:8.1f} MiB  {compact / args.chunks:6.0f} B/chunk")
+    print(f"saved {1 - compact / legacy:.0%}")
+
+if __name__ == '__main__':
+    main()
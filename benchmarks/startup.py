@@ -0,0 +1,68 @@
+"""
+Startup time of the OpenAI-only path, measured in fresh interpreters.
+
+Times `import alpacagen` and building an OpenAI client (which loads the `openai`
+SDK) and checks that HuggingFace/markitdown backends stay unloaded. Exits with
+status 1 when the median exceeds `--budget` seconds or a heavy module was imported.
+
+    python benchmarks/startup.py --runs 5 --budget 1.5
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# modules the OpenAI/Azure path must not import
+HEAVY_MODULES = ['torch', 'transformers', 'markitdown', 'numpy']
+
+PROBE = """
+import sys, time, json, resource
+started = time.perf_counter()
+import alpacagen
+imported = time.perf_counter()
+from alpacagen import AlpacaGen
+ag = AlpacaGen(llm_provider='openai', api_key='startup-benchmark')
+client = ag._build_client('openai', ag.api_key, None, ag.llm_model)
+ready = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - started,
+    'client_seconds': ready - started,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'heavy_modules': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+def measure(runs: int):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.5, help='seconds allowed until an OpenAI client is ready')
+    args = parser.parse_args()
+
+    samples = measure(args.runs)
+    import_seconds = statistics.median(sample['import_seconds'] for sample in samples)
+    client_seconds = statistics.median(sample['client_seconds'] for sample in samples)
+    max_rss_mb = max(sample['max_rss_kb'] for sample in samples) / 1024
+    heavy = sorted({name for sample in samples for name in sample['heavy_modules']})
+
+    print(f"import alpacagen        {import_seconds * 1000:8.0f} ms (median of {args.runs})")
+    print(f"OpenAI client ready     {client_seconds * 1000:8.0f} ms (budget {args.budget * 1000:.0f} ms)")
+    print(f"peak RSS                {max_rss_mb:8.0f} MiB")
+    failed = False
+    if heavy:
+        print(f"FAIL: heavy modules imported on the OpenAI path: {', '.join(heavy)}")
+        failed = True
+    if client_seconds > args.budget:
+        print("FAIL: startup budget exceeded")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+End-to-end throughput benchmark against a local OpenAI-compatible stub server.
+
+Builds a synthetic corpus, runs `AlpacaGen.get_chunks` and `get_datasets` against
+`alpacagen.testing.StubOpenAIServer` with injected latency and faults, and writes a
+JSON report. With `--baseline` the run is compared against an earlier report and
+the script exits with status 1 when a metric regressed by more than `--tolerance`.
+
+    python benchmarks/throughput.py --files 200 --latency 0.05 --output report.json
+    python benchmarks/throughput.py --files 200 --latency 0.05 --baseline report.json
+"""
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+from alpacagen import AlpacaGen
+from alpacagen.testing import StubOpenAIServer
+
+# metric -> whether a higher value is better
+# each rate is named after its stage and divides by that stage's seconds only
+COMPARED_METRICS = {
+    'chunking_chunks_per_second': True,
+    'generation_chunks_per_second': True,
+    'generation_qa_pairs_per_second': True,
+    'p95_latency': False,
+    'peak_rss_mb': False,
+}
+
+WORDS = (
+    "server processor memory cache storage network cluster node replica shard query index "
+    "latency throughput request response batch stream queue worker thread process kernel "
+    "driver firmware module interface protocol packet buffer socket endpoint gateway"
+).split()
+
+def build_corpus(directory: Path, files: int, paragraphs: int, seed: int) -> int:
+    """ write `files` plain-text documents of `paragraphs` paragraphs each, return total bytes """
+    rng = random.Random(seed)
+    total = 0
+    for n in range(files):
+        text = '\n\n'.join(
+            ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize() + '.'
+            for _ in range(paragraphs)
+        )
+        path = directory / f"doc-{n:05d}.txt"
+        path.write_text(f"# Document {n}\n\n{text}\n", encoding='utf-8')
+        total += path.stat().st_size
+    return total
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS; the stub server shares this process
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp, StubOpenAIServer(
+        entries_per_response=args.entries_per_chunk,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+    ) as server:
+        corpus_bytes = build_corpus(Path(tmp), args.files, args.paragraphs, args.seed)
+        ag = AlpacaGen(llm_provider='openai', api_key='benchmark', base_url=server.url)
+
+        started = time.perf_counter()
+        chunks = ag.get_chunks(tmp, chunk_size=args.chunk_size, num_workers=args.num_workers)
+        chunked = time.perf_counter()
+        dataset = ag.get_datasets(
+            chunks,
+            language='en',
+            entries_per_chunk=args.entries_per_chunk,
+            max_concurrency=args.max_concurrency,
+        )
+        finished = time.perf_counter()
+        counters = dict(server.counters)
+
+    run_stats, parse_stats = ag.last_run_stats, ag.last_parse_stats
+    return {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'results': {
+            'corpus_bytes': corpus_bytes,
+            'chunks': len(chunks),
+            'qa_pairs': len(dataset),
+            'chunk_seconds': chunked - started,
+            'generate_seconds': finished - chunked,
+            'total_seconds': finished - started,
+            'chunking_chunks_per_second': len(chunks) / (chunked - started),
+            'generation_chunks_per_second': len(chunks) / (finished - chunked),
+            'generation_qa_pairs_per_second': len(dataset) / (finished - chunked),
+            'p50_latency': run_stats.p50_latency,
+            'p95_latency': run_stats.p95_latency,
+            'failed_chunks': run_stats.failed,
+            'peak_rss_mb': peak_rss_mb(),
+            # every request beyond one per chunk was a retry of some kind
+            'retries': counters['requests'] - len(chunks),
+            'parse_retries': parse_stats.parse_retries,
+            'server': counters,
+        },
+    }
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """ metrics that got worse than the baseline by more than `tolerance` (relative) """
+    regressions = []
+    print(f"{'metric':<32}{'baseline':>12}{'current':>12}{'change':>10}")
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        before, after = baseline['results'].get(metric), report['results'].get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        worse = -change if higher_is_better else change
+        flag = '  REGRESSION' if worse > tolerance else ''
+        print(f"{metric:<32}{before:>12.3f}{after:>12.3f}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(metric)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--paragraphs', type=int, default=20, help='paragraphs per file')
+    parser.add_argument('--chunk-size', type=int, default=1024)
+    parser.add_argument('--num-workers', type=int, default=1)
+    parser.add_argument('--entries-per-chunk', type=int, default=3)
+    parser.add_argument('--max-concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per stub request')
+    parser.add_argument('--latency-jitter', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=Path('benchmark-report.json'))
+    parser.add_argument('--baseline', type=Path, help='earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative regression')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    report = run(args)
+    args.output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+    results = report['results']
+    print(
+        f"{results['chunks']} chunks, {results['qa_pairs']} pairs: "
+        f"chunking {results['chunking_chunks_per_second']:.1f} chunks/s, "
+        f"generation {results['generation_chunks_per_second']:.1f} chunks/s ({results['generation_qa_pairs_per_second']:.1f} pairs/s), "
+        f"p95 {results['p95_latency'] * 1000:.0f}ms, peak RSS {results['peak_rss_mb']:.0f} MiB, "
+        f"{results['retries']} retries -> {args.output}"
+    )
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 from .main import AlpacaGen
 from .models.qa_pair import QAPair, Chunk
-from .strategies.chunk import ChunkStrategy, RecursiveChunkStrategy
+from .strategies.chunk import ChunkStrategy, RecursiveChunkStrategy, TokenChunkStrategy, OffsetChunkStrategy
 from .converters.text import TextConverter, MarkItDownConverter
 
 __version__ = "0.1.1"
@@ -11,6 +11,8 @@ __all__ = [
     'Chunk',
     'ChunkStrategy',
     'RecursiveChunkStrategy',
+    'TokenChunkStrategy',
+    'OffsetChunkStrategy',
     'TextConverter',
     'MarkItDownConverter',
 ]
\ No newline at end of file
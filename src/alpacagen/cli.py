@@ -0,0 +1,266 @@
+"""
+Command-line entry point.
+
+    alpacagen run docs/ out.jsonl --provider openai --language en
+    alpacagen run docs/ out/shard-1.jsonl --shard-index 1 --num-shards 8   # one node of eight
+    alpacagen launch docs/ out/ --num-shards 8 --language en                # all shards on this machine
+    alpacagen merge out/shard-*.jsonl --output dataset.jsonl
+    alpacagen filter dataset.jsonl clean.jsonl --language en --rejected rejected.jsonl
+
+Files are assigned to shards by a hash of their path relative to the input
+directory, so every node computes the same split without coordination.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+API_KEY_ENV = 'ALPACAGEN_API_KEY'
+
+def shard_output_path(output_dir: Path, shard_index: int, num_shards: int, suffix: str = '.jsonl') -> Path:
+    return output_dir / f"shard-{shard_index:05d}-of-{num_shards:05d}{suffix}"
+
+def _add_generation_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--provider', default='openai', choices=['openai', 'azure', 'huggingface'])
+    parser.add_argument('--model', help='model or deployment name (provider default if omitted)')
+    parser.add_argument('--api-key', help=f'defaults to ${API_KEY_ENV}, then $OPENAI_API_KEY')
+    parser.add_argument('--base-url')
+    parser.add_argument('--language', default='zhtw', choices=['zhtw', 'en'])
+    parser.add_argument('--prompt', type=Path, help='custom generation prompt file')
+    parser.add_argument('--entries-per-chunk', type=int, default=3)
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--offset-chunks', action='store_true', help='split with OffsetChunkStrategy (no chunk copies)')
+    parser.add_argument('--max-concurrency', type=int, default=20)
+    parser.add_argument('--num-workers', type=int, default=1, help='conversion processes per shard')
+    parser.add_argument('--file-timeout', type=float, help='skip files that take longer to convert (with --num-workers > 1)')
+    parser.add_argument('--requests-per-minute', type=int)
+    parser.add_argument('--tokens-per-minute', type=int)
+    parser.add_argument('--cache-dir', type=Path, help='on-disk LLM response cache')
+    parser.add_argument('--resume', action='store_true', help='skip chunks completed by an earlier run')
+    parser.add_argument('--dedup-threshold', type=float)
+    parser.add_argument('--pack-tokens', type=int)
+    parser.add_argument('--max-output-tokens', type=int, default=4096, help="the model's output token limit")
+    parser.add_argument('--structured-output', action='store_true')
+    parser.add_argument('--stream-responses', action='store_true', help='stop each response once enough pairs are parsed')
+
+def _generation_argv(args: argparse.Namespace) -> List[str]:
+    """ the generation options of `args` as command-line flags, to hand them to shard workers """
+    argv = []
+    for action in _generation_parser()._actions:
+        if not action.option_strings or action.dest in ('help', 'api_key'):
+            continue
+        value = getattr(args, action.dest, None)
+        if value is None or value is False:
+            continue
+        argv.append(action.option_strings[0])
+        if value is not True:
+            argv.append(str(value))
+    return argv
+
+def _generation_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(add_help=False)
+    _add_generation_arguments(parser)
+    return parser
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='alpacagen', description='Generate Alpaca-format datasets from documents.')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the pipeline on a directory or on one shard of it')
+    run.add_argument('input', type=Path)
+    run.add_argument('output', type=Path, help='.jsonl(.gz/.zst), .parquet or .arrow')
+    run.add_argument('--shard-index', type=int)
+    run.add_argument('--num-shards', type=int, default=1)
+    _add_generation_arguments(run)
+
+    launch = commands.add_parser('launch', help='run every shard in its own local process, then merge')
+    launch.add_argument('input', type=Path)
+    launch.add_argument('output_dir', type=Path)
+    launch.add_argument('--num-shards', type=int, default=os.cpu_count() or 1)
+    launch.add_argument('--processes', type=int, help='shards running at once (default: all)')
+    launch.add_argument('--merged-output', type=Path, help='defaults to <output_dir>/dataset.jsonl')
+    _add_generation_arguments(launch)
+
+    shard = commands.add_parser('shard', help='print the files of each shard')
+    shard.add_argument('input', type=Path)
+    shard.add_argument('--num-shards', type=int, required=True)
+    shard.add_argument('--shard-index', type=int)
+
+    quality = commands.add_parser('filter', help='drop low-quality and near-duplicate pairs from a JSONL dataset')
+    quality.add_argument('input', type=Path)
+    quality.add_argument('output', type=Path)
+    quality.add_argument('--language', choices=['zhtw', 'en'], help='also reject pairs mostly in another script')
+    quality.add_argument('--threshold', type=float, default=0.8, help='similarity from which pairs are duplicates')
+    quality.add_argument('--window', type=int, default=500_000, help='kept pairs remembered for deduplication')
+    quality.add_argument('--rejected', type=Path, help='write rejected rows with their reason here')
+
+    merge = commands.add_parser('merge', help='concatenate shard outputs into one dataset')
+    merge.add_argument('inputs', type=Path, nargs='+')
+    merge.add_argument('--output', type=Path, required=True)
+    return parser
+
+def _api_key(args: argparse.Namespace) -> Optional[str]:
+    return args.api_key or os.environ.get(API_KEY_ENV) or os.environ.get('OPENAI_API_KEY')
+
+def run_command(args: argparse.Namespace, parser: argparse.ArgumentParser) -> int:
+    from .main import AlpacaGen
+    from .strategies.chunk import OffsetChunkStrategy
+
+    shard = None
+    if args.num_shards > 1:
+        if args.shard_index is None or not 0 <= args.shard_index < args.num_shards:
+            parser.error("--shard-index must be in [0, --num-shards) when sharding")
+        shard = (args.shard_index, args.num_shards)
+    elif args.shard_index is not None:
+        parser.error("--shard-index needs --num-shards > 1")
+    ag = AlpacaGen(
+        llm_provider=args.provider,
+        llm_model=args.model,
+        api_key=_api_key(args),
+        base_url=args.base_url,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        cache_dir=args.cache_dir,
+        structured_output=args.structured_output,
+        stream_responses=args.stream_responses,
+        max_output_tokens=args.max_output_tokens,
+    )
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    written = ag.run_pipeline(
+        args.input,
+        args.output,
+        language=args.language,
+        gen_prompt_path=args.prompt,
+        entries_per_chunk=args.entries_per_chunk,
+        chunk_size=args.chunk_size,
+        max_concurrency=args.max_concurrency,
+        resume=args.resume,
+        num_workers=args.num_workers,
+        file_timeout=args.file_timeout,
+        chunk_strategy=OffsetChunkStrategy(chunk_size=args.chunk_size, chunk_overlap=200) if args.offset_chunks else None,
+        dedup_threshold=args.dedup_threshold,
+        pack_tokens=args.pack_tokens,
+        shard=shard,
+    )
+    logger.info(f"Wrote {written} QA pairs to {args.output}")
+    return 0
+
+def launch_command(args: argparse.Namespace) -> int:
+    """ one `alpacagen run` subprocess per shard, at most `processes` at a time, then merge """
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    processes = args.processes or args.num_shards
+    # the key goes through the environment so it does not show up in process listings
+    env = dict(os.environ)
+    if _api_key(args):
+        env[API_KEY_ENV] = _api_key(args)
+
+    outputs = [shard_output_path(args.output_dir, index, args.num_shards) for index in range(args.num_shards)]
+    pending = list(range(args.num_shards))
+    running = {}
+    failed = []
+    while pending or running:
+        while pending and len(running) < processes:
+            index = pending.pop(0)
+            command = [
+                sys.executable, '-m', 'alpacagen.cli', 'run', str(args.input), str(outputs[index]),
+                *(['--shard-index', str(index), '--num-shards', str(args.num_shards)] if args.num_shards > 1 else []),
+                *_generation_argv(args),
+            ]
+            running[index] = subprocess.Popen(command, env=env)
+        for index, process in list(running.items()):
+            if process.poll() is None:
+                continue
+            del running[index]
+            if process.returncode != 0:
+                logger.error(f"Shard {index} failed with exit code {process.returncode}")
+                failed.append(index)
+        if running:
+            time.sleep(0.2)
+
+    if failed:
+        if args.resume:
+            hint = "rerun with --resume to retry them"
+        else:
+            # no journal was kept, so a rerun starts every shard over
+            hint = "rerun to retry them; add --resume to keep completed chunks across reruns"
+        logger.error(f"{len(failed)} shard(s) failed: {sorted(failed)}; {hint}")
+        return 1
+    merged = args.merged_output or args.output_dir / 'dataset.jsonl'
+    lines = merge_outputs(outputs, merged)
+    logger.info(f"Merged {args.num_shards} shards ({lines} QA pairs) into {merged}")
+    return 0
+
+def shard_command(args: argparse.Namespace) -> int:
+    from .generators.chunk import ChunkGenerator
+
+    files = ChunkGenerator.list_files(args.input)
+    indices = [args.shard_index] if args.shard_index is not None else range(args.num_shards)
+    for index in indices:
+        for file in ChunkGenerator.shard_files(args.input, files, index, args.num_shards):
+            print(f"{index}\t{file}")
+    return 0
+
+def filter_command(args: argparse.Namespace) -> int:
+    from .filters.qa_filter import QAFilter
+
+    qa_filter = QAFilter(language=args.language, threshold=args.threshold, window=args.window)
+    stats = qa_filter.filter_jsonl(args.input, args.output, args.rejected)
+    print(json.dumps({'seen': stats.seen, 'kept': stats.kept, 'rejected': stats.rejected}))
+    return 0
+
+def merge_outputs(inputs: Sequence[Path], output: Path) -> int:
+    """
+    concatenate JSONL shard outputs in the given order, returning the number of records
+    gzip and zstd streams may be concatenated as they are, so compressed shards are copied byte for byte
+    and only decompressed to count their records
+    """
+    from .filters.qa_filter import _open_lines
+
+    suffixes = {''.join(path.suffixes[-2:]) if path.suffix in ('.gz', '.zst') else path.suffix for path in inputs}
+    if not suffixes <= {'.jsonl', '.jsonl.gz', '.jsonl.zst'} or len(suffixes) > 1:
+        raise ValueError(f"merge needs shard outputs of one JSONL format, got {sorted(suffixes)}")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    records = 0
+    with output.open('wb') as merged:
+        for path in inputs:
+            if path.resolve() == output.resolve():
+                continue
+            with path.open('rb') as shard:
+                shutil.copyfileobj(shard, merged, 1 << 20)
+            with _open_lines(path, 'r') as shard:
+                records += sum(1 for line in shard if line.strip())
+    return records
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        force=True,
+    )
+    match args.command:
+        case 'run':
+            return run_command(args, parser)
+        case 'launch':
+            return launch_command(args)
+        case 'shard':
+            return shard_command(args)
+        case 'filter':
+            return filter_command(args)
+        case 'merge':
+            records = merge_outputs(args.inputs, args.output)
+            print(json.dumps({'output': str(args.output), 'records': records}))
+            return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,49 @@
 ## AlpacaGen
 import logging
-from typing import Union
+from typing import TYPE_CHECKING, Union
 from pathlib import Path
 from abc import ABC, abstractmethod
-from markitdown import MarkItDown
+
+if TYPE_CHECKING:
+    from markitdown import MarkItDown
 
 class TextConverter(ABC):
     @abstractmethod
     def convert(self, input_path: Union[str, Path]) -> str:
         pass
 
+    @property
+    def version(self) -> str:
+        """ identifies the converter output, cached conversions from another version are discarded """
+        return f"{type(self).__module__}.{type(self).__qualname__}"
+
 class MarkItDownConverter(TextConverter):
     """ use MakeItDown as a converter """
+    def __init__(self):
+        self._md = None
+
+    @property
+    def md(self) -> 'MarkItDown':
+        # built once per converter (and so once per worker process) instead of per file;
+        # markitdown is only imported here, it is slow to import and unused by custom converters
+        if self._md is None:
+            from markitdown import MarkItDown
+            self._md = MarkItDown()
+        return self._md
+
+    @property
+    def version(self) -> str:
+        import markitdown
+        return f"markitdown-{getattr(markitdown, '__version__', 'unknown')}"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_md'] = None
+        return state
+
     def convert(self, input_path: Union[str, Path]) -> str:
         """ input path should be a file, not a directory """
-        md = MarkItDown()
+        md = self.md
 
         if isinstance(input_path, Path):
             input_path = str(input_path)
@@ -0,0 +1,5 @@
+from .chunk_dedup import ChunkDeduplicator, DedupStats
+from .minhash import MinHasher, LSHIndex
+from .qa_filter import QAFilter, QAFilterStats, QualityRules
+
+__all__ = ['ChunkDeduplicator', 'DedupStats', 'MinHasher', 'LSHIndex', 'QAFilter', 'QAFilterStats', 'QualityRules']
@@ -0,0 +1,62 @@
+import logging
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+from ..models.qa_pair import Chunk
+from .minhash import MinHasher, LSHIndex, exact_digest
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class DedupStats:
+    seen: int = 0
+    exact_duplicates: int = 0
+    near_duplicates: int = 0
+
+    @property
+    def llm_calls_saved(self) -> int:
+        return self.exact_duplicates + self.near_duplicates
+
+class ChunkDeduplicator:
+    """
+    Drop chunks that repeat content already seen, before any LLM call is spent on them.
+    Exact duplicates are caught by a hash of the normalized text; near duplicates by
+    MinHash signatures looked up in an LSH index, so cost grows linearly with the corpus.
+    """
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, shingle_size: int = 5):
+        self.minhasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+        self.index = LSHIndex(num_perm=num_perm, threshold=threshold)
+        self.digests = set()
+        self.stats = DedupStats()
+
+    def is_duplicate(self, chunk: Chunk) -> bool:
+        self.stats.seen += 1
+        digest = exact_digest(chunk.content)
+        if digest in self.digests:
+            self.stats.exact_duplicates += 1
+            return True
+        self.digests.add(digest)
+
+        signature = self.minhasher.signature(chunk.content)
+        if signature is None:
+            return False
+        if self.index.query(signature) is not None:
+            self.stats.near_duplicates += 1
+            return True
+        self.index.insert(self.stats.seen, signature)
+        return False
+
+    def filter(self, chunks: Iterable[Chunk]) -> Iterator[Chunk]:
+        for chunk in chunks:
+            if not self.is_duplicate(chunk):
+                yield chunk
+
+    async def afilter(self, chunks: AsyncIterable[Chunk]) -> AsyncIterator[Chunk]:
+        async for chunk in chunks:
+            if not self.is_duplicate(chunk):
+                yield chunk
+
+    def log_stats(self):
+        logger.info(
+            f"Chunk dedup: {self.stats.exact_duplicates} exact and {self.stats.near_duplicates} near duplicates "
+            f"out of {self.stats.seen} chunks, {self.stats.llm_calls_saved} LLM calls saved"
+        )
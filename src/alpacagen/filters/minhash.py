@@ -0,0 +1,166 @@
+import re
+import hashlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+_MAX_HASH = np.uint32((1 << 32) - 1)
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize(text: str) -> str:
+    return _WHITESPACE.sub(' ', text).strip().lower()
+
+def exact_digest(text: str) -> bytes:
+    return hashlib.blake2b(normalize(text).encode('utf-8'), digest_size=16).digest()
+
+def optimal_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """ (bands, rows) whose S-curve midpoint (1/b)^(1/r) is closest to the threshold """
+    candidates = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(candidates, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold))
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """ splitmix64 finalizer, spreads rolling-hash values over all 64 bits """
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+class MinHasher:
+    """
+    MinHash signatures over character shingles, vectorized with NumPy.
+
+    Uses one-permutation hashing: every shingle is hashed once, its high bits pick one
+    of `num_perm` bins and the bin keeps the smallest low bits. Empty bins borrow from
+    the next filled bin (rotation densification). This costs O(shingles) per text
+    instead of O(shingles * num_perm) for classic k-permutation MinHash.
+    """
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = np.uint64(seed * 0x9E3779B97F4A7C15 % (1 << 64))
+
+    def shingle_hashes(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(normalize(text).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        n = len(codes) - self.shingle_size + 1
+        if n <= 0:
+            return np.empty(0, dtype=np.uint64)
+        hashes = np.full(n, self.seed, dtype=np.uint64)
+        for offset in range(self.shingle_size):
+            # uint64 arithmetic wraps around, which is what a rolling hash wants
+            hashes = hashes * np.uint64(1_000_003) + codes[offset:offset + n]
+        return np.unique(_mix64(hashes))
+
+    def signature_from_hashes(self, hashes: np.ndarray) -> Optional[np.ndarray]:
+        if not len(hashes):
+            return None
+        bins = ((hashes >> np.uint64(32)) % np.uint64(self.num_perm)).astype(np.intp)
+        signature = np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        np.minimum.at(signature, bins, (hashes & np.uint64(0xFFFFFFFF)).astype(np.uint32))
+        return _densify(signature)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """ uint32 signature, or None when the text is shorter than one shingle """
+        return self.signature_from_hashes(self.shingle_hashes(text))
+
+    def signatures(self, texts: Iterable[str]) -> List[Optional[np.ndarray]]:
+        return [self.signature(text) for text in texts]
+
+    def shingle_table(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        distinct shingle hashes of many texts in one pass -> (text index, hash) pairs sorted by
+        text then hash, and the number of shingles (repeats included) of each text
+        per text the hashes are identical to shingle_hashes
+        """
+        normalized = [normalize(text) for text in texts]
+        lengths = np.fromiter((len(text) for text in normalized), dtype=np.intp, count=len(texts))
+        codes = np.frombuffer(''.join(normalized).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        n = len(codes) - self.shingle_size + 1
+        if n <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.uint64), np.zeros(len(texts), dtype=np.intp)
+        hashes = np.full(n, self.seed, dtype=np.uint64)
+        for offset in range(self.shingle_size):
+            hashes = hashes * np.uint64(1_000_003) + codes[offset:offset + n]
+        # the rolling hash runs over the concatenation; keep windows that lie inside one text
+        owners = np.repeat(np.arange(len(texts), dtype=np.intp), lengths)[:n]
+        ends = np.cumsum(lengths)[owners]
+        inside = np.arange(n) + self.shingle_size <= ends
+        owners, hashes = owners[inside], _mix64(hashes[inside])
+        totals = np.bincount(owners, minlength=len(texts))
+        # one sort of (text, top 40 hash bits) keys is much cheaper than a lexsort of both columns
+        keys = owner_keys(owners, hashes)
+        order = np.argsort(keys)
+        keys, owners, hashes = keys[order], owners[order], hashes[order]
+        distinct = np.ones(len(keys), dtype=bool)
+        distinct[1:] = keys[1:] != keys[:-1]
+        return owners[distinct], hashes[distinct], totals
+
+    def signature_matrix(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        signatures of many texts in one pass -> (texts x num_perm uint32 matrix, mask of texts with shingles)
+        rows equal `signature` of each text; rows of texts shorter than one shingle are unset
+        """
+        owners, hashes, _ = self.shingle_table(texts)
+        matrix = np.full((len(texts), self.num_perm), _MAX_HASH, dtype=np.uint32)
+        bins = ((hashes >> np.uint64(32)) % np.uint64(self.num_perm)).astype(np.intp)
+        np.minimum.at(matrix.reshape(-1), owners * self.num_perm + bins, (hashes & np.uint64(0xFFFFFFFF)).astype(np.uint32))
+        valid = np.bincount(owners, minlength=len(texts)) > 0
+        # densify all rows at once: each pass fills the empty bins whose right neighbour is set
+        empty = (matrix == _MAX_HASH) & valid[:, None]
+        while empty.any():
+            fill = empty & ~np.roll(empty, -1, axis=1)
+            matrix[fill] = np.roll(matrix, -1, axis=1)[fill]
+            empty &= ~fill
+        return matrix, valid
+
+def owner_keys(owners: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+    """ (text index, hash) -> one sortable uint64, the index in the top 24 bits """
+    return (owners.astype(np.uint64) << np.uint64(40)) | (hashes >> np.uint64(24))
+
+def _densify(signature: np.ndarray) -> np.ndarray:
+    filled = np.flatnonzero(signature != _MAX_HASH)
+    if len(filled) < len(signature):
+        # each empty bin copies the next filled bin to its right (wrapping around)
+        empty = np.flatnonzero(signature == _MAX_HASH)
+        source = filled[np.searchsorted(filled, empty) % len(filled)]
+        signature[empty] = signature[source]
+    return signature
+
+def band_hashes(matrix: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    """ signatures (n x bands*rows) -> one uint64 key per band (n x bands), for LSH tables kept in arrays """
+    banded = matrix[:, :bands * rows].reshape(len(matrix), bands, rows).astype(np.uint64)
+    keys = np.zeros((len(matrix), bands), dtype=np.uint64)
+    for row in range(rows):
+        keys = keys * np.uint64(0x100000001B3) + banded[:, :, row]
+    return _mix64(keys)
+
+def jaccard(signature: np.ndarray, other: np.ndarray) -> float:
+    return float(np.count_nonzero(signature == other)) / len(signature)
+
+class LSHIndex:
+    """ banded LSH over MinHash signatures; lookups cost O(bands) instead of O(items) """
+    def __init__(self, num_perm: int = 128, threshold: float = 0.85):
+        self.threshold = threshold
+        self.bands, self.rows = optimal_bands(num_perm, threshold)
+        self.tables: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self.signatures: Dict[int, np.ndarray] = {}
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def query(self, signature: np.ndarray) -> Optional[int]:
+        """ id of an indexed item whose estimated similarity reaches the threshold """
+        checked = set()
+        for table, key in zip(self.tables, self._band_keys(signature)):
+            for item_id in table.get(key, ()):
+                if item_id in checked:
+                    continue
+                checked.add(item_id)
+                if jaccard(signature, self.signatures[item_id]) >= self.threshold:
+                    return item_id
+        return None
+
+    def insert(self, item_id: int, signature: np.ndarray):
+        self.signatures[item_id] = signature
+        for table, key in zip(self.tables, self._band_keys(signature)):
+            table.setdefault(key, []).append(item_id)
+
+    def __len__(self) -> int:
+        return len(self.signatures)
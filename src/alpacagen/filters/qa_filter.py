@@ -0,0 +1,304 @@
+""" post-generation cleanup of QA datasets: quality rules, then near-duplicate removal """
+import gzip
+import json
+import logging
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from ..models.qa_pair import QAPair
+from .minhash import MinHasher, band_hashes, normalize, optimal_bands, owner_keys
+
+logger = logging.getLogger(__name__)
+
+# minimum share of the expected script among letters, per generation language
+SCRIPT_SHARES = {'zhtw': 0.3, 'en': 0.7}
+
+@dataclass
+class QualityRules:
+    min_instruction_chars: int = 4
+    # output chars per instruction char; rambling answers to short questions are usually degenerate
+    max_length_ratio: float = 100.0
+    # share of distinct character shingles, below it an output is mostly repetition
+    min_distinct_shingles: float = 0.3
+    # outputs at least this similar (shingle Jaccard) to the instruction or input echo it
+    echo_threshold: float = 0.8
+    min_script_share: Optional[float] = None
+
+@dataclass
+class QAFilterStats:
+    seen: int = 0
+    kept: int = 0
+    rejected: Dict[str, int] = field(default_factory=dict)
+
+    def reject(self, reason: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+def _code_points(texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """ code points of all texts concatenated, and the start offset of each text """
+    encoded = ''.join(texts).encode('utf-32-le')
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.intp, count=len(texts))
+    return np.frombuffer(encoded, dtype=np.uint32), np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+def _per_text_sums(mask: np.ndarray, offsets: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    # the trailing 0 keeps offsets of empty texts at the end in range
+    sums = np.add.reduceat(np.append(mask.astype(np.int64), 0), offsets)
+    # reduceat yields the element at the offset for empty texts instead of 0
+    return np.where(lengths > 0, sums, 0)
+
+def script_shares(texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ per text: (CJK share, Latin share) among CJK and Latin letters, and the letter count """
+    codes, offsets = _code_points(texts)
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.intp, count=len(texts))
+    cjk = ((codes >= 0x4E00) & (codes <= 0x9FFF)) | ((codes >= 0x3400) & (codes <= 0x4DBF)) | ((codes >= 0xF900) & (codes <= 0xFAFF))
+    folded = codes | np.uint32(0x20)
+    latin = (folded >= ord('a')) & (folded <= ord('z'))
+    cjk_counts = _per_text_sums(cjk, offsets, lengths)
+    latin_counts = _per_text_sums(latin, offsets, lengths)
+    letters = cjk_counts + latin_counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nan_to_num(cjk_counts / letters), np.nan_to_num(latin_counts / letters), letters
+
+def _shared_counts(table: Tuple[np.ndarray, np.ndarray, np.ndarray], other: Tuple[np.ndarray, np.ndarray, np.ndarray], n: int) -> np.ndarray:
+    """ per row, the number of distinct shingles two shingle tables have in common """
+    keys = np.sort(np.concatenate([owner_keys(table[0], table[1]), owner_keys(other[0], other[1])]))
+    # both tables are distinct per row, so a repeated key is one shared shingle
+    shared = keys[1:][keys[1:] == keys[:-1]]
+    return np.bincount((shared >> np.uint64(40)).astype(np.intp), minlength=n)
+
+def _jaccard(table, other, n: int) -> np.ndarray:
+    sizes, other_sizes = np.bincount(table[0], minlength=n), np.bincount(other[0], minlength=n)
+    shared = _shared_counts(table, other, n)
+    union = sizes + other_sizes - shared
+    return np.divide(shared, union, out=np.zeros(n), where=union > 0)
+
+class _SignatureWindow:
+    """ LSH band tables over the signatures of the last `window` kept rows, as sorted arrays per band """
+    def __init__(self, num_perm: int, threshold: float, window: int):
+        self.threshold = threshold
+        self.bands, self.rows = optimal_bands(num_perm, threshold)
+        self.window = window
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self.keys = [np.empty(0, dtype=np.uint64) for _ in range(self.bands)]
+        self.ids = [np.empty(0, dtype=np.int64) for _ in range(self.bands)]
+        self.next_id = 0
+
+    def _similar(self, signatures: np.ndarray, others: np.ndarray) -> np.ndarray:
+        return np.count_nonzero(signatures == others, axis=1) / signatures.shape[1] >= self.threshold
+
+    def duplicates(self, signatures: np.ndarray, keys: np.ndarray) -> np.ndarray:
+        """ mask of rows similar to a remembered row or to an earlier non-duplicate row of the batch """
+        duplicate = np.zeros(len(signatures), dtype=bool)
+        for band in range(self.bands):
+            table, ids = self.keys[band], self.ids[band]
+            if not len(table):
+                break
+            positions = np.minimum(np.searchsorted(table, keys[:, band]), len(table) - 1)
+            hits = np.flatnonzero((table[positions] == keys[:, band]) & ~duplicate)
+            if len(hits):
+                slots = ids[positions[hits]] % self.window
+                duplicate[hits[self._similar(signatures[hits], self.signatures[slots])]] = True
+
+        for band in range(self.bands):
+            remaining = np.flatnonzero(~duplicate)
+            _, first, inverse = np.unique(keys[remaining, band], return_index=True, return_inverse=True)
+            earlier = remaining[first[inverse]]
+            later = np.flatnonzero(earlier != remaining)
+            if len(later):
+                rows = remaining[later]
+                duplicate[rows[self._similar(signatures[rows], signatures[earlier[later]])]] = True
+        return duplicate
+
+    def insert(self, signatures: np.ndarray, keys: np.ndarray):
+        ids = np.arange(self.next_id, self.next_id + len(signatures), dtype=np.int64)
+        self.next_id += len(signatures)
+        if len(self.signatures) < self.window:
+            grown = min(self.window, max(len(self.signatures) * 2, self.next_id))
+            self.signatures = np.concatenate([self.signatures, np.empty((grown - len(self.signatures), self.signatures.shape[1]), dtype=np.uint32)])
+        # rows beyond the window overwrite the oldest slots and leave the band tables below
+        recent = ids[-self.window:]
+        self.signatures[recent % self.window] = signatures[-self.window:]
+        oldest = self.next_id - self.window
+        for band in range(self.bands):
+            order = np.argsort(keys[:, band], kind='stable')
+            new_keys, new_ids = keys[order, band], ids[order]
+            table, table_ids = self.keys[band], self.ids[band]
+            if oldest > 0:
+                keep = table_ids >= oldest
+                table, table_ids = table[keep], table_ids[keep]
+                keep = new_ids >= oldest
+                new_keys, new_ids = new_keys[keep], new_ids[keep]
+            positions = np.searchsorted(table, new_keys) + np.arange(len(new_keys))
+            merged_keys = np.empty(len(table) + len(new_keys), dtype=np.uint64)
+            merged_ids = np.empty(len(merged_keys), dtype=np.int64)
+            old = np.ones(len(merged_keys), dtype=bool)
+            old[positions] = False
+            merged_keys[positions], merged_ids[positions] = new_keys, new_ids
+            merged_keys[old], merged_ids[old] = table, table_ids
+            self.keys[band], self.ids[band] = merged_keys, merged_ids
+
+class QAFilter:
+    """
+    Streaming quality and near-duplicate filter for generated QA pairs.
+
+    Quality rules, each counted under its reason:
+      - 'empty': blank instruction or output
+      - 'too_short': instruction shorter than `min_instruction_chars`
+      - 'length_ratio': output more than `max_length_ratio` times longer than the instruction
+      - 'degenerate': output whose character shingles are mostly repeats
+      - 'echo': output (nearly) repeating the instruction or the input
+      - 'language': too few letters of the expected script for `language` ('zhtw' or 'en')
+    Rows passing them are dropped as 'duplicate' when their `instruction + output`
+    reaches `threshold` estimated Jaccard similarity with a row kept before.
+    """
+    def __init__(
+        self,
+        language: Optional[str] = None,
+        threshold: float = 0.8,
+        num_perm: int = 64,
+        shingle_size: int = 5,
+        batch_size: int = 4096,
+        window: int = 500_000,
+        rules: Optional[QualityRules] = None,
+    ):
+        assert language is None or language in SCRIPT_SHARES, f"language should be one of {list(SCRIPT_SHARES)}"
+        self.language = language
+        self.rules = rules if rules is not None else QualityRules()
+        self.min_script_share = self.rules.min_script_share
+        if self.min_script_share is None and language is not None:
+            self.min_script_share = SCRIPT_SHARES[language]
+        self.batch_size = batch_size
+        self.minhasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+        self.index = _SignatureWindow(num_perm, threshold, window)
+        self.stats = QAFilterStats()
+
+    def _quality(self, instructions: List[str], inputs: List[str], outputs: List[str]) -> np.ndarray:
+        """ rejection reason per row, '' for rows passing every rule """
+        n = len(instructions)
+        instruction_lengths = np.fromiter((len(text.strip()) for text in instructions), dtype=np.intp, count=n)
+        output_lengths = np.fromiter((len(text.strip()) for text in outputs), dtype=np.intp, count=n)
+        output_table = self.minhasher.shingle_table(outputs)
+        distinct = np.bincount(output_table[0], minlength=n)
+        totals = output_table[2]
+        long_enough = totals >= 10 * self.minhasher.shingle_size
+        distinct_share = np.divide(distinct, totals, out=np.ones(n), where=totals > 0)
+        echo = np.maximum(
+            _jaccard(output_table, self.minhasher.shingle_table(instructions), n),
+            _jaccard(output_table, self.minhasher.shingle_table(inputs), n),
+        ) >= self.rules.echo_threshold
+        # outputs shorter than one shingle are compared as text
+        for row in np.flatnonzero(totals == 0):
+            echo[row] = normalize(outputs[row]) in (normalize(instructions[row]), normalize(inputs[row]))
+        language = np.zeros(n, dtype=bool)
+        if self.min_script_share is not None:
+            cjk, latin, letters = script_shares([instruction + output for instruction, output in zip(instructions, outputs)])
+            share = cjk if self.language == 'zhtw' else latin
+            language = (letters > 0) & (share < self.min_script_share)
+
+        # the first rule a row breaks is its reason
+        return np.select(
+            [
+                (instruction_lengths == 0) | (output_lengths == 0),
+                instruction_lengths < self.rules.min_instruction_chars,
+                output_lengths / np.maximum(instruction_lengths, 1) > self.rules.max_length_ratio,
+                language,
+                long_enough & (distinct_share < self.rules.min_distinct_shingles),
+                echo,
+            ],
+            ['empty', 'too_short', 'length_ratio', 'language', 'degenerate', 'echo'],
+            default='',
+        )
+
+    def check(self, rows: Sequence[Tuple[str, str, str]]) -> List[Optional[str]]:
+        """ (instruction, input, output) rows -> rejection reason of each row, None for rows kept """
+        instructions = [str(instruction or '') for instruction, _, _ in rows]
+        inputs = [str(input or '') for _, input, _ in rows]
+        outputs = [str(output or '') for _, _, output in rows]
+        reasons = self._quality(instructions, inputs, outputs).astype(object)
+
+        candidates = np.flatnonzero(reasons == '')
+        signatures, valid = self.minhasher.signature_matrix([instructions[row] + '\n' + outputs[row] for row in candidates])
+        candidates, signatures = candidates[valid], signatures[valid]
+        keys = band_hashes(signatures, self.index.bands, self.index.rows)
+        duplicate = self.index.duplicates(signatures, keys)
+        reasons[candidates[duplicate]] = 'duplicate'
+        self.index.insert(signatures[~duplicate], keys[~duplicate])
+
+        self.stats.seen += len(rows)
+        reasons = [reason or None for reason in reasons]
+        for reason in reasons:
+            if reason is None:
+                self.stats.kept += 1
+            else:
+                self.stats.reject(reason)
+        return reasons
+
+    def _batches(self, items: Iterable[Any]) -> Iterator[List[Any]]:
+        iterator = iter(items)
+        while batch := list(islice(iterator, self.batch_size)):
+            yield batch
+
+    def filter_records(self, records: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], Optional[str]]]:
+        """ dict records -> (record, rejection reason or None), one batch in memory at a time """
+        for batch in self._batches(records):
+            reasons = self.check([(record.get('instruction'), record.get('input'), record.get('output')) for record in batch])
+            yield from zip(batch, reasons)
+
+    def filter_pairs(self, qa_pairs: Iterable[QAPair]) -> Iterator[QAPair]:
+        for batch in self._batches(qa_pairs):
+            reasons = self.check([(qa_pair.instruction, qa_pair.input, qa_pair.output) for qa_pair in batch])
+            yield from (qa_pair for qa_pair, reason in zip(batch, reasons) if reason is None)
+
+    def filter_jsonl(
+        self,
+        input_path: Union[str, Path],
+        output_path: Union[str, Path],
+        rejected_path: Optional[Union[str, Path]] = None,
+    ) -> QAFilterStats:
+        """
+        stream a JSONL dataset (optionally .gz/.zst) into one with only the kept rows
+        kept lines are copied unchanged; rejected ones go to rejected_path with a "reason" field
+        """
+        with _open_lines(input_path, 'r') as source, _open_lines(output_path, 'w') as kept, \
+                (_open_lines(rejected_path, 'w') if rejected_path else nullcontext()) as rejected:
+            lines = (line for line in source if line.strip())
+            for batch in self._batches(lines):
+                records = [json.loads(line) for line in batch]
+                for line, (record, reason) in zip(batch, self.filter_records(records)):
+                    if reason is None:
+                        kept.write(line if line.endswith('\n') else line + '\n')
+                    elif rejected is not None:
+                        rejected.write(json.dumps({**record, 'reason': reason}, ensure_ascii=False) + '\n')
+        self.log_stats()
+        return self.stats
+
+    def log_stats(self):
+        rejected = ', '.join(f"{count} {reason}" for reason, count in sorted(self.stats.rejected.items()))
+        logger.info(f"QA filter: kept {self.stats.kept} of {self.stats.seen} pairs" + (f", rejected {rejected}" if rejected else ""))
+
+@contextmanager
+def _open_lines(path: Union[str, Path], mode: str) -> Iterator[IO[str]]:
+    """ text file by suffix: plain, gzip or zstd (requires zstandard) """
+    path = Path(path)
+    if path.suffix == '.gz':
+        with gzip.open(path, mode + 't', encoding='utf-8') as f:
+            yield f
+    elif path.suffix == '.zst':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("Reading or writing .zst requires zstandard: pip install zstandard") from e
+        import io
+        with path.open(mode + 'b') as raw:
+            if mode == 'r':
+                # merged shards are several concatenated frames
+                stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+            else:
+                stream = zstandard.ZstdCompressor().stream_writer(raw)
+            with io.TextIOWrapper(stream, encoding='utf-8') as f:
+                yield f
+    else:
+        with path.open(mode, encoding='utf-8') as f:
+            yield f
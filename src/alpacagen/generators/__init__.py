@@ -1,6 +1,10 @@
 from .chunk import ChunkGenerator
 from .client import OpenAIClient, AzureClient, HuggingFaceClient
+from .cache import CachedLLMClient
+from .pool import ClientPool, Endpoint, CircuitBreaker
 from .qa import QAGenerator
 from .dataset import QADatasetGenerator
+from .batch import BatchJobRunner, BatchJobStats
+from .scheduler import SlidingWindowScheduler, ThroughputStats
 
-__all__ = ['ChunkGenerator', 'QAGenerator', 'QADatasetGenerator']
\ No newline at end of file
+__all__ = ['ChunkGenerator', 'QAGenerator', 'QADatasetGenerator', 'SlidingWindowScheduler', 'ThroughputStats', 'CachedLLMClient', 'ClientPool', 'Endpoint', 'CircuitBreaker', 'BatchJobRunner', 'BatchJobStats']
\ No newline at end of file
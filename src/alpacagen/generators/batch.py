@@ -0,0 +1,286 @@
+""" offline bulk generation through the provider Batch API (OpenAI / Azure OpenAI) """
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from .client import OpenAIClient, AzureClient, json_schema_format
+from .pool import is_failover_error
+from .qa import QAGenerator, entries_schema
+from ..models.qa_pair import QAPair, Chunk
+from ..instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+@dataclass
+class BatchJobStats:
+    jobs: int = 0
+    requests: int = 0
+    succeeded: int = 0
+    # result lines with an error status, or missing from an expired/failed job
+    failed_requests: int = 0
+    # answers that parsed to no usable entries
+    empty_responses: int = 0
+    retried: int = 0
+    # chunks still without pairs after the last attempt
+    gave_up: int = 0
+    # jobs of an earlier run picked up from the state file
+    reattached: int = 0
+    # status checks that failed and were retried
+    poll_errors: int = 0
+
+class BatchJobRunner:
+    """
+    Generate QA pairs for many chunks with batch jobs instead of interactive requests.
+
+        runner = BatchJobRunner(qa_generator, entries_per_chunk=3, poll_interval=60)
+        results = await runner.run(chunks)   # QA pairs (or None) per chunk, in order
+
+    Jobs hold at most `max_requests_per_job` lines and are submitted together.
+    Failed chunks are retried in new jobs up to `max_attempts` times in total.
+    A status check that fails with a transient error is retried with backoff,
+    up to `max_poll_errors` times in a row.
+    """
+    def __init__(
+        self,
+        qa_generator: QAGenerator,
+        entries_per_chunk: int = 3,
+        poll_interval: float = 30.0,
+        max_attempts: int = 3,
+        max_requests_per_job: int = 50_000,
+        completion_window: str = '24h',
+        max_tokens: int = 1024,
+        state_path: Optional[Union[str, Path]] = None,
+        max_poll_errors: int = 5,
+    ):
+        client = qa_generator.client
+        # the batch endpoints live on the SDK client underneath any wrappers (e.g. the response cache)
+        while not isinstance(client, OpenAIClient) and hasattr(client, 'client'):
+            client = client.client
+        assert isinstance(client, OpenAIClient), "Batch jobs need an OpenAIClient or AzureClient"
+        self.qa_generator = qa_generator
+        self.llm_client = client
+        self.api = client.client
+        self.entries_per_chunk = entries_per_chunk
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_requests_per_job = max_requests_per_job
+        self.completion_window = completion_window
+        self.max_tokens = min(max_tokens, qa_generator.max_output_tokens)
+        self.state_path = Path(state_path) if state_path is not None else None
+        self.max_poll_errors = max_poll_errors
+        self.stats = BatchJobStats()
+
+    @property
+    def endpoint(self) -> str:
+        # Azure batch files address deployments without the version prefix
+        return '/chat/completions' if isinstance(self.llm_client, AzureClient) else '/v1/chat/completions'
+
+    def request_line(self, custom_id: str, chunk: Chunk) -> Dict[str, Any]:
+        body = {
+            'model': self.llm_client.llm_model,
+            'messages': [{'role': 'user', 'content': self.qa_generator.render_prompt(chunk, self.entries_per_chunk)}],
+            'max_tokens': self.max_tokens,
+        }
+        if self.qa_generator.structured_output:
+            body['response_format'] = json_schema_format(entries_schema(self.entries_per_chunk))
+        return {'custom_id': custom_id, 'method': 'POST', 'url': self.endpoint, 'body': body}
+
+    def _request_file(self, pending: Dict[str, Chunk]) -> bytes:
+        return ''.join(
+            json.dumps(self.request_line(custom_id, chunk), ensure_ascii=False) + '\n'
+            for custom_id, chunk in pending.items()
+        ).encode('utf-8')
+
+    @staticmethod
+    def _digest(content: bytes) -> str:
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        """ batch id -> {'custom_ids', 'digest'} of the jobs submitted but not read yet """
+        if self.state_path is None or not self.state_path.exists():
+            return {}
+        return json.loads(self.state_path.read_text(encoding='utf-8'))
+
+    def _save_state(self, jobs: Dict[str, Dict[str, Any]]):
+        if self.state_path is None:
+            return
+        if not jobs:
+            self.state_path.unlink(missing_ok=True)
+            return
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(f'.tmp{os.getpid()}')
+        tmp_path.write_text(json.dumps(jobs), encoding='utf-8')
+        os.replace(tmp_path, self.state_path)
+
+    async def _submit(self, pending: Dict[str, Chunk]):
+        content = self._request_file(pending)
+        request_file = await self.api.files.create(file=('alpacagen-batch.jsonl', content), purpose='batch')
+        batch = await self.api.batches.create(
+            input_file_id=request_file.id,
+            endpoint=self.endpoint,
+            completion_window=self.completion_window,
+        )
+        self.stats.jobs += 1
+        self.stats.requests += len(pending)
+        logger.info(f"Submitted batch {batch.id} with {len(pending)} requests")
+        if self.state_path is not None:
+            jobs = self._load_state()
+            jobs[batch.id] = {'custom_ids': list(pending), 'digest': self._digest(content)}
+            self._save_state(jobs)
+        return batch
+
+    def _reattachable(self, pending: Dict[str, Chunk]) -> List[Tuple[str, Dict[str, Chunk]]]:
+        """ jobs in the state file whose requests are exactly what this run would send """
+        jobs = []
+        for batch_id, job in self._load_state().items():
+            if not all(custom_id in pending for custom_id in job['custom_ids']):
+                continue
+            job_pending = {custom_id: pending[custom_id] for custom_id in job['custom_ids']}
+            if self._digest(self._request_file(job_pending)) != job['digest']:
+                logger.warning(f"Batch {batch_id} was submitted for different chunks or settings, not re-attaching")
+                continue
+            jobs.append((batch_id, job_pending))
+        return jobs
+
+    async def _retrieve(self, batch_id: str):
+        errors = 0
+        while True:
+            try:
+                return await self.api.batches.retrieve(batch_id)
+            except Exception as e:
+                if not is_failover_error(e) or errors >= self.max_poll_errors:
+                    raise
+                delay = min(self.poll_interval * 2 ** errors, 600.0)
+                errors += 1
+                self.stats.poll_errors += 1
+                metrics.count('retries', reason='batch_poll')
+                logger.warning(f"Checking batch {batch_id} failed ({e}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+
+    async def _wait(self, batch):
+        while batch.status not in TERMINAL_STATES:
+            await asyncio.sleep(self.poll_interval)
+            batch = await self._retrieve(batch.id)
+            counts = getattr(batch, 'request_counts', None)
+            if counts is not None:
+                logger.info(f"Batch {batch.id} {batch.status}: {counts.completed}/{counts.total} done, {counts.failed} failed")
+        return batch
+
+    async def _delete_file(self, file_id: Optional[str]):
+        if not file_id:
+            return
+        try:
+            await self.api.files.delete(file_id)
+        except Exception as e:
+            logger.warning(f"Could not delete batch input file {file_id}: {e}")
+
+    async def _read_lines(self, file_id: Optional[str]) -> List[Dict[str, Any]]:
+        if not file_id:
+            return []
+        content = await self.api.files.content(file_id)
+        return [json.loads(line) for line in content.text.splitlines() if line.strip()]
+
+    def _parse_line(self, line: Dict[str, Any], chunk: Chunk) -> List[QAPair]:
+        response = line.get('response') or {}
+        if line.get('error') or response.get('status_code') != 200:
+            self.stats.failed_requests += 1
+            metrics.count('batch_requests', status=response.get('status_code') or 'error')
+            return []
+        try:
+            text = response['body']['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            text = None
+        if not text:
+            # refusals and content filtering answer without text; retried like a failed request
+            self.stats.failed_requests += 1
+            metrics.count('batch_requests', status='no_content')
+            return []
+        metrics.count('batch_requests', status=200)
+        qa_pairs = self.qa_generator.parse_pairs(text, chunk)
+        if self.qa_generator.structured_output:
+            self.qa_generator.parse_stats.structured_responses += 1
+            qa_pairs = qa_pairs[:self.entries_per_chunk]
+        if not qa_pairs:
+            self.stats.empty_responses += 1
+        return qa_pairs
+
+    async def _run_job(self, pending: Dict[str, Chunk], batch_id: Optional[str] = None) -> Dict[str, List[QAPair]]:
+        '''
+        one batch job -> QA pairs of the chunks that got a usable answer, by custom_id
+        batch_id re-attaches to a job submitted by an earlier run instead of submitting one
+        '''
+        with metrics.span('batch_job', requests=len(pending)) as span:
+            if batch_id is None:
+                batch = await self._submit(pending)
+            else:
+                batch = await self._retrieve(batch_id)
+                logger.info(f"Re-attached to batch {batch_id} with {len(pending)} requests")
+            batch = await self._wait(batch)
+            span.set(status=batch.status)
+        await self._delete_file(batch.input_file_id)
+        if batch.status != 'completed':
+            logger.warning(f"Batch {batch.id} ended as {batch.status}, unanswered requests will be retried")
+
+        results: Dict[str, List[QAPair]] = {}
+        answered = 0
+        for line in await self._read_lines(batch.output_file_id) + await self._read_lines(batch.error_file_id):
+            chunk = pending.get(line.get('custom_id'))
+            if chunk is None:
+                continue
+            answered += 1
+            qa_pairs = self._parse_line(line, chunk)
+            if qa_pairs:
+                results[line['custom_id']] = qa_pairs
+        self.stats.failed_requests += len(pending) - answered
+        self.stats.succeeded += len(results)
+        if self.state_path is not None:
+            jobs = self._load_state()
+            jobs.pop(batch.id, None)
+            self._save_state(jobs)
+        return results
+
+    async def run(self, chunks: Sequence[Chunk]) -> List[Optional[List[QAPair]]]:
+        ''' chunks -> QA pairs of each chunk, None for chunks that failed every attempt '''
+        results: List[Optional[List[QAPair]]] = [None] * len(chunks)
+        pending = {f"chunk-{index}": chunk for index, chunk in enumerate(chunks)}
+        # jobs an interrupted run already paid for count as the first attempt of their chunks
+        reattached = self._reattachable(pending)
+        self.stats.reattached = len(reattached)
+        for attempt in range(self.max_attempts):
+            if not pending:
+                break
+            if attempt:
+                logger.info(f"Retrying {len(pending)} failed requests in a new batch (attempt {attempt + 1})")
+                self.stats.retried += len(pending)
+                metrics.count('retries', len(pending), reason='batch')
+            submitted = {custom_id for _, job in reattached for custom_id in job}
+            custom_ids = [custom_id for custom_id in pending if custom_id not in submitted]
+            jobs = [(batch_id, job) for batch_id, job in reattached] + [
+                (None, {custom_id: pending[custom_id] for custom_id in custom_ids[start:start + self.max_requests_per_job]})
+                for start in range(0, len(custom_ids), self.max_requests_per_job)
+            ]
+            reattached = []
+            for job_results in await asyncio.gather(*(self._run_job(job, batch_id) for batch_id, job in jobs)):
+                for custom_id, qa_pairs in job_results.items():
+                    results[int(custom_id.rsplit('-', 1)[1])] = qa_pairs
+                    del pending[custom_id]
+        self.stats.gave_up = len(pending)
+        if pending:
+            logger.warning(f"{len(pending)} chunks got no QA pairs after {self.max_attempts} batch attempts")
+        return results
+
+    async def generate(self, chunks: Sequence[Chunk]) -> List[QAPair]:
+        return [qa_pair for qa_pairs in await self.run(chunks) for qa_pair in qa_pairs or []]
+
+    def log_stats(self):
+        logger.info(
+            f"Batch jobs: {self.stats.jobs} jobs, {self.stats.requests} requests, {self.stats.succeeded} succeeded, "
+            f"{self.stats.failed_requests} failed, {self.stats.empty_responses} empty, {self.stats.retried} retried, "
+            f"{self.stats.gave_up} gave up, {self.stats.reattached} re-attached, {self.stats.poll_errors} poll errors"
+        )
@@ -0,0 +1,109 @@
+import json
+import hashlib
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Union
+from .client import BaseLLMClient
+from ..storage.cache import ResponseCache
+
+class CachedLLMClient(BaseLLMClient):
+    """
+    Wrap any BaseLLMClient with an on-disk response cache.
+    Identical (model, prompt, max_tokens) requests are answered from disk; every other
+    attribute is forwarded to the wrapped client, so it can be used anywhere a client is.
+    """
+    def __init__(
+        self,
+        client: BaseLLMClient,
+        cache: Optional[ResponseCache] = None,
+        cache_dir: Optional[Union[str, Path]] = None,
+        max_bytes: int = 1 << 30,
+        bypass: bool = False,
+    ):
+        assert cache is not None or cache_dir is not None, "Specify cache or cache_dir"
+        self.client = client
+        self.cache = cache if cache is not None else ResponseCache(cache_dir, max_bytes=max_bytes)
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the wrapper itself
+        return getattr(self.__dict__['client'], name)
+
+    @property
+    def llm_model(self) -> str:
+        return getattr(self.client, 'llm_model', type(self.client).__name__)
+
+    @property
+    def supports_structured_output(self) -> bool:
+        return self.client.supports_structured_output
+
+    @property
+    def supports_streaming(self) -> bool:
+        return self.client.supports_streaming
+
+    def cache_key(self, prompt: str, max_tokens: int, schema: Optional[Dict[str, Any]] = None) -> str:
+        digest = hashlib.sha256()
+        parts = [self.llm_model, prompt, str(max_tokens)]
+        if schema is not None:
+            parts.append(json.dumps(schema, sort_keys=True))
+        for part in parts:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    async def _cached(self, key: str, request) -> str:
+        if not self.bypass:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+
+        self.misses += 1
+        response = await request()
+        # bypass skips lookups but still refreshes the cache with the new answer
+        if isinstance(response, str):
+            self.cache.put(key, response)
+        return response
+
+    async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
+        return await self._cached(
+            self.cache_key(prompt, max_tokens),
+            lambda: self.client.get_response(prompt, max_tokens=max_tokens),
+        )
+
+    async def stream_response(self, prompt: str, max_tokens: int = 1024) -> AsyncIterator[str]:
+        key = self.cache_key(prompt, max_tokens)
+        if not self.bypass:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.hits += 1
+                yield cached
+                return
+
+        self.misses += 1
+        pieces = []
+        async for piece in self.client.stream_response(prompt, max_tokens=max_tokens):
+            pieces.append(piece)
+            yield piece
+        # only complete answers are stored here; a stream closed early (cancelled run, failing
+        # writer, or a caller that had enough) is only stored when the caller says so (keep_response)
+        self.cache.put(key, ''.join(pieces))
+
+    async def get_structured_response(self, prompt: str, schema: Dict[str, Any], max_tokens: int = 1024) -> str:
+        return await self._cached(
+            self.cache_key(prompt, max_tokens, schema),
+            lambda: self.client.get_structured_response(prompt, schema, max_tokens=max_tokens),
+        )
+
+    def keep_response(self, prompt: str, max_tokens: int, text: str):
+        # what the caller had when it stopped the stream is also all a replay needs
+        self.cache.put(self.cache_key(prompt, max_tokens), text)
+
+    def discard_response(self, prompt: str, max_tokens: int = 1024, schema: Optional[Dict[str, Any]] = None):
+        # an unparseable answer would otherwise be replayed to every retry and every later run
+        self.cache.delete(self.cache_key(prompt, max_tokens, schema))
+        self.client.discard_response(prompt, max_tokens=max_tokens, schema=schema)
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -1,36 +1,236 @@
-from typing import List, Union
+import time
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterator, Iterator, List, Optional, Tuple, Union
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from tqdm import tqdm
 from ..models.qa_pair import Chunk
 from ..converters.text import TextConverter
 from ..strategies.chunk import ChunkStrategy
+from ..storage.conversion import ConversionCache
+from ..instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+# converter owned by a worker process, set once by the pool initializer
+_worker_converter: Optional[TextConverter] = None
+
+def _init_worker(text_converter: TextConverter):
+    global _worker_converter
+    _worker_converter = text_converter
+
+def _convert_in_worker(file: Path) -> Tuple[str, float]:
+    started = time.perf_counter()
+    text = _worker_converter.convert(file)
+    return text, time.perf_counter() - started
+
+def shard_of(relative_path: str, num_shards: int) -> int:
+    """ stable shard of a file, the same relative path lands in the same shard on every machine """
+    digest = hashlib.blake2b(relative_path.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
 
 class ChunkGenerator:
     def __init__(
             self,
             text_converter: TextConverter,
             chunk_strategy: ChunkStrategy,
+            num_workers: int = 1,
+            file_timeout: Optional[float] = None,
+            conversion_cache: Optional[ConversionCache] = None,
+            shard: Optional[Tuple[int, int]] = None,
     ):
-        self.text_converter = text_converter
-        self.chunk_strategy = chunk_strategy
-    
-    def generate(self, input_path: Union[str, Path]) -> List[Chunk]:
         '''
-        file/dir -> chunks
-        handling both file or directory path
+        a file that fails to convert is logged and skipped instead of aborting the run
+        num_workers > 1 converts files in a process pool, where a file exceeding
+        file_timeout seconds is skipped too
+        conversion_cache skips converting files that are unchanged since they were last seen
+        shard=(index, count) only processes the files whose path hash falls into shard `index`
         '''
-        chunks = []
+        self.text_converter = text_converter
+        self.chunk_strategy = chunk_strategy
+        self.num_workers = num_workers
+        self.file_timeout = file_timeout
+        self.conversion_cache = conversion_cache
+        self.shard = shard
+        self.failed_files: List[Path] = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @staticmethod
+    def list_files(input_path: Union[str, Path]) -> List[Path]:
+        """file/dir -> files, sorted so chunk order is deterministic"""
         input_path = Path(input_path)
+        if input_path.is_file():
+            return [input_path]
+        return sorted(path for path in input_path.glob('**/*') if path.is_file())
+
+    @staticmethod
+    def shard_files(input_path: Union[str, Path], files: List[Path], shard_index: int, num_shards: int) -> List[Path]:
+        """the files of one shard, hashed by their path relative to input_path"""
+        input_path = Path(input_path)
+        root = input_path.parent if input_path.is_file() else input_path
+        return [file for file in files if shard_of(file.relative_to(root).as_posix(), num_shards) == shard_index]
+
+    def _files(self, input_path: Union[str, Path]) -> List[Path]:
+        files = self.list_files(input_path)
+        if self.shard is not None:
+            files = self.shard_files(input_path, files, *self.shard)
+        return files
+
+    def _cached_text(self, file: Path) -> Optional[str]:
+        if self.conversion_cache is None:
+            return None
+        text = self.conversion_cache.get(file, self.text_converter.version)
+        if text is None:
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+        metrics.count('conversion_cache', result='miss' if text is None else 'hit')
+        return text
+
+    def _store_text(self, file: Path, text: Optional[str]):
+        if self.conversion_cache is not None and isinstance(text, str):
+            self.conversion_cache.put(file, self.text_converter.version, text)
 
-        files = [input_path] if input_path.is_file() else [path for path in input_path.glob('**/*') if path.is_file()]
-        
-        for file in tqdm(files, desc="Extract Content"):
-            text = self.text_converter.convert(file)
-            chunks.extend(self.chunk_strategy.split(source=file, text=text))
-        
+    def _convert(self, file: Path) -> str:
+        text = self._cached_text(file)
+        if text is None:
+            started = time.perf_counter()
+            with metrics.span('convert', file=str(file)):
+                text = self.text_converter.convert(file)
+            metrics.observe_file(file, time.perf_counter() - started)
+            self._store_text(file, text)
+        return text
+
+    def _split(self, file: Path, text: str) -> List[Chunk]:
+        with metrics.span('chunk', file=str(file)) as span:
+            chunks = self.chunk_strategy.split(source=file, text=text)
+            span.set(chunks=len(chunks))
+        metrics.count('chunks', len(chunks))
         return chunks
 
+    def chunk_file(self, file: Path) -> List[Chunk]:
+        text = self._convert(file)
+        return self._split(file, text)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            initializer=_init_worker,
+            initargs=(self.text_converter,),
+        )
+
+    @staticmethod
+    def _kill_executor(executor: ProcessPoolExecutor):
+        # a converter stuck on a corrupt file never returns, so its process has to go;
+        # shutdown() cannot stop a running task
+        if hasattr(executor, 'kill_workers'):
+            executor.kill_workers()  # Python 3.14+
+        else:
+            # CPython-specific workaround for older versions: terminate the workers through
+            # the private `_processes` map, before shutdown() drops it
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
 
+    def _iter_texts_parallel(self, files: List[Path]) -> Iterator[Tuple[Path, Optional[str]]]:
+        '''
+        convert files in a process pool, yielding results in input order
+        only a small window of files is submitted ahead to keep memory bounded
+        '''
+        window = self.num_workers * 2
+        executor = self._new_executor()
+        futures = {}
+        try:
+            for position, file in enumerate(files):
+                for ahead in range(position, min(len(files), position + window)):
+                    if ahead not in futures:
+                        cached = self._cached_text(files[ahead])
+                        futures[ahead] = (
+                            cached if cached is not None
+                            else executor.submit(_convert_in_worker, files[ahead])
+                        )
+                item = futures.pop(position)
+                if isinstance(item, str):
+                    # served from the conversion cache
+                    yield file, item
+                    continue
+                try:
+                    text, seconds = item.result(timeout=self.file_timeout)
+                    metrics.observe('convert', seconds)
+                    metrics.observe_file(file, seconds)
+                    self._store_text(file, text)
+                except (FutureTimeoutError, BrokenProcessPool) as e:
+                    if isinstance(e, BrokenProcessPool):
+                        logger.error(f"Worker crashed converting {file}, skipped.")
+                    else:
+                        logger.error(f"Timed out converting {file} after {self.file_timeout}s, skipped.")
+                    # restart the pool and resubmit the files that were queued behind it
+                    self._kill_executor(executor)
+                    executor = self._new_executor()
+                    futures = {ahead: item for ahead, item in futures.items() if isinstance(item, str)}
+                    text = None
+                except Exception as e:
+                    logger.error(f"Error converting {file}, skipped: {e}")
+                    text = None
+                if text is None:
+                    self.failed_files.append(file)
+                    metrics.count('failed_files')
+                yield file, text
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
+    def _iter_file_chunks(self, files: List[Path]) -> Iterator[List[Chunk]]:
+        if self.num_workers <= 1:
+            for file in files:
+                try:
+                    text = self._convert(file)
+                except Exception as e:
+                    logger.error(f"Error converting {file}, skipped: {e}")
+                    self.failed_files.append(file)
+                    metrics.count('failed_files')
+                    yield []
+                    continue
+                yield self._split(file, text)
+            return
+
+        for file, text in self._iter_texts_parallel(files):
+            yield self._split(file, text) if text is not None else []
+
+    def iter_chunks(self, input_path: Union[str, Path]) -> Iterator[Chunk]:
+        '''
+        file/dir -> chunks, one file at a time
+        only the chunks of the file being consumed are kept in memory
+        '''
+        files = self._files(input_path)
+        for chunks in tqdm(self._iter_file_chunks(files), total=len(files), desc="Extract Content"):
+            yield from chunks
+        self._log_cache_stats()
 
+    def _log_cache_stats(self):
+        if self.conversion_cache is not None:
+            logger.info(f"Conversion cache: {self.cache_hits} hits, {self.cache_misses} files converted")
 
+    async def astream(self, input_path: Union[str, Path]) -> AsyncIterator[Chunk]:
+        '''
+        async version of iter_chunks
+        conversion runs in a worker thread so in-flight LLM requests keep going meanwhile
+        '''
+        file_chunks = self._iter_file_chunks(self._files(input_path))
+        try:
+            while (chunks := await asyncio.to_thread(next, file_chunks, None)) is not None:
+                for chunk in chunks:
+                    yield chunk
+            self._log_cache_stats()
+        finally:
+            file_chunks.close()
+
+    def generate(self, input_path: Union[str, Path]) -> List[Chunk]:
+        '''
+        file/dir -> chunks
+        handling both file or directory path
+        '''
+        return list(self.iter_chunks(input_path))
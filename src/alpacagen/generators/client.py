@@ -1,67 +1,355 @@
+import time
 import asyncio
-from typing import Optional, Union, List, Dict
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Union, List, Dict
 from functools import partial
-import transformers
-import torch
-from openai import AsyncOpenAI
+from concurrent.futures import ThreadPoolExecutor
 from abc import ABC, abstractmethod
+from .ratelimit import RateLimiter, is_rate_limit_error, parse_retry_after
+from ..tokenizers import estimate_tokens
+from ..instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+def json_schema_format(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """ `response_format` constraining a chat completion to `schema` """
+    return {"type": "json_schema", "json_schema": {"name": "qa_entries", "schema": schema, "strict": True}}
+
+def pooled_http_client(
+    max_connections: int = 1000,
+    max_keepalive_connections: int = 100,
+    keepalive_expiry: float = 30.0,
+):
+    """
+    httpx client for AsyncOpenAI with explicit connection pool limits
+    one instance can be shared by the clients of several endpoints; idle connections are kept
+    open for keepalive_expiry seconds so back-to-back requests skip the TCP and TLS handshakes
+    """
+    import httpx
+    from openai import DefaultAsyncHttpxClient
+    return DefaultAsyncHttpxClient(limits=httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    ))
 
 class BaseLLMClient(ABC):
     """Abstract base class for LLM clients."""
-    
+
+    # clients that can constrain output to a JSON schema override both of these
+    supports_structured_output: bool = False
+    # clients that can hand out text while it is generated override stream_response
+    supports_streaming: bool = False
+
     @abstractmethod
     async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
         pass
 
+    async def stream_response(self, prompt: str, max_tokens: int = 1024) -> AsyncIterator[str]:
+        """ response text in pieces as it is generated; closing the iterator early cancels the request """
+        yield await self.get_response(prompt, max_tokens=max_tokens)
+
+    async def get_structured_response(self, prompt: str, schema: Dict[str, Any], max_tokens: int = 1024) -> str:
+        """ JSON text guaranteed to match `schema` """
+        raise NotImplementedError(f"{type(self).__name__} does not support structured output")
+
+    def discard_response(self, prompt: str, max_tokens: int = 1024, schema: Optional[Dict[str, Any]] = None):
+        """ the caller could not use the response to this request; asking again must not replay it """
+
+    def keep_response(self, prompt: str, max_tokens: int, text: str):
+        """ the caller closed a stream early because `text` already held everything it needed """
+
+    async def aclose(self):
+        """ release connections, worker threads or models held by the client """
+
 class OpenAIClient(BaseLLMClient):
     """OpenAI-compatible LLM client."""
-    
-    def __init__(self, api_key: str = None, llm_model: str = 'gpt-4o'):
-        self.client = AsyncOpenAI(api_key=api_key)
+
+    def __init__(
+        self,
+        api_key: str = None,
+        llm_model: str = 'gpt-4o',
+        base_url: str = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_rate_limit_retries: int = 6,
+        http_client=None,
+    ):
+        from openai import AsyncOpenAI
+        # 429s are handled below with the shared limiter, so the SDK must not retry them on its own
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
         self.llm_model = llm_model
-    
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.max_rate_limit_retries = max_rate_limit_retries
+
+    supports_structured_output = True
+    supports_streaming = True
+
+    async def _request(self, create: Callable[[], Awaitable[Any]], tokens: int) -> Any:
+        """ run one API call through the rate limiter, backing off and retrying on 429 """
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            async with self.rate_limiter.limit(tokens):
+                metrics.observe('queue', time.perf_counter() - queued)
+                started_at = time.monotonic()
+                try:
+                    with metrics.span('request', model=self.llm_model, attempt=attempt) as span:
+                        raw = await create()
+                        response = raw.parse()
+                        usage = getattr(response, 'usage', None)
+                        if usage is not None:
+                            span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+                            metrics.count('tokens', usage.prompt_tokens, kind='prompt')
+                            metrics.count('tokens', usage.completion_tokens, kind='completion')
+                except Exception as e:
+                    metrics.count('requests', status=getattr(e, 'status_code', None) or 'error')
+                    if not is_rate_limit_error(e):
+                        raise
+                    # the limiter has to back off even when the 429 is handed to a caller (e.g. ClientPool)
+                    retry_after = parse_retry_after(getattr(getattr(e, 'response', None), 'headers', None))
+                    self.rate_limiter.on_rate_limited(retry_after, started_at)
+                    if attempt >= self.max_rate_limit_retries:
+                        raise
+                    metrics.count('retries', reason='rate_limit')
+                else:
+                    metrics.count('requests', status=200)
+                    self.rate_limiter.on_success()
+                    self.rate_limiter.update_from_headers(raw.headers)
+                    return response
+            # back off outside the limiter so the slot is free for others
+            await asyncio.sleep(self.rate_limiter.backoff_delay(attempt, retry_after))
+            attempt += 1
+
     async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
-        response = await self.client.completions.create(
-            model=self.llm_model,
-            prompt=prompt,
-            max_tokens=max_tokens
+        response = await self._request(
+            partial(
+                self.client.completions.with_raw_response.create,
+                model=self.llm_model,
+                prompt=prompt,
+                max_tokens=max_tokens
+            ),
+            tokens=estimate_tokens(prompt) + max_tokens,
         )
         return response.choices[0].text
 
-class AzureClient(BaseLLMClient):
+    async def stream_response(self, prompt: str, max_tokens: int = 1024) -> AsyncIterator[str]:
+        # the limiter slot is held until the response headers arrive, 429s are reported before any token
+        stream = await self._request(
+            partial(
+                self.client.completions.with_raw_response.create,
+                model=self.llm_model,
+                prompt=prompt,
+                max_tokens=max_tokens,
+                stream=True,
+            ),
+            tokens=estimate_tokens(prompt) + max_tokens,
+        )
+        try:
+            async for event in stream:
+                if event.choices and event.choices[0].text:
+                    yield event.choices[0].text
+        finally:
+            # dropping the connection is what makes the provider stop generating (and billing) tokens
+            await stream.close()
+
+    async def get_structured_response(self, prompt: str, schema: Dict[str, Any], max_tokens: int = 1024) -> str:
+        """ chat completion constrained by a JSON schema (structured outputs) """
+        response = await self._request(
+            partial(
+                self.client.chat.completions.with_raw_response.create,
+                model=self.llm_model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                response_format=json_schema_format(schema),
+            ),
+            tokens=estimate_tokens(prompt) + max_tokens,
+        )
+        return response.choices[0].message.content
+
+    async def aclose(self):
+        # also closes the http_client passed in; closing a shared one twice is harmless
+        await self.client.close()
+
+class AzureClient(OpenAIClient):
     """Azure OpenAI-compatible LLM client."""
-    
-    def __init__(self, api_key: str = None, base_url: str = None, llm_model: str = 'azure-gpt-4o'):
-        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-        self.llm_model = llm_model
-    
-    async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
-        response = await self.client.completions.create(
-            model=self.llm_model,
-            prompt=prompt,
-            max_tokens=max_tokens
+
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        llm_model: str = 'azure-gpt-4o',
+        rate_limiter: Optional[RateLimiter] = None,
+        max_rate_limit_retries: int = 6,
+        http_client=None,
+    ):
+        super().__init__(
+            api_key=api_key,
+            llm_model=llm_model,
+            base_url=base_url,
+            rate_limiter=rate_limiter,
+            max_rate_limit_retries=max_rate_limit_retries,
+            http_client=http_client,
         )
-        return response.choices[0].text
+
+@dataclass
+class BatchStats:
+    """Counters of the HuggingFace micro-batching engine."""
+    batches: int = 0
+    requests: int = 0
+    wait_seconds: float = 0.0
+    generation_seconds: float = 0.0
+    generated_tokens: int = 0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.requests / self.batches if self.batches else 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.wait_seconds / self.requests if self.requests else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.generated_tokens / self.generation_seconds if self.generation_seconds else 0.0
 
 class HuggingFaceClient(BaseLLMClient):
-    """HuggingFace Transformers LLM client."""
-    
-    def __init__(self, llm_model: str):
-        self.pipeline = transformers.pipeline(
+    """
+    HuggingFace Transformers LLM client.
+
+    Concurrent prompts are micro-batched: requests arriving within `max_wait_ms`
+    (up to `max_batch_size`) run as one padded batched generate call on a
+    dedicated worker thread instead of one forward pass per prompt.
+    """
+
+    def __init__(
+        self,
+        llm_model: str,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20,
+        pipeline=None,
+    ):
+        self.llm_model = llm_model
+        self.pipeline = pipeline if pipeline is not None else self._load_pipeline(llm_model)
+        tokenizer = getattr(self.pipeline, 'tokenizer', None)
+        if tokenizer is not None:
+            # decoder-only models need left padding and a pad token to generate in batches
+            tokenizer.padding_side = 'left'
+            if tokenizer.pad_token_id is None:
+                tokenizer.pad_token_id = tokenizer.eos_token_id
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = BatchStats()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hf-generate')
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @staticmethod
+    def _load_pipeline(llm_model: str):
+        # torch and transformers take seconds to import, so only the HuggingFace path pays for them
+        import torch
+        import transformers
+        return transformers.pipeline(
             "text-generation",
             model=llm_model,
             model_kwargs={"torch_dtype": torch.bfloat16},
             device_map="auto",
         )
-    
+
+    def _ensure_batch_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._batch_task is None or self._batch_task.done():
+            # queues and tasks are bound to one event loop, start fresh ones per loop
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._batch_task = loop.create_task(self._batch_loop())
+
     async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
-        # Run pipeline in a thread pool since it's synchronous
-        loop = asyncio.get_event_loop()
-        message = [{"role": "user", "content": prompt}]
-        
-        outputs = await loop.run_in_executor(
-            None,
-            partial(self.pipeline, message, max_tokens=max_tokens)
-        )
-        
-        return outputs[0]["generated_text"][-1]
\ No newline at end of file
+        self._ensure_batch_loop()
+        future = self._loop.create_future()
+        await self._queue.put((prompt, max_tokens, future, time.perf_counter()))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # generation length is a per-call argument, so group by max_tokens
+            groups: Dict[int, list] = {}
+            for request in batch:
+                groups.setdefault(request[1], []).append(request)
+            for max_tokens, requests in groups.items():
+                await self._run_batch(requests, max_tokens)
+
+    async def _run_batch(self, requests: list, max_tokens: int):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        messages = [[{"role": "user", "content": prompt}] for prompt, *_ in requests]
+        try:
+            with metrics.span('request', model=self.llm_model, batch_size=len(messages)):
+                outputs = await loop.run_in_executor(
+                    self._executor,
+                    partial(self.pipeline, messages, max_new_tokens=max_tokens, batch_size=len(messages))
+                )
+
+            elapsed = time.perf_counter() - started
+            self.stats.batches += 1
+            self.stats.requests += len(requests)
+            self.stats.generation_seconds += elapsed
+            for (_, _, future, enqueued_at), output in zip(requests, outputs):
+                self.stats.wait_seconds += started - enqueued_at
+                metrics.observe('queue', started - enqueued_at)
+                try:
+                    text = self._extract_text(output)
+                    generated_tokens = self._count_tokens(text)
+                except Exception as e:
+                    # a malformed output only fails its own request
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                self.stats.generated_tokens += generated_tokens
+                metrics.count('tokens', generated_tokens, kind='completion')
+                if not future.done():
+                    future.set_result(text)
+        except Exception as e:
+            for *_, future, _ in requests:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # whatever happened, no caller may be left waiting on the batch loop (e.g. fewer outputs than prompts)
+            for *_, future, _ in requests:
+                if not future.done():
+                    future.set_exception(RuntimeError(f"{self.llm_model} returned no output for this prompt"))
+
+    async def aclose(self):
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+            self._batch_task = None
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _extract_text(output) -> str:
+        if isinstance(output, list):
+            output = output[0]
+        generated = output["generated_text"]
+        if isinstance(generated, list):
+            # chat input returns the conversation with the new assistant message last
+            generated = generated[-1]["content"]
+        return generated
+
+    def _count_tokens(self, text: str) -> int:
+        tokenizer = getattr(self.pipeline, 'tokenizer', None)
+        if tokenizer is None:
+            return estimate_tokens(text)
+        return len(tokenizer(text, add_special_tokens=False)["input_ids"])
@@ -1,40 +1,171 @@
-import asyncio
-from typing import List
-from tqdm.asyncio import tqdm_asyncio
+from functools import partial
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, List, Optional, Tuple, Union
 from ..models.qa_pair import QAPair, Chunk
 from .qa import QAGenerator
+from .scheduler import SlidingWindowScheduler, ThroughputStats
+from ..storage.journal import ProgressJournal
+from ..tokenizers import Tokenizer, HeuristicTokenizer
+from ..instrumentation import metrics
 
 class QADatasetGenerator:
     def __init__(
         self,
         qa_generator: QAGenerator,
-        entries_per_chunk: int = 3
+        entries_per_chunk: int = 3,
+        max_concurrency: int = 20,
+        journal: Optional[ProgressJournal] = None,
+        pack_tokens: Optional[int] = None,
+        max_pack_size: int = 8,
+        tokenizer: Optional[Tokenizer] = None,
     ):
+        '''
+        pack_tokens groups consecutive small chunks into one request of up to that many
+        content tokens (at most max_pack_size chunks), so the prompt template is paid once per pack;
+        packs also stay small enough for all their entries to fit the model's max_output_tokens
+        '''
         self.qa_generator = qa_generator
         self.entries_per_chunk = entries_per_chunk
+        self.max_concurrency = max_concurrency
+        self.journal = journal
+        self.pack_tokens = pack_tokens
+        self.max_pack_size = max_pack_size
+        self.tokenizer = tokenizer if tokenizer is not None else HeuristicTokenizer()
+        self.stats: Optional[ThroughputStats] = None
+
+    def _journal_key(self, chunk: Chunk) -> str:
+        return ProgressJournal.chunk_key(
+            chunk,
+            self.qa_generator.prompt_template,
+            self.qa_generator.llm_model,
+            self.entries_per_chunk,
+        )
+
+    def _recorded(self, chunk: Chunk) -> Optional[List[QAPair]]:
+        if self.journal is None:
+            return None
+        recorded = self.journal.get(self._journal_key(chunk))
+        if recorded is None:
+            return None
+        return [QAPair(**entry, source=chunk) for entry in recorded]
+
+    def _record(self, chunk: Chunk, qa_pairs: Optional[List[QAPair]]):
+        # chunks that ran out of retries are left out so a restart tries them again
+        if self.journal is None or not qa_pairs:
+            return
+        self.journal.record(self._journal_key(chunk), chunk, [
+            {'instruction': qa_pair.instruction, 'input': qa_pair.input, 'output': qa_pair.output}
+            for qa_pair in qa_pairs
+        ])
+
+    async def _generate_chunk(
+        self,
+        chunk: Chunk,
+        on_pair: Optional[Callable[[QAPair], None]] = None,
+    ) -> Optional[List[QAPair]]:
+        recorded = self._recorded(chunk)
+        if recorded is not None:
+            if on_pair is not None:
+                for qa_pair in recorded:
+                    on_pair(qa_pair)
+            return recorded
+
+        with metrics.span('generate', source=chunk.source, idx=chunk.idx) as span:
+            qa_pairs = await self.qa_generator.generate(chunk, self.entries_per_chunk, on_pair=on_pair)
+            span.set(qa_pairs=len(qa_pairs or []))
+        metrics.count('qa_pairs', len(qa_pairs or []))
+        self._record(chunk, qa_pairs)
+        return qa_pairs
+
+    async def _generate_pack(
+        self,
+        pack: List[Tuple[int, Chunk]],
+        on_pair: Optional[Callable[[QAPair], None]] = None,
+    ) -> List[Optional[List[QAPair]]]:
+        results = [self._recorded(chunk) for _, chunk in pack]
+        pending = [position for position, recorded in enumerate(results) if recorded is None]
+        if pending:
+            with metrics.span('generate', chunks=len(pending)) as span:
+                generated = await self.qa_generator.generate_packed(
+                    [pack[position][1] for position in pending],
+                    self.entries_per_chunk,
+                )
+                span.set(qa_pairs=sum(len(qa_pairs or []) for qa_pairs in generated))
+            for position, qa_pairs in zip(pending, generated):
+                metrics.count('qa_pairs', len(qa_pairs or []))
+                self._record(pack[position][1], qa_pairs)
+                results[position] = qa_pairs
+        if on_pair is not None:
+            for qa_pairs in results:
+                for qa_pair in qa_pairs or []:
+                    on_pair(qa_pair)
+        return results
+
+    async def _packs(
+        self,
+        chunks: Union[Iterable[Chunk], AsyncIterable[Chunk]],
+    ) -> AsyncIterator[List[Tuple[int, Chunk]]]:
+        ''' consecutive chunks -> packs of (chunk index, chunk) within the token budget '''
+        pack: List[Tuple[int, Chunk]] = []
+        pack_tokens = 0
+        max_pack_size = min(self.max_pack_size, self.qa_generator.max_pack_chunks(self.entries_per_chunk))
+
+        async def indexed():
+            if hasattr(chunks, '__aiter__'):
+                index = 0
+                async for chunk in chunks:
+                    yield index, chunk
+                    index += 1
+            else:
+                for item in enumerate(chunks):
+                    yield item
+
+        async for index, chunk in indexed():
+            tokens = self.tokenizer.count(chunk.content)
+            if pack and (pack_tokens + tokens > self.pack_tokens or len(pack) >= max_pack_size):
+                yield pack
+                pack, pack_tokens = [], 0
+            pack.append((index, chunk))
+            pack_tokens += tokens
+        if pack:
+            yield pack
+
+    async def stream(
+        self,
+        chunks: Union[Iterable[Chunk], AsyncIterable[Chunk]],
+        total: Optional[int] = None,
+        on_pair: Optional[Callable[[QAPair], None]] = None,
+    ) -> AsyncIterator[Tuple[int, Chunk, List[QAPair]]]:
+        '''
+        chunks -> (chunk index, chunk, qa pairs) as soon as each chunk finishes
+        chunks are pulled lazily, so a generator input keeps memory bounded by max_concurrency
+        on_pair additionally receives every pair as soon as it is parsed, before its chunk finishes
+        '''
+        scheduler = SlidingWindowScheduler(
+            max_concurrency=self.max_concurrency,
+            desc="Generate QA",
+        )
+        self.stats = scheduler.stats
+        try:
+            if self.pack_tokens is None:
+                async for index, chunk, qa_pairs in scheduler.run(partial(self._generate_chunk, on_pair=on_pair), chunks, total=total):
+                    self.stats = scheduler.stats
+                    yield index, chunk, [qa_pair for qa_pair in qa_pairs or [] if qa_pair]
+                return
+
+            # progress and throughput are counted per pack (one request each)
+            async for _, pack, results in scheduler.run(partial(self._generate_pack, on_pair=on_pair), self._packs(chunks)):
+                self.stats = scheduler.stats
+                for (index, chunk), qa_pairs in zip(pack, results or [None] * len(pack)):
+                    yield index, chunk, [qa_pair for qa_pair in qa_pairs or [] if qa_pair]
+        finally:
+            self.stats = scheduler.stats
 
     async def generate(self, chunks: List[Chunk]) -> List[QAPair]:
-        BATCH_SIZE = 20
-        tasks = []
-        dataset = []
-        for chunk in chunks:
-            # tasks.extend([self.qa_generator.generate(chunk) for _ in range(self.entries_per_chunk)])
-            tasks.append(self.qa_generator.generate(chunk, self.entries_per_chunk))
-
-        itrs = (len(tasks) // BATCH_SIZE) + (len(tasks) % BATCH_SIZE != 0)
-        print(f"Total QAPairs: {len(tasks)*self.entries_per_chunk}")
-        
-        for n, ith in enumerate(range(0, len(tasks), BATCH_SIZE)):
-            batch_tasks = tasks[ith: ith+BATCH_SIZE]
-            batch_dataset: List[List[QAPair]] = await tqdm_asyncio.gather(
-                *batch_tasks, 
-                desc=f"Generate QA(Batch{n+1}/{itrs})"
-            )
-            # flatten datset to make final dataset a list of QAPair
-            if batch_dataset:
-                for sublist in batch_dataset:
-                    dataset.extend([qa_pair for qa_pair in sublist if qa_pair])
-            await asyncio.sleep(0.5)
-        
-
-        return dataset
\ No newline at end of file
+        print(f"Total QAPairs: {len(chunks)*self.entries_per_chunk}")
+
+        results: List[List[QAPair]] = [[] for _ in chunks]
+        async for index, _, qa_pairs in self.stream(chunks):
+            results[index] = qa_pairs
+
+        # flatten in chunk order to make final dataset a list of QAPair
+        return [qa_pair for sublist in results for qa_pair in sublist]
@@ -0,0 +1,209 @@
+import re
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+
+def _loads(candidate: str) -> Any:
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError as e:
+        # models often mimic trailing commas from the prompt examples; only worth a second
+        # pass over the text when the first one stopped right after a comma
+        before = e.pos - 1
+        while before >= 0 and candidate[before] in ' \t\r\n':
+            before -= 1
+        if before < 0 or candidate[before] != ',':
+            raise
+        return json.loads(_TRAILING_COMMA.sub(r'\1', candidate))
+
+def iter_entries(obj: Any) -> Iterator[Dict[str, Any]]:
+    """ QA-shaped dicts in a parsed value, also when wrapped, e.g. {"entries": [...]} """
+    if isinstance(obj, dict):
+        if 'instruction' in obj:
+            yield obj
+            return
+        for value in obj.values():
+            yield from iter_entries(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            yield from iter_entries(value)
+
+class JsonObjectExtractor:
+    """
+    Incremental extractor of top-level JSON objects from free-form model output.
+
+    Braces are matched in a single pass (string-aware once inside an object), so prose,
+    code fences, JSON arrays, pretty-printing and trailing text around the objects do not
+    matter. Text can be fed piece by piece as it streams in; each completed object is
+    returned from the `feed` call that closes it. The spans of objects nested in the current
+    one are remembered, so when it does not parse (or never closes) the valid objects inside
+    it still come out, and scanning resumes after it instead of rescanning its text.
+    """
+    def __init__(self):
+        self.buffer = ''
+        self.position = 0
+        self.failures = 0
+        self._reset()
+
+    def _reset(self):
+        # offsets of the braces still open, outermost first
+        self.opens: List[int] = []
+        # (start, end) of the objects closed inside the current top-level one
+        self.nested: List[Tuple[int, int]] = []
+        self.in_string = False
+        self.escape = False
+
+    @property
+    def depth(self) -> int:
+        return len(self.opens)
+
+    def _recover(self, buffer: str) -> List[Any]:
+        """ the outermost nested objects that parse; one that fails is searched through its own children """
+        objects = []
+        covered = -1
+        # sorted by start, an object comes right before the objects nested in it
+        for start, end in sorted(self.nested):
+            if start < covered:
+                continue
+            try:
+                objects.append(_loads(buffer[start:end + 1]))
+                covered = end
+            except json.JSONDecodeError:
+                self.failures += 1
+        return objects
+
+    def feed(self, text: str) -> List[Any]:
+        self.buffer += text
+        objects = []
+        buffer = self.buffer
+        opens = self.opens
+        i = self.position
+        while i < len(buffer):
+            ch = buffer[i]
+            if not opens:
+                # outside of objects only an opening brace matters; skip ahead to it
+                next_open = buffer.find('{', i)
+                if next_open == -1:
+                    i = len(buffer)
+                    break
+                opens.append(next_open)
+                i = next_open + 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == '{':
+                opens.append(i)
+            elif ch == '}':
+                start = opens.pop()
+                if opens:
+                    self.nested.append((start, i))
+                else:
+                    try:
+                        objects.append(_loads(buffer[start:i + 1]))
+                    except json.JSONDecodeError:
+                        self.failures += 1
+                        objects.extend(self._recover(buffer))
+                    self._reset()
+                    opens = self.opens
+                    # completed text is never looked at again
+                    buffer = buffer[i + 1:]
+                    i = 0
+                    continue
+            i += 1
+
+        self.buffer = buffer
+        if not opens:
+            self.buffer, self.position = '', 0
+        else:
+            self.position = i
+        return objects
+
+    def close(self) -> List[Any]:
+        """ end of input: an object left open may hide complete ones inside it """
+        objects = []
+        if self.opens:
+            self.failures += 1
+            objects = self._recover(self.buffer)
+        self.buffer, self.position = '', 0
+        self._reset()
+        return objects
+
+def extract_json_objects(text: str) -> List[Any]:
+    extractor = JsonObjectExtractor()
+    return extractor.feed(text) + extractor.close()
+
+@dataclass
+class ParseStats:
+    """ how well QA entries were recovered from model responses """
+    responses: int = 0
+    objects_recovered: int = 0
+    valid_entries: int = 0
+    invalid_entries: int = 0
+    empty_responses: int = 0
+    parse_retries: int = 0
+    # structured-output mode: schema-constrained responses
+    structured_responses: int = 0
+    # chunks by the path of their first request, how many of those parsed right away,
+    # and the parse retries spent on each path
+    structured_first_tries: int = 0
+    structured_first_try_parsed: int = 0
+    structured_parse_retries: int = 0
+    text_first_tries: int = 0
+    text_first_try_parsed: int = 0
+    text_parse_retries: int = 0
+
+    @property
+    def recovery_rate(self) -> float:
+        """ share of responses that produced at least one valid entry """
+        return 1 - self.empty_responses / self.responses if self.responses else 0.0
+
+    def record_attempt(self, structured: bool, parsed: bool, first: bool):
+        prefix = 'structured' if structured else 'text'
+        if first:
+            setattr(self, f'{prefix}_first_tries', getattr(self, f'{prefix}_first_tries') + 1)
+            if parsed:
+                setattr(self, f'{prefix}_first_try_parsed', getattr(self, f'{prefix}_first_try_parsed') + 1)
+        if not parsed:
+            setattr(self, f'{prefix}_parse_retries', getattr(self, f'{prefix}_parse_retries') + 1)
+
+    def first_try_rate(self, structured: bool) -> float:
+        """ share of chunks on a path whose first response parsed """
+        if structured:
+            return self.structured_first_try_parsed / self.structured_first_tries if self.structured_first_tries else 0.0
+        return self.text_first_try_parsed / self.text_first_tries if self.text_first_tries else 0.0
+
+    @property
+    def retries_avoided(self) -> Optional[float]:
+        """ parse retries the structured chunks would have needed at the text path's retry rate """
+        if not self.structured_first_tries or not self.text_first_tries:
+            return None
+        text_rate = self.text_parse_retries / self.text_first_tries
+        return self.structured_first_tries * text_rate - self.structured_parse_retries
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'responses': self.responses,
+            'objects_recovered': self.objects_recovered,
+            'valid_entries': self.valid_entries,
+            'invalid_entries': self.invalid_entries,
+            'empty_responses': self.empty_responses,
+            'parse_retries': self.parse_retries,
+            'structured_responses': self.structured_responses,
+            'structured_first_tries': self.structured_first_tries,
+            'structured_first_try_parsed': self.structured_first_try_parsed,
+            'structured_parse_retries': self.structured_parse_retries,
+            'text_first_tries': self.text_first_tries,
+            'text_first_try_parsed': self.text_first_try_parsed,
+            'text_parse_retries': self.text_parse_retries,
+            'recovery_rate': self.recovery_rate,
+            'retries_avoided': self.retries_avoided,
+        }
@@ -0,0 +1,257 @@
+import time
+import random
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Union
+from .client import BaseLLMClient
+from .ratelimit import is_rate_limit_error
+from ..instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+ROUTING = ['least_outstanding', 'weighted', 'latency']
+
+def is_failover_error(error: BaseException) -> bool:
+    """ errors another endpoint may not have: 429, 5xx, timeouts and connection failures """
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        return not isinstance(error, (NotImplementedError, ValueError, TypeError))
+    return status_code == 429 or status_code >= 500
+
+class CircuitBreaker:
+    """
+    Closed until `failure_threshold` consecutive failures, then open for `recovery_time`
+    seconds. After that one trial request is let through (half-open): success closes
+    the breaker again, failure re-opens it.
+    """
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.recovery_time:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        state = self.state
+        return state == 'closed' or (state == 'half_open' and not self.trial_in_flight)
+
+    def on_request(self):
+        if self.state == 'half_open':
+            self.trial_in_flight = True
+
+    def on_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def on_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+@dataclass(eq=False)
+class Endpoint:
+    """ one deployment in a ClientPool, with its routing weight, breaker and stats """
+    client: BaseLLMClient
+    weight: float = 1.0
+    name: Optional[str] = None
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    outstanding: int = 0
+    requests: int = 0
+    successes: int = 0
+    failures: int = 0
+    rate_limited: int = 0
+    latency_ewma: Optional[float] = None
+    current_weight: float = 0.0  # smooth weighted round-robin state
+
+    def observe_latency(self, seconds: float, alpha: float = 0.2):
+        self.latency_ewma = seconds if self.latency_ewma is None else (1 - alpha) * self.latency_ewma + alpha * seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'weight': self.weight,
+            'state': self.breaker.state,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'rate_limited': self.rate_limited,
+            'latency_ewma': self.latency_ewma,
+        }
+
+class ClientPool(BaseLLMClient):
+    """
+    LLM client spreading requests over several endpoints (deployments, regions, keys).
+
+    routing:
+      - 'least_outstanding': fewest in-flight requests relative to weight
+      - 'weighted': smooth weighted round-robin
+      - 'latency': lowest EWMA latency scaled by in-flight requests
+    A request that fails with a 429, 5xx or connection error is retried on another
+    endpoint; endpoints failing repeatedly are taken out of rotation by their circuit breaker.
+    When every endpoint answered 429, the request waits until the first endpoint's limiter
+    lets requests through again (Retry-After) and tries again, up to `max_rate_limit_waits` times.
+    """
+    def __init__(
+        self,
+        endpoints: Sequence[Union[BaseLLMClient, Endpoint]],
+        routing: str = 'least_outstanding',
+        failure_threshold: int = 5,
+        recovery_time: float = 30.0,
+        max_rate_limit_waits: int = 6,
+    ):
+        assert endpoints, "ClientPool needs at least one endpoint"
+        assert routing in ROUTING, f"routing should be one of {ROUTING}"
+        self.endpoints: List[Endpoint] = [
+            endpoint if isinstance(endpoint, Endpoint) else Endpoint(client=endpoint)
+            for endpoint in endpoints
+        ]
+        for n, endpoint in enumerate(self.endpoints):
+            endpoint.name = endpoint.name or f"{getattr(endpoint.client, 'llm_model', 'endpoint')}-{n}"
+            endpoint.breaker.failure_threshold = failure_threshold
+            endpoint.breaker.recovery_time = recovery_time
+        self.routing = routing
+        self.max_rate_limit_waits = max_rate_limit_waits
+        self.llm_model = getattr(self.endpoints[0].client, 'llm_model', None)
+        self.failovers = 0
+
+    @property
+    def supports_structured_output(self) -> bool:
+        return all(endpoint.client.supports_structured_output for endpoint in self.endpoints)
+
+    @property
+    def supports_streaming(self) -> bool:
+        return all(getattr(endpoint.client, 'supports_streaming', False) for endpoint in self.endpoints)
+
+    def _select(self, tried: List[Endpoint]) -> Optional[Endpoint]:
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in tried and endpoint.breaker.allow()]
+        if not candidates:
+            return None
+        if self.routing == 'weighted':
+            total = sum(endpoint.weight for endpoint in candidates)
+            for endpoint in candidates:
+                endpoint.current_weight += endpoint.weight
+            chosen = max(candidates, key=lambda endpoint: endpoint.current_weight)
+            chosen.current_weight -= total
+            return chosen
+        if self.routing == 'latency':
+            # endpoints without samples yet score 0 so every endpoint gets measured
+            return min(candidates, key=lambda endpoint: (
+                (endpoint.latency_ewma or 0.0) * (endpoint.outstanding + 1) / endpoint.weight,
+                endpoint.outstanding,
+            ))
+        return min(candidates, key=lambda endpoint: (endpoint.outstanding / endpoint.weight, endpoint.requests))
+
+    async def _call(self, request: Callable[[BaseLLMClient], Awaitable[str]]) -> str:
+        attempt = 0
+        while True:
+            tried: List[Endpoint] = []
+            errors: List[BaseException] = []
+            while (endpoint := self._select(tried)) is not None:
+                tried.append(endpoint)
+                endpoint.breaker.on_request()
+                endpoint.outstanding += 1
+                endpoint.requests += 1
+                started = time.perf_counter()
+                try:
+                    response = await request(endpoint.client)
+                except Exception as e:
+                    if not is_failover_error(e):
+                        # the request itself is bad, another endpoint would reject it too
+                        endpoint.breaker.on_success()
+                        raise
+                    errors.append(e)
+                    if is_rate_limit_error(e):
+                        # saturated rather than broken: skip it for this request only
+                        endpoint.rate_limited += 1
+                        endpoint.breaker.trial_in_flight = False
+                    else:
+                        endpoint.failures += 1
+                        endpoint.breaker.on_failure()
+                    self.failovers += 1
+                    metrics.count('failovers', endpoint=endpoint.name, reason='rate_limit' if is_rate_limit_error(e) else 'error')
+                    logger.warning(f"Endpoint {endpoint.name} failed ({e}), trying another endpoint.")
+                else:
+                    endpoint.successes += 1
+                    endpoint.observe_latency(time.perf_counter() - started)
+                    endpoint.breaker.on_success()
+                    return response
+                finally:
+                    endpoint.outstanding -= 1
+            if errors and all(is_rate_limit_error(e) for e in errors) and attempt < self.max_rate_limit_waits:
+                delay = self._saturation_delay(attempt)
+                metrics.count('retries', reason='rate_limit')
+                logger.warning(f"All endpoints are rate limited, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if errors:
+                raise errors[-1]
+            raise RuntimeError("No healthy endpoint available, all circuit breakers are open")
+
+    def _saturation_delay(self, attempt: int) -> float:
+        """ until the first endpoint limiter opens again, or jittered backoff when none reports a wait """
+        waits = [
+            endpoint.client.rate_limiter.wait_time()
+            for endpoint in self.endpoints
+            if getattr(endpoint.client, 'rate_limiter', None) is not None
+        ]
+        delay = min(waits, default=0.0)
+        if delay > 0:
+            return delay
+        return random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+
+    async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
+        return await self._call(lambda client: client.get_response(prompt=prompt, max_tokens=max_tokens))
+
+    async def get_structured_response(self, prompt: str, schema: Dict[str, Any], max_tokens: int = 1024) -> str:
+        return await self._call(
+            lambda client: client.get_structured_response(prompt=prompt, schema=schema, max_tokens=max_tokens)
+        )
+
+    async def stream_response(self, prompt: str, max_tokens: int = 1024) -> AsyncIterator[str]:
+        """ failover happens until the first piece arrives; once text was handed out, errors propagate """
+        async def open_stream(client: BaseLLMClient):
+            stream = client.stream_response(prompt=prompt, max_tokens=max_tokens)
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        stream, first = await self._call(open_stream)
+        try:
+            if first is not None:
+                yield first
+                async for piece in stream:
+                    yield piece
+        finally:
+            await stream.aclose()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [endpoint.to_dict() for endpoint in self.endpoints]
+
+    async def aclose(self):
+        for endpoint in self.endpoints:
+            await endpoint.client.aclose()
+
+    def log_stats(self):
+        for endpoint in self.endpoints:
+            latency = f"{endpoint.latency_ewma * 1000:.0f}ms" if endpoint.latency_ewma is not None else "-"
+            logger.info(
+                f"Endpoint {endpoint.name} ({endpoint.breaker.state}): {endpoint.successes}/{endpoint.requests} ok, "
+                f"{endpoint.failures} failed, {endpoint.rate_limited} rate limited, latency {latency}"
+            )
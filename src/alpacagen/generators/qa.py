@@ -1,70 +1,432 @@
-import json
+import time
+import random
+import asyncio
 import logging
-from typing import Optional, List
-from openai import AsyncOpenAI
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, List, Sequence, Tuple
 from ..models.qa_pair import QAPair, Chunk
 from ..generators.client import BaseLLMClient
+from ..generators.ratelimit import is_rate_limit_error
+from ..generators.parsing import ParseStats, JsonObjectExtractor, extract_json_objects, iter_entries
+from ..tokenizers import estimate_tokens
+from ..instrumentation import metrics
 logger = logging.getLogger(__name__)
 
+class _OnPairError(Exception):
+    """ an error raised by on_pair (e.g. the writer), passed on to the caller instead of retried """
+    def __init__(self, error: Exception):
+        super().__init__(str(error))
+        self.error = error
+
+def _hand_over(on_pair: Callable[[QAPair], None], qa_pair: QAPair):
+    try:
+        on_pair(qa_pair)
+    except Exception as e:
+        raise _OnPairError(e) from e
+
+PACK_INSTRUCTION = (
+    "\n\nThe material above consists of {num_chunks} separate passages, each starting with a "
+    "[passage N] marker. Treat every passage independently: generate {entries_per_chunk} entries "
+    "for each passage, and add a \"chunk_id\" field holding the passage number N to every entry."
+)
+
+def entries_schema(entries_per_chunk: int, with_chunk_id: bool = False) -> Dict[str, Any]:
+    """ JSON schema for structured output: an object holding the QA entries """
+    entry_properties = {
+        "instruction": {"type": "string"},
+        "input": {"type": "string"},
+        "output": {"type": "string"},
+    }
+    if with_chunk_id:
+        entry_properties["chunk_id"] = {"type": "integer"}
+    return {
+        "type": "object",
+        "properties": {
+            "entries": {
+                "type": "array",
+                "description": f"Exactly {entries_per_chunk} entries" + (" per passage" if with_chunk_id else ""),
+                "items": {
+                    "type": "object",
+                    "properties": entry_properties,
+                    "required": list(entry_properties),
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["entries"],
+        "additionalProperties": False,
+    }
+
+_RESPONSE_FORMAT_HINTS = ('response_format', 'json_schema', 'structured output')
+
+def _is_bad_request(error: BaseException) -> bool:
+    return getattr(error, 'status_code', None) in (400, 404, 422)
+
+def _is_unsupported_error(error: BaseException) -> bool:
+    """ a rejection of response_format itself, as opposed to e.g. a too long prompt or a content filter """
+    message = str(getattr(error, 'body', None) or error).lower()
+    return _is_bad_request(error) and any(hint in message for hint in _RESPONSE_FORMAT_HINTS)
+
+@dataclass
+class PackStats:
+    """ how multi-chunk packing paid off """
+    requests: int = 0
+    chunks: int = 0
+    # chunks that got nothing back from their pack and were generated on their own
+    fallbacks: int = 0
+
+    @property
+    def requests_saved(self) -> int:
+        return self.chunks - self.requests - self.fallbacks
+
+@dataclass
+class StreamStats:
+    """ what streaming with early termination saved """
+    streams: int = 0
+    early_stops: int = 0
+    streamed_tokens: int = 0
+    # max_tokens budget left unused by streams cut short, an upper bound on output tokens saved
+    tokens_saved: int = 0
+    first_pairs: int = 0
+    first_pair_seconds: float = 0.0
+
+    @property
+    def mean_time_to_first_pair(self) -> float:
+        return self.first_pair_seconds / self.first_pairs if self.first_pairs else 0.0
+
 class QAGenerator:
-    def __init__(self, client: BaseLLMClient, llm_model: str, prompt_template: str) -> List[QAPair]:
+    def __init__(
+        self,
+        client: BaseLLMClient,
+        llm_model: str,
+        prompt_template: str,
+        structured_output: bool = False,
+        stream_responses: bool = False,
+        max_output_tokens: int = 4096,
+    ) -> List[QAPair]:
         self.client = client
         self.llm_model = llm_model
         self.prompt_template = prompt_template
         self.max_retry_time = 3
+        # the model's output limit; no request asks for more than this
+        self.max_output_tokens = max_output_tokens
+        self.max_tokens = min(1024, max_output_tokens)
+        # output budget per entry of a packed request
+        self.tokens_per_entry = 256
+        self.parse_stats = ParseStats()
+        self.pack_stats = PackStats()
+        self.stream_stats = StreamStats()
+        # opt-in; silently stays on the text path for clients that cannot do it
+        self.structured_output = structured_output and client.supports_structured_output
+        # a schema-constrained answer is one object that only closes at the end, so nothing to stream there
+        self.stream_responses = stream_responses and getattr(client, 'supports_streaming', False)
     '''
     Chunk -> List[QAPair]
     '''
-    async def generate(self, chunk: Chunk, entries_per_chunk, retry_time=0) -> Optional[List[QAPair]]:
+    async def generate(
+        self,
+        chunk: Chunk,
+        entries_per_chunk,
+        retry_time=0,
+        on_pair: Optional[Callable[[QAPair], None]] = None,
+    ) -> Optional[List[QAPair]]:
+        '''
+        on_pair is called once for every returned pair as soon as it is available,
+        while the response is still streaming in when stream_responses is on
+        '''
         if retry_time >= self.max_retry_time:
             return None
         
         try:
-            response_text = await self.client.get_response(
-                prompt=self.prompt_template.format(
-                    text=chunk.content, 
-                    entries_per_chunk=entries_per_chunk
-                ),
-                max_tokens=1024,
-            )
-            # print(response_text)
-            response_json_format = self.parsing_response(response_text)
-            # Add validation check
-            if not response_json_format:  # If empty or None
+            streamed = structured = False
+            if self.structured_output:
+                entries, structured = await self._generate_structured(chunk, entries_per_chunk)
+            elif self.stream_responses:
+                streamed = True
+                entries = await self._generate_streamed(chunk, entries_per_chunk, on_pair)
+            else:
+                entries = await self._generate_text(chunk, entries_per_chunk)
+            self.parse_stats.record_attempt(structured, bool(entries), first=retry_time == 0)
+            if not entries:  # If no valid entries were created
                 logger.info("Unable to receive the expected response in JSON format.")
-                return await self.generate(chunk, entries_per_chunk, retry_time + 1)
+                self.parse_stats.parse_retries += 1
+                metrics.count('retries', reason='parse')
+                return await self.generate(chunk, entries_per_chunk, retry_time + 1, on_pair)
 
-            entries = []
-            for response in response_json_format:
-                try:
-                    response_entry = json.loads(response)
-                    logger.info(f"Response: {response}")
-                    entries.append(
-                        QAPair(
-                            instruction=response_entry['instruction'],
-                            input=response_entry['input'],
-                            output=response_entry['output'],
-                            source=chunk,
-                        )
-                    )
-                except json.JSONDecodeError as e:
-                    logger.info(f"JSON decode error: {e}")
-                    continue
-                except KeyError as e:
-                    logger.info(f"Missing required key: {e}")
-                    continue
-
-            if not entries:  # If no valid entries were created
-                return await self.generate(chunk, entries_per_chunk, retry_time + 1)
-                
+            if on_pair is not None and not streamed:
+                for qa_pair in entries:
+                    _hand_over(on_pair, qa_pair)
             return entries
-                
+
+        except _OnPairError as e:
+            # pairs may already be written; a retry would write them twice
+            raise e.error
         except Exception as e:
             logger.error(f"Error during generating entry: {str(e)}")
-            return await self.generate(chunk, entries_per_chunk, retry_time + 1)
+            metrics.count('retries', reason='rate_limit' if is_rate_limit_error(e) else type(e).__name__)
+            if is_rate_limit_error(e):
+                # the client already gave up backing off; wait before spending another retry
+                await asyncio.sleep(self._rate_limit_delay(retry_time))
+            return await self.generate(chunk, entries_per_chunk, retry_time + 1, on_pair)
+
+    async def _generate_streamed(
+        self,
+        chunk: Chunk,
+        entries_per_chunk: int,
+        on_pair: Optional[Callable[[QAPair], None]] = None,
+    ) -> List[QAPair]:
+        """ parse entries while the response streams in and cancel it once entries_per_chunk pairs exist """
+        extractor = JsonObjectExtractor()
+        entries: List[QAPair] = []
+        received: List[str] = []
+        stopped_early = False
+        started = time.perf_counter()
+        self.stream_stats.streams += 1
+        self.parse_stats.responses += 1
+        prompt = self.render_prompt(chunk, entries_per_chunk)
+        stream = self.client.stream_response(prompt=prompt, max_tokens=self.max_tokens)
+        try:
+            while True:
+                try:
+                    piece = await anext(stream)
+                except StopAsyncIteration:
+                    self._collect(extractor.close(), chunk, entries, entries_per_chunk, on_pair, started)
+                    break
+                except Exception as e:
+                    # pairs already handed to on_pair are kept rather than generated (and written) twice;
+                    # only errors of the stream itself end up here, on_pair errors propagate
+                    if not entries:
+                        raise
+                    logger.warning(f"Stream broke off after {len(entries)} entries: {e}")
+                    break
+                received.append(piece)
+                self._collect(extractor.feed(piece), chunk, entries, entries_per_chunk, on_pair, started)
+                if len(entries) >= entries_per_chunk:
+                    stopped_early = True
+                    break
+        finally:
+            await stream.aclose()
+
+        streamed_tokens = estimate_tokens(''.join(received))
+        self.stream_stats.streamed_tokens += streamed_tokens
+        if stopped_early:
+            self.client.keep_response(prompt, self.max_tokens, ''.join(received))
+            self.stream_stats.early_stops += 1
+            self.stream_stats.tokens_saved += max(0, self.max_tokens - streamed_tokens)
+            metrics.count('tokens_saved', max(0, self.max_tokens - streamed_tokens))
+        if not entries:
+            self.parse_stats.empty_responses += 1
+            self.client.discard_response(prompt, max_tokens=self.max_tokens)
+        return entries
+
+    def _collect(
+        self,
+        objects: List[Any],
+        chunk: Chunk,
+        entries: List[QAPair],
+        limit: int,
+        on_pair: Optional[Callable[[QAPair], None]],
+        started: float,
+    ):
+        """ add the valid pairs among newly parsed objects to entries, up to limit """
+        for entry in (entry for obj in objects for entry in iter_entries(obj)):
+            if len(entries) >= limit:
+                return
+            self.parse_stats.objects_recovered += 1
+            qa_pair = self.to_pair(entry, chunk)
+            if qa_pair is None:
+                logger.info(f"Invalid entry: {entry}")
+                self.parse_stats.invalid_entries += 1
+                continue
+            if not entries:
+                self.stream_stats.first_pairs += 1
+                self.stream_stats.first_pair_seconds += time.perf_counter() - started
+                metrics.observe('first_pair', time.perf_counter() - started)
+            self.parse_stats.valid_entries += 1
+            entries.append(qa_pair)
+            if on_pair is not None:
+                _hand_over(on_pair, qa_pair)
+
+    async def _generate_text(self, chunk: Chunk, entries_per_chunk: int) -> List[QAPair]:
+        prompt = self.render_prompt(chunk, entries_per_chunk)
+        response_text = await self.client.get_response(prompt=prompt, max_tokens=self.max_tokens)
+        entries = self.parse_pairs(response_text, chunk)
+        if not entries:
+            self.client.discard_response(prompt, max_tokens=self.max_tokens)
+        return entries
+
+    async def _generate_structured(self, chunk: Chunk, entries_per_chunk: int) -> Tuple[List[QAPair], bool]:
+        """
+        schema-constrained generation, falls back to the text path if the provider rejects it
+        -> (pairs, whether they came from a structured response)
+        """
+        prompt = self.render_prompt(chunk, entries_per_chunk)
+        schema = entries_schema(entries_per_chunk)
+        try:
+            response_text = await self.client.get_structured_response(
+                prompt=prompt,
+                schema=schema,
+                max_tokens=self.max_tokens,
+            )
+        except Exception as e:
+            if not self._structured_rejected(e):
+                raise
+            return await self._generate_text(chunk, entries_per_chunk), False
+
+        self.parse_stats.structured_responses += 1
+        entries = self.parse_pairs(response_text, chunk)[:entries_per_chunk]
+        if not entries:
+            self.client.discard_response(prompt, max_tokens=self.max_tokens, schema=schema)
+        return entries, True
+
+    def _structured_rejected(self, error: BaseException) -> bool:
+        """
+        whether a failed structured request should be answered on the text path instead
+        only an explicit response_format rejection turns structured output off for the run;
+        other bad requests fall back for this one request
+        """
+        if _is_unsupported_error(error):
+            logger.warning(f"Structured output is not available ({error}), falling back to text generation.")
+            metrics.count('retries', reason='structured_output_unsupported')
+            self.structured_output = False
+            return True
+        if _is_bad_request(error):
+            logger.warning(f"Structured request rejected ({error}), sending this one as text.")
+            metrics.count('retries', reason='structured_output_rejected')
+            return True
+        return False
+
+    async def generate_packed(self, chunks: Sequence[Chunk], entries_per_chunk: int) -> List[Optional[List[QAPair]]]:
+        '''
+        Chunks -> QAPairs of each chunk, using one request for the whole pack
+        the prompt template is sent once; every passage is numbered and the model tags
+        its entries with a chunk_id, so pairs keep pointing at their own Chunk
+        chunks left without pairs (or a failed request) fall back to one request each
+        '''
+        if len(chunks) == 1:
+            return [await self.generate(chunks[0], entries_per_chunk)]
+
+        self.pack_stats.requests += 1
+        self.pack_stats.chunks += len(chunks)
+        results: List[Optional[List[QAPair]]] = [[] for _ in chunks]
+        try:
+            for chunk_id, entry in await self._generate_pack_entries(chunks, entries_per_chunk):
+                qa_pair = self.to_pair(entry, chunks[chunk_id])
+                if qa_pair is None:
+                    self.parse_stats.invalid_entries += 1
+                    continue
+                self.parse_stats.valid_entries += 1
+                results[chunk_id].append(qa_pair)
+        except Exception as e:
+            logger.error(f"Error during generating packed entries: {str(e)}")
+
+        missing = [position for position, pairs in enumerate(results) if not pairs]
+        if missing:
+            self.pack_stats.fallbacks += len(missing)
+            retried = await asyncio.gather(*(self.generate(chunks[position], entries_per_chunk) for position in missing))
+            for position, pairs in zip(missing, retried):
+                results[position] = pairs
+        return results
+
+    async def _generate_pack_entries(self, chunks: Sequence[Chunk], entries_per_chunk: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """ one request for the pack -> (position in pack, entry) for entries with a known chunk_id """
+        prompt = self.render_pack_prompt(chunks, entries_per_chunk)
+        max_tokens = self.pack_max_tokens(len(chunks), entries_per_chunk)
+        schema = None
+        if self.structured_output:
+            schema = entries_schema(entries_per_chunk, with_chunk_id=True)
+            try:
+                response_text = await self.client.get_structured_response(
+                    prompt=prompt,
+                    schema=schema,
+                    max_tokens=max_tokens,
+                )
+                self.parse_stats.structured_responses += 1
+            except Exception as e:
+                if not self._structured_rejected(e):
+                    raise
+                schema = None
+        if schema is None:
+            response_text = await self.client.get_response(prompt=prompt, max_tokens=max_tokens)
+
+        self.parse_stats.responses += 1
+        objects = self.parsing_response(response_text)
+        self.parse_stats.objects_recovered += len(objects)
+        entries = []
+        for entry in objects:
+            try:
+                chunk_id = int(entry.get('chunk_id'))
+            except (TypeError, ValueError):
+                chunk_id = 0
+            if not 1 <= chunk_id <= len(chunks):
+                logger.info(f"Entry without a valid chunk_id: {entry}")
+                self.parse_stats.invalid_entries += 1
+                continue
+            entries.append((chunk_id - 1, entry))
+        if not entries:
+            self.parse_stats.empty_responses += 1
+            self.client.discard_response(prompt, max_tokens=max_tokens, schema=schema)
+        return entries
+
+    def max_pack_chunks(self, entries_per_chunk: int) -> int:
+        ''' most chunks one pack can hold while all their entries fit max_output_tokens '''
+        return max(1, self.max_output_tokens // (self.tokens_per_entry * entries_per_chunk))
+
+    def pack_max_tokens(self, num_chunks: int, entries_per_chunk: int) -> int:
+        return min(self.tokens_per_entry * entries_per_chunk * num_chunks, self.max_output_tokens)
+
+    def render_pack_prompt(self, chunks: Sequence[Chunk], entries_per_chunk: int) -> str:
+        text = '\n\n'.join(f"[passage {chunk_id}]\n{chunk.content}" for chunk_id, chunk in enumerate(chunks, 1))
+        return self.prompt_template.format(
+            text=text,
+            entries_per_chunk=entries_per_chunk
+        ) + PACK_INSTRUCTION.format(num_chunks=len(chunks), entries_per_chunk=entries_per_chunk)
+
+    def render_prompt(self, chunk: Chunk, entries_per_chunk: int) -> str:
+        return self.prompt_template.format(
+            text=chunk.content,
+            entries_per_chunk=entries_per_chunk
+        )
+
+    def parse_pairs(self, response_text: str, chunk: Chunk) -> List[QAPair]:
+        """ response text -> every valid QAPair it contains, recording parse stats """
+        self.parse_stats.responses += 1
+        with metrics.span('parse'):
+            objects = self.parsing_response(response_text)
+        self.parse_stats.objects_recovered += len(objects)
+
+        entries = []
+        for entry in objects:
+            qa_pair = self.to_pair(entry, chunk)
+            if qa_pair is None:
+                logger.info(f"Invalid entry: {entry}")
+                self.parse_stats.invalid_entries += 1
+                continue
+            entries.append(qa_pair)
+        self.parse_stats.valid_entries += len(entries)
+        if not entries:
+            self.parse_stats.empty_responses += 1
+        return entries
+
+    @staticmethod
+    def to_pair(entry: Dict[str, Any], chunk: Chunk) -> Optional[QAPair]:
+        instruction, output = entry.get('instruction'), entry.get('output')
+        if not instruction or output is None or output == '':
+            return None
+        return QAPair(
+            instruction=str(instruction),
+            input=str(entry.get('input') or ''),
+            output=str(output),
+            source=chunk,
+        )
+
+    def _rate_limit_delay(self, retry_time: int) -> float:
+        rate_limiter = getattr(self.client, 'rate_limiter', None)
+        if rate_limiter is not None:
+            return rate_limiter.backoff_delay(retry_time + 1)
+        return random.uniform(0, 2 ** (retry_time + 1))
     
     @staticmethod
-    def parsing_response(response: str):
-        json_objects = [obj.strip() for obj in response.split('}\n') if obj.strip()]
-        json_objects = [obj + '}' for obj in json_objects[:-1]] + [json_objects[-1]]
-        return json_objects
\ No newline at end of file
+    def parsing_response(response: str) -> List[Dict[str, Any]]:
+        """ QA-shaped JSON objects found anywhere in the response, see JsonObjectExtractor """
+        return [entry for obj in extract_json_objects(response) for entry in iter_entries(obj)]
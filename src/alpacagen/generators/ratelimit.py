@@ -0,0 +1,227 @@
+import re
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager
+from typing import Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    return getattr(error, 'status_code', None) == 429
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse '20ms', '1s', '6m0s' or a plain number of seconds."""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds the provider asked us to wait, from Retry-After or x-ratelimit-reset-* headers."""
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    resets = [
+        _parse_duration(headers[name])
+        for name in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')
+        if headers.get(name)
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute, bursting up to a full minute's budget."""
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter:
+    """
+    Client-side limiter shared by every request of an LLM client.
+
+    Budgets requests and estimated tokens per minute with token buckets and
+    adapts concurrency AIMD-style: the in-flight limit halves on a 429 and
+    grows by one after `recover_after` consecutive successes. A 429 for a request
+    that started before the last cut belongs to the same overload and cuts nothing.
+    """
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        min_concurrency: int = 1,
+        recover_after: int = 10,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = max_concurrency
+        self.recover_after = recover_after
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.in_flight = 0
+        self.rate_limited = 0
+        self._success_streak = 0
+        self._blocked_until = 0.0
+        self._last_cut = float('-inf')
+        self._condition: Optional[asyncio.Condition] = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # created lazily so the limiter can be built outside of a running loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = max(0.0, self._blocked_until - time.monotonic())
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.wait_time(1))
+        if self.token_bucket:
+            wait = max(wait, self.token_bucket.wait_time(tokens))
+        return wait
+
+    def wait_time(self, tokens: int = 0) -> float:
+        """Seconds until a request of `tokens` would be let through (ignoring the concurrency limit)."""
+        return self._wait_time(tokens)
+
+    async def acquire(self, tokens: int = 0):
+        async with self.condition:
+            while True:
+                if self.concurrency_limit is not None and self.in_flight >= self.concurrency_limit:
+                    await self.condition.wait()
+                    continue
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                try:
+                    # wake early if a release changes the picture, otherwise sleep the budget off
+                    await asyncio.wait_for(self.condition.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+            if self.request_bucket:
+                self.request_bucket.consume(1)
+            if self.token_bucket:
+                self.token_bucket.consume(tokens)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    @asynccontextmanager
+    async def limit(self, tokens: int = 0):
+        await self.acquire(tokens)
+        try:
+            yield
+        finally:
+            await self.release()
+
+    def on_success(self):
+        self._success_streak += 1
+        if self.concurrency_limit is None or self._success_streak < self.recover_after:
+            return
+        self._success_streak = 0
+        if self.max_concurrency is None or self.concurrency_limit < self.max_concurrency:
+            self.concurrency_limit += 1
+
+    def on_rate_limited(self, retry_after: Optional[float] = None, started_at: Optional[float] = None):
+        """started_at: time.monotonic() when the rejected request was let through, if known"""
+        self.rate_limited += 1
+        self._success_streak = 0
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        if started_at is not None and started_at < self._last_cut:
+            # sent before the limit was cut for this overload; cutting again would overshoot
+            return
+        self._last_cut = time.monotonic()
+        current = self.concurrency_limit if self.concurrency_limit is not None else max(self.in_flight, 2)
+        self.concurrency_limit = max(self.min_concurrency, current // 2)
+        if self.request_bucket:
+            self.request_bucket.drain()
+        logger.warning(
+            f"Rate limited by provider, concurrency limit is now {self.concurrency_limit}"
+            + (f", pausing {retry_after:.1f}s" if retry_after else "")
+        )
+
+    def update_from_headers(self, headers: Optional[Mapping[str, str]]):
+        """Pause new requests when the provider reports an exhausted budget."""
+        if not headers:
+            return
+        for remaining, reset in (
+            ('x-ratelimit-remaining-requests', 'x-ratelimit-reset-requests'),
+            ('x-ratelimit-remaining-tokens', 'x-ratelimit-reset-tokens'),
+        ):
+            value = headers.get(remaining)
+            if value is None or not value.strip().isdigit() or int(value) > 0:
+                continue
+            delay = _parse_duration(headers.get(reset, '') or '')
+            if delay:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff, never shorter than what the provider asked for."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
@@ -0,0 +1,154 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import (
+    Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple,
+    TypeVar, Union
+)
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile over an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[rank]
+
+
+@dataclass
+class ThroughputStats:
+    """Per-run counters collected by SlidingWindowScheduler."""
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    latencies: List[float] = field(default_factory=list)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    @property
+    def requests_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def p50_latency(self) -> float:
+        return _percentile(sorted(self.latencies), 50)
+
+    @property
+    def p95_latency(self) -> float:
+        return _percentile(sorted(self.latencies), 95)
+
+    def to_dict(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'elapsed': self.elapsed,
+            'requests_per_second': self.requests_per_second,
+            'p50_latency': _percentile(latencies, 50),
+            'p95_latency': _percentile(latencies, 95),
+        }
+
+
+class SlidingWindowScheduler:
+    """
+    Bounded work-queue scheduler.
+    Keeps at most `max_concurrency` tasks running and starts the next item
+    as soon as any running task finishes, instead of waiting for a whole batch.
+    """
+    def __init__(self, max_concurrency: int = 20, desc: Optional[str] = None, show_progress: bool = True):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency should be at least 1")
+        self.max_concurrency = max_concurrency
+        self.desc = desc
+        self.show_progress = show_progress
+        self.stats = ThroughputStats()
+
+    async def _timed(self, fn: Callable[[T], Awaitable[R]], item: T) -> Tuple[R, float]:
+        start = time.perf_counter()
+        result = await fn(item)
+        return result, time.perf_counter() - start
+
+    async def run(
+        self,
+        fn: Callable[[T], Awaitable[R]],
+        items: Union[Iterable[T], AsyncIterable[T]],
+        total: Optional[int] = None,
+    ) -> AsyncIterator[Tuple[int, T, Optional[R]]]:
+        """
+        Apply `fn` to every item and yield `(index, item, result)` in completion order.
+        Items may come from a sync or async iterable and are only pulled when a slot is free,
+        so memory stays bounded by the window rather than by the number of items.
+        A task that raises is logged, counted as failed and yielded with a None result.
+        """
+        if total is None and hasattr(items, '__len__'):
+            total = len(items)
+
+        self.stats = stats = ThroughputStats(started_at=time.perf_counter())
+        is_async = hasattr(items, '__aiter__')
+        iterator = aiter(items) if is_async else iter(items)
+        pending: Dict[asyncio.Task, Tuple[int, T]] = {}
+        exhausted = False
+        progress = tqdm(total=total, desc=self.desc, disable=not self.show_progress)
+
+        async def fill():
+            nonlocal exhausted
+            while not exhausted and len(pending) < self.max_concurrency:
+                try:
+                    item = await anext(iterator) if is_async else next(iterator)
+                except (StopIteration, StopAsyncIteration):
+                    exhausted = True
+                    break
+                task = asyncio.ensure_future(self._timed(fn, item))
+                pending[task] = (stats.submitted, item)
+                stats.submitted += 1
+            stats.in_flight = len(pending)
+            stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+
+        try:
+            await fill()
+            while pending:
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                finished = []
+                for task in done:
+                    index, item = pending.pop(task)
+                    try:
+                        result, latency = task.result()
+                        stats.latencies.append(latency)
+                        stats.completed += 1
+                    except Exception as e:
+                        logger.error(f"Task {index} failed: {e}")
+                        result = None
+                        stats.failed += 1
+                    finished.append((index, item, result))
+                # refill before handing results back so slots never sit idle
+                await fill()
+                progress.update(len(finished))
+                progress.set_postfix(in_flight=stats.in_flight, rps=f"{stats.requests_per_second:.2f}")
+                for entry in finished:
+                    yield entry
+        finally:
+            for task in pending:
+                task.cancel()
+            stats.in_flight = 0
+            stats.finished_at = time.perf_counter()
+            progress.close()
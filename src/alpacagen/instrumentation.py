@@ -0,0 +1,287 @@
+""" spans and counters for the conversion -> chunking -> generation hot paths, off by default """
+import os
+import json
+import time
+import heapq
+import bisect
+import threading
+import contextvars
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+# histogram bucket upper bounds in seconds, shared by every timer
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+@dataclass
+class Span:
+    """ a finished, OpenTelemetry-shaped span """
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_time_ns: int
+    end_time_ns: int
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = 'OK'
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time_ns - self.start_time_ns) / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time_ns': self.start_time_ns,
+            'end_time_ns': self.end_time_ns,
+            'attributes': self.attributes,
+            'status': self.status,
+        }
+
+class SpanExporter(ABC):
+    @abstractmethod
+    def export(self, spans: Sequence[Span]):
+        pass
+
+    def shutdown(self):
+        pass
+
+class InMemorySpanExporter(SpanExporter):
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    def export(self, spans: Sequence[Span]):
+        self.spans.extend(spans)
+
+class JsonlSpanExporter(SpanExporter):
+    """ one JSON object per span, appended to `path` """
+    def __init__(self, path: Union[str, Path]):
+        self.file = Path(path).open('a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def export(self, spans: Sequence[Span]):
+        lines = ''.join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + '\n' for span in spans)
+        with self.lock:
+            self.file.write(lines)
+
+    def shutdown(self):
+        self.file.close()
+
+class OpenTelemetrySpanExporter(SpanExporter):
+    """ replays finished spans into an OpenTelemetry tracer, requires `opentelemetry-api` """
+    def __init__(self, tracer=None):
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError("OpenTelemetrySpanExporter requires opentelemetry-api: pip install opentelemetry-api") from e
+        self.tracer = tracer if tracer is not None else trace.get_tracer('alpacagen')
+
+    def export(self, spans: Sequence[Span]):
+        for span in spans:
+            otel_span = self.tracer.start_span(span.name, start_time=span.start_time_ns, attributes={
+                key: value if isinstance(value, (str, bool, int, float)) else str(value)
+                for key, value in span.attributes.items()
+            })
+            otel_span.end(end_time=span.end_time_ns)
+
+class _NoopSpan:
+    """ shared stand-in while instrumentation is disabled """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+_current_span: contextvars.ContextVar[Optional['_ActiveSpan']] = contextvars.ContextVar('alpacagen_span', default=None)
+
+class _ActiveSpan:
+    __slots__ = ('metrics', 'name', 'attributes', 'span_id', 'parent', 'started', 'start_ns', 'token')
+
+    def __init__(self, metrics: 'Metrics', name: str, attributes: Dict[str, Any]):
+        self.metrics = metrics
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """ attach attributes discovered while the span is open, e.g. token counts """
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.span_id = os.urandom(8).hex()
+        self.token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.metrics.observe(self.name, elapsed)
+        if self.metrics.exporter is not None:
+            self.metrics.exporter.export([Span(
+                name=self.name,
+                trace_id=self.metrics.trace_id,
+                span_id=self.span_id,
+                parent_id=self.parent.span_id if self.parent is not None else None,
+                start_time_ns=self.start_ns,
+                end_time_ns=self.start_ns + int(elapsed * 1e9),
+                attributes=self.attributes,
+                status='ERROR' if exc_type is not None else 'OK',
+            )])
+        return False
+
+@dataclass
+class TimerStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    buckets: List[int] = field(default_factory=lambda: [0] * len(BUCKETS))
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """ upper bound of the bucket holding the q-quantile (capped at the max seen) """
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+class Metrics:
+    """ timers and counters per stage, plus the slowest files seen by the converter """
+    def __init__(self, enabled: bool = False, exporter: Optional[SpanExporter] = None, slowest_files: int = 10):
+        self.enabled = enabled
+        self.exporter = exporter
+        self.slowest_files = slowest_files
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.trace_id = os.urandom(16).hex()
+            self.timers: Dict[str, TimerStats] = {}
+            self.counters: Dict[LabelKey, float] = {}
+            self.file_times: List[Tuple[float, str]] = []
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _ActiveSpan(self, name, attributes)
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = TimerStats()
+            timer.observe(seconds)
+
+    def count(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe_file(self, file: Union[str, Path], seconds: float):
+        """ per-file conversion time, keeping only the slowest files """
+        if not self.enabled:
+            return
+        with self.lock:
+            entry = (seconds, str(file))
+            if len(self.file_times) < self.slowest_files:
+                heapq.heappush(self.file_times, entry)
+            else:
+                heapq.heappushpop(self.file_times, entry)
+
+    def counter(self, name: str, **labels) -> float:
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        return self.counters.get(key, 0)
+
+    def to_prometheus(self, prefix: str = 'alpacagen') -> str:
+        """ Prometheus text exposition of every timer (as a histogram) and counter """
+        lines = []
+        with self.lock:
+            for name, timer in sorted(self.timers.items()):
+                metric = f"{prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(BUCKETS, timer.buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+                lines.append(f"{metric}_sum {timer.total}")
+                lines.append(f"{metric}_count {timer.count}")
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{prefix}_{name}_total"
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f"# TYPE {metric} counter")
+                label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+                lines.append(f"{metric}{{{label_text}}} {value:g}" if label_text else f"{metric} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """ end-of-run table: time per stage, counters and the slowest files """
+        with self.lock:
+            rows = [f"{'stage':<18}{'count':>8}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+            for name, timer in sorted(self.timers.items(), key=lambda item: -item[1].total):
+                rows.append(
+                    f"{name:<18}{timer.count:>8}{timer.total:>10.2f}{timer.mean * 1000:>10.1f}"
+                    f"{timer.quantile(0.95) * 1000:>10.1f}{timer.max * 1000:>10.1f}"
+                )
+            if self.counters:
+                rows.append('')
+                for (name, labels), value in sorted(self.counters.items()):
+                    label_text = ','.join(f"{label}={label_value}" for label, label_value in labels)
+                    rows.append(f"{name + (f'[{label_text}]' if label_text else ''):<48}{value:>12g}")
+            if self.file_times:
+                rows.append('')
+                rows.append('slowest files:')
+                for seconds, file in sorted(self.file_times, reverse=True):
+                    rows.append(f"  {seconds * 1000:>10.1f} ms  {file}")
+        return '\n'.join(rows)
+
+# process-wide registry used by the hooks in converters, generators and clients
+metrics = Metrics()
+
+def enable(exporter: Optional[SpanExporter] = None, reset: bool = True) -> Metrics:
+    if reset:
+        metrics.reset()
+    metrics.exporter = exporter
+    metrics.enabled = True
+    return metrics
+
+def disable():
+    metrics.enabled = False
+    if metrics.exporter is not None:
+        metrics.exporter.shutdown()
+        metrics.exporter = None
@@ -1,18 +1,28 @@
-import json
 import logging
 import asyncio
-from typing import List, Optional, Union, Tuple, Any
+import threading
+from typing import Dict, List, Optional, Union, Tuple, Any, Awaitable, Callable
 from pathlib import Path
 import nest_asyncio
-from openai import AsyncOpenAI
 
 from .converters.text import MarkItDownConverter
 from .models.qa_pair import QAPair, Chunk
-from .strategies.chunk import RecursiveChunkStrategy
-from .generators.client import OpenAIClient, AzureClient, HuggingFaceClient
+from .strategies.chunk import ChunkStrategy, RecursiveChunkStrategy
+from .generators.client import BaseLLMClient, OpenAIClient, AzureClient, HuggingFaceClient, BatchStats, pooled_http_client
+from .generators.cache import CachedLLMClient
+from .generators.pool import ClientPool, Endpoint
 from .generators.chunk import ChunkGenerator
 from .generators.qa import QAGenerator
 from .generators.dataset import QADatasetGenerator
+from .generators.batch import BatchJobRunner
+from .generators.scheduler import ThroughputStats
+from .generators.parsing import ParseStats
+from .generators.ratelimit import RateLimiter
+from .storage.journal import ProgressJournal
+from .storage.cache import ResponseCache
+from .storage.conversion import ConversionCache
+from .writers import JsonlWriter, get_writer
+from . import instrumentation
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -35,82 +45,397 @@ class AlpacaGen:
             llm_model: str = None,
             api_key: str = None,
             base_url: str = None,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None,
+            cache_dir: Optional[Union[str, Path]] = None,
+            cache_max_bytes: int = 1 << 30,
+            cache_bypass: bool = False,
+            conversion_cache_path: Optional[Union[str, Path]] = None,
+            structured_output: bool = False,
+            stream_responses: bool = False,
+            max_output_tokens: int = 4096,
+            endpoints: Optional[List[Dict[str, Any]]] = None,
+            routing: str = 'least_outstanding',
+            max_connections: int = 1000,
+            max_keepalive_connections: int = 100,
+            keepalive_expiry: float = 30.0,
     ):
         assert llm_provider in LLM_PROVIDERS, f"Specify your llm provider, provider should be one of {LLM_PROVIDERS}"
         assert llm_provider != 'huggingface' or llm_model, f"Specify llm model since you chose huggingface as llm provider"
+        assert not endpoints or llm_provider != 'huggingface', "endpoints can only be used with openai or azure"
         self.llm_provider = llm_provider
         self.llm_model = llm_model if llm_model else DEFAULT_MODEL_DICT[self.llm_provider]
         self.api_key = api_key
         self.base_url = base_url
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.response_cache = ResponseCache(cache_dir, max_bytes=cache_max_bytes) if cache_dir else None
+        self.cache_bypass = cache_bypass
+        self.conversion_cache = ConversionCache(conversion_cache_path) if conversion_cache_path else None
+        self.structured_output = structured_output
+        self.stream_responses = stream_responses
+        self.max_output_tokens = max_output_tokens
+        self.endpoints = endpoints
+        self.routing = routing
+        self.pool_limits = {
+            'max_connections': max_connections,
+            'max_keepalive_connections': max_keepalive_connections,
+            'keepalive_expiry': keepalive_expiry,
+        }
+        # client kept open between calls while used as a session (`async with AlpacaGen(...) as ag`)
+        self._session_client: Optional[BaseLLMClient] = None
+        # a sync session (`with AlpacaGen(...) as ag`) runs every call on its own loop thread,
+        # since the session's connections belong to the loop they were opened on
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session_thread: Optional[threading.Thread] = None
+        self.last_run_stats: Optional[ThroughputStats] = None
+        self.last_parse_stats: Optional[ParseStats] = None
         logging.basicConfig(level=logging.ERROR)
 
-    async def _get_client(self) -> AsyncOpenAI:
-        """Get or create AsyncOpenAI client."""
-        match self.llm_provider:
+    async def __aenter__(self) -> 'AlpacaGen':
+        """
+        Open a session: one LLM client (and HTTP connection pool, or loaded HuggingFace model)
+        is shared by every call until the session is closed.
+        """
+        if self._session_client is None:
+            self._session_client = self._create_client()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def __enter__(self) -> 'AlpacaGen':
+        """Sync session; only the sync methods may be used inside it."""
+        assert self._session_client is None, "A session is already open"
+        self._session_loop = asyncio.new_event_loop()
+        self._session_thread = threading.Thread(
+            target=self._session_loop.run_forever, name='alpacagen-session', daemon=True
+        )
+        self._session_thread.start()
+        return self._run_sync(self.__aenter__)
+
+    def __exit__(self, *exc_info):
+        try:
+            self._run_sync(self.aclose)
+        finally:
+            loop, self._session_loop = self._session_loop, None
+            loop.call_soon_threadsafe(loop.stop)
+            self._session_thread.join()
+            self._session_thread = None
+            loop.close()
+
+    async def aclose(self):
+        """Close the session client and its connections."""
+        client, self._session_client = self._session_client, None
+        if client is not None:
+            await client.aclose()
+
+    async def _get_client(self) -> BaseLLMClient:
+        """The session client, or a new client for this call only."""
+        if self._session_client is not None:
+            return self._session_client
+        return self._create_client()
+
+    async def _release_client(self, client: BaseLLMClient):
+        """Close a client made for one call; the session client stays open."""
+        if client is not self._session_client:
+            await client.aclose()
+
+    def _create_client(self) -> BaseLLMClient:
+        """Create the LLM client, wrapped with the response cache if configured."""
+        if self.llm_provider == 'huggingface':
+            http_client = None
+        else:
+            # one pool for all endpoints; httpx keeps separate connections per host
+            http_client = pooled_http_client(**self.pool_limits)
+        if self.endpoints:
+            client = self._get_client_pool(http_client)
+        else:
+            client = self._build_client(
+                self.llm_provider, self.api_key, self.base_url, self.llm_model, http_client=http_client
+            )
+        if self.response_cache is not None:
+            client = CachedLLMClient(client, cache=self.response_cache, bypass=self.cache_bypass)
+        return client
+
+    def _build_client(
+        self,
+        llm_provider: str,
+        api_key: Optional[str],
+        base_url: Optional[str],
+        llm_model: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        **client_kwargs,
+    ) -> BaseLLMClient:
+        match llm_provider:
             case 'openai':
-                client = OpenAIClient(api_key=self.api_key)
+                return OpenAIClient(
+                    api_key=api_key,
+                    llm_model=llm_model,
+                    base_url=base_url,
+                    rate_limiter=rate_limiter or self._get_rate_limiter(),
+                    **client_kwargs,
+                )
             case 'azure':
-                client = AzureClient(api_key=self.api_key, base_url=self.base_url)
+                return AzureClient(
+                    api_key=api_key,
+                    base_url=base_url,
+                    llm_model=llm_model,
+                    rate_limiter=rate_limiter or self._get_rate_limiter(),
+                    **client_kwargs,
+                )
             case 'huggingface':
-                client = HuggingFaceClient(llm_model=self.llm_model)
-        return client
+                return HuggingFaceClient(llm_model=llm_model)
+
+    def _get_client_pool(self, http_client=None) -> ClientPool:
+        """One client per configured endpoint, each with its own rate limits."""
+        pool_endpoints = []
+        for endpoint in self.endpoints:
+            client = self._build_client(
+                endpoint.get('llm_provider', self.llm_provider),
+                endpoint.get('api_key', self.api_key),
+                endpoint.get('base_url'),
+                endpoint.get('llm_model', self.llm_model),
+                rate_limiter=self._get_rate_limiter(
+                    endpoint.get('requests_per_minute', self.requests_per_minute),
+                    endpoint.get('tokens_per_minute', self.tokens_per_minute),
+                ),
+                # a 429 is retried on another endpoint right away instead of backing off here
+                max_rate_limit_retries=endpoint.get('max_rate_limit_retries', 0),
+                http_client=http_client,
+            )
+            pool_endpoints.append(Endpoint(client=client, weight=endpoint.get('weight', 1.0), name=endpoint.get('name')))
+        return ClientPool(pool_endpoints, routing=self.routing)
+
+    def _get_rate_limiter(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ) -> RateLimiter:
+        return RateLimiter(
+            requests_per_minute=requests_per_minute or self.requests_per_minute,
+            tokens_per_minute=tokens_per_minute or self.tokens_per_minute,
+        )
 
     def get_chunks(
         self,
         input_path: Union[str, Path],
         chunk_size: int = 4096,
+        num_workers: int = 1,
+        file_timeout: Optional[float] = None,
+        chunk_strategy: Optional[ChunkStrategy] = None,
+        shard: Optional[Tuple[int, int]] = None,
     ) -> List[Chunk]:
-        """Generate chunks from input file."""
-        input_path = Path(input_path)
-        if not input_path.exists():
+        """
+        Generate chunks from input file.
+        Files that fail to convert are logged and skipped. With num_workers > 1 files are
+        converted in a process pool, and files taking longer than file_timeout seconds are skipped too.
+        chunk_strategy overrides the default character-based splitting (chunk_size is then ignored),
+        e.g. TokenChunkStrategy.for_model(...) to pack chunks to the model's context budget.
+        shard=(index, count) only reads the files that fall into that shard of the directory.
+        """
+        return self._get_chunk_generator(
+            input_path, chunk_size, num_workers, file_timeout, chunk_strategy, shard
+        ).generate(input_path)
+
+    async def aget_chunks(
+        self,
+        input_path: Union[str, Path],
+        chunk_size: int = 4096,
+        num_workers: int = 1,
+        file_timeout: Optional[float] = None,
+        chunk_strategy: Optional[ChunkStrategy] = None,
+        shard: Optional[Tuple[int, int]] = None,
+    ) -> List[Chunk]:
+        """
+        Async version of get_chunks; documents are converted in a worker thread,
+        so the caller's event loop keeps running meanwhile.
+        """
+        chunk_generator = self._get_chunk_generator(
+            input_path, chunk_size, num_workers, file_timeout, chunk_strategy, shard
+        )
+        return [chunk async for chunk in chunk_generator.astream(input_path)]
+
+    def _get_chunk_generator(
+        self,
+        input_path: Union[str, Path],
+        chunk_size: int,
+        num_workers: int = 1,
+        file_timeout: Optional[float] = None,
+        chunk_strategy: Optional[ChunkStrategy] = None,
+        shard: Optional[Tuple[int, int]] = None,
+    ) -> ChunkGenerator:
+        if not Path(input_path).exists():
             raise FileNotFoundError(f"Cannot find: {input_path}")
 
-        chunk_generator = ChunkGenerator(
+        return ChunkGenerator(
             text_converter=MarkItDownConverter(),
-            chunk_strategy=RecursiveChunkStrategy(
+            chunk_strategy=chunk_strategy or RecursiveChunkStrategy(
                 chunk_size=chunk_size,
                 chunk_overlap=200,
-            )
+            ),
+            num_workers=num_workers,
+            file_timeout=file_timeout,
+            conversion_cache=self.conversion_cache,
+            shard=shard,
         )
 
-        return chunk_generator.generate(input_path)
+    def _load_prompt(self, language: str, gen_prompt_path: Optional[Path] = None) -> str:
+        assert language in LANGUAGES, f"Language should be one of {LANGUAGES}"
+        if gen_prompt_path:
+            return Path(gen_prompt_path).read_text(encoding='utf-8')
+        with DEFAULT_PROMPT_PATHS[language].open('r', encoding='utf-8') as f:
+            return f.read()
 
-    async def _get_dataset_async(
+    async def _get_dataset_generator(
+        self,
+        gen_prompt: str,
+        entries_per_chunk: int,
+        max_concurrency: int,
+        journal: Optional[ProgressJournal] = None,
+        pack_tokens: Optional[int] = None,
+    ) -> QADatasetGenerator:
+        client = await self._get_client()
+        return QADatasetGenerator(
+            qa_generator=QAGenerator(
+                client,
+                self.llm_model,
+                gen_prompt,
+                structured_output=self.structured_output,
+                stream_responses=self.stream_responses,
+                max_output_tokens=self.max_output_tokens,
+            ),
+            entries_per_chunk=entries_per_chunk,
+            max_concurrency=max_concurrency,
+            journal=journal,
+            pack_tokens=pack_tokens,
+        )
+
+    def _finish_run(self, dataset_generator: QADatasetGenerator):
+        self.last_run_stats = dataset_generator.stats
+        self.last_parse_stats = parse_stats = dataset_generator.qa_generator.parse_stats
+        logger.info(
+            f"Parsing: {parse_stats.valid_entries} entries from {parse_stats.responses} responses, "
+            f"recovery rate {parse_stats.recovery_rate:.1%}, {parse_stats.parse_retries} parse retries"
+        )
+        if parse_stats.structured_first_tries:
+            summary = (
+                f"Structured output: {parse_stats.structured_first_try_parsed}/{parse_stats.structured_first_tries} chunks "
+                f"parsed on the first try ({parse_stats.first_try_rate(True):.1%}), "
+                f"{parse_stats.structured_parse_retries} parse retries"
+            )
+            if parse_stats.text_first_tries:
+                summary += (
+                    f"; text path {parse_stats.text_first_try_parsed}/{parse_stats.text_first_tries} "
+                    f"({parse_stats.first_try_rate(False):.1%}), {parse_stats.text_parse_retries} parse retries"
+                )
+            if parse_stats.retries_avoided is not None:
+                summary += f", about {max(0.0, parse_stats.retries_avoided):.0f} retries avoided"
+            if not dataset_generator.qa_generator.structured_output:
+                summary += ", then turned off as unsupported"
+            logger.info(summary)
+        pack_stats = dataset_generator.qa_generator.pack_stats
+        if pack_stats.requests:
+            logger.info(
+                f"Prompt packing: {pack_stats.chunks} chunks in {pack_stats.requests} requests, "
+                f"{pack_stats.fallbacks} retried alone, {pack_stats.requests_saved} requests saved"
+            )
+        stream_stats = dataset_generator.qa_generator.stream_stats
+        if stream_stats.streams:
+            logger.info(
+                f"Streaming: {stream_stats.early_stops}/{stream_stats.streams} responses stopped early, "
+                f"mean time to first pair {stream_stats.mean_time_to_first_pair * 1000:.0f}ms, "
+                f"up to {stream_stats.tokens_saved} output tokens saved"
+            )
+        client = dataset_generator.qa_generator.client
+        if isinstance(client, CachedLLMClient):
+            logger.info(f"Response cache: {client.hits} hits, {client.misses} misses")
+            client = client.client
+        if isinstance(client, ClientPool):
+            client.log_stats()
+        batch_stats = getattr(client, 'stats', None)
+        if isinstance(batch_stats, BatchStats) and batch_stats.batches:
+            logger.info(
+                f"HuggingFace batching: mean batch size {batch_stats.mean_batch_size:.1f}, "
+                f"mean wait {batch_stats.mean_wait * 1000:.0f}ms, {batch_stats.tokens_per_second:.1f} tokens/s"
+            )
+        if instrumentation.metrics.enabled:
+            logger.info("Run summary:\n" + self.metrics_summary())
+
+    def metrics_summary(self) -> str:
+        """Table of time per stage, counters and slowest files (requires `instrumentation.enable()`)."""
+        return instrumentation.metrics.summary()
+
+    def dump_metrics(self, path: Union[str, Path]):
+        """Write the collected metrics in Prometheus text format."""
+        Path(path).write_text(instrumentation.metrics.to_prometheus(), encoding='utf-8')
+
+    @staticmethod
+    def _open_journal(
+        resume: bool,
+        output_path: Optional[Union[str, Path]],
+        journal_path: Optional[Union[str, Path]],
+    ) -> Optional[ProgressJournal]:
+        if not resume:
+            return None
+        if journal_path is None:
+            assert output_path, "Specify output_path or journal_path to resume a run"
+            journal_path = ProgressJournal.default_path(output_path)
+        journal = ProgressJournal(journal_path)
+        logger.info(f"Resuming from {journal_path} ({len(journal)} chunks already completed)")
+        return journal
+
+    def _run_sync(self, make_coroutine: Callable[[], Awaitable[Any]]) -> Any:
+        """Run a coroutine from sync code, also when called inside a running loop (e.g. notebooks)."""
+        if self._session_loop is not None:
+            return asyncio.run_coroutine_threadsafe(make_coroutine(), self._session_loop).result()
+        try:
+            loop = asyncio.get_event_loop()
+            if loop.is_running():
+                nest_asyncio.apply()
+            return loop.run_until_complete(make_coroutine())
+        except RuntimeError:
+            return asyncio.run(make_coroutine())
+
+    async def aget_datasets(
         self,
         chunks: List[Chunk],
         language: str = 'zhtw',
         gen_prompt_path: Optional[Path] = None,
         entries_per_chunk: int = 3,
         output_path: Optional[Union[str, Path]] = None,
+        max_concurrency: int = 20,
+        resume: bool = False,
+        journal_path: Optional[Union[str, Path]] = None,
+        dedup_threshold: Optional[float] = None,
+        pack_tokens: Optional[int] = None,
+        writer_options: Optional[Dict[str, Any]] = None,
     ) -> List[QAPair]:
-        """Internal async method for dataset generation."""
-        assert language in LANGUAGES, f"Language should be one of {LANGUAGES}"
-
-        def get_default_prompt(language: str) -> str:
-            with DEFAULT_PROMPT_PATHS[language].open('r', encoding='utf-8') as f:
-                return f.read()
-
-        gen_prompt = (
-            Path(gen_prompt_path).read_text(encoding='utf-8')
-            if gen_prompt_path
-            else get_default_prompt(language)
-        )
-
-        client = await self._get_client()
-        
-        dataset_generator = QADatasetGenerator(
-            qa_generator=QAGenerator(
-                client,
-                self.llm_model,
-                gen_prompt
-            ),
-            entries_per_chunk=entries_per_chunk
+        """
+        Async version of get_datasets, for callers that run their own event loop.
+        Inside a session (`async with AlpacaGen(...) as ag`) every call reuses the same client.
+        """
+        gen_prompt = self._load_prompt(language, gen_prompt_path)
+        if dedup_threshold is not None:
+            from .filters.chunk_dedup import ChunkDeduplicator  # numpy is only needed for dedup
+            deduplicator = ChunkDeduplicator(threshold=dedup_threshold)
+            chunks = list(deduplicator.filter(chunks))
+            deduplicator.log_stats()
+        journal = self._open_journal(resume, output_path, journal_path)
+        dataset_generator = await self._get_dataset_generator(
+            gen_prompt, entries_per_chunk, max_concurrency, journal, pack_tokens
         )
 
-        dataset = await dataset_generator.generate(chunks)
+        try:
+            dataset = await dataset_generator.generate(chunks)
+        finally:
+            self._finish_run(dataset_generator)
+            await self._release_client(dataset_generator.qa_generator.client)
+            if journal is not None:
+                journal.close()
 
         if output_path:
-            self.save_to_jsonl(dataset, output_path)
+            self.save_dataset(dataset, output_path, **(writer_options or {}))
 
         return dataset
 
@@ -121,6 +446,12 @@ class AlpacaGen:
         gen_prompt_path: Optional[Path] = None,
         entries_per_chunk: int = 3,
         output_path: Optional[Union[str, Path]] = None,
+        max_concurrency: int = 20,
+        resume: bool = False,
+        journal_path: Optional[Union[str, Path]] = None,
+        dedup_threshold: Optional[float] = None,
+        pack_tokens: Optional[int] = None,
+        writer_options: Optional[Dict[str, Any]] = None,
     ) -> List[QAPair]:
         """
         User-friendly synchronous method to generate datasets from chunks.
@@ -131,44 +462,311 @@ class AlpacaGen:
             gen_prompt_path: Optional custom prompt file path
             entries_per_chunk: Number of QA pairs to generate per chunk
             output_path: Optional path to save the dataset
-            
+            max_concurrency: Maximum number of chunks being generated at the same time
+            resume: Keep a checkpoint journal and skip chunks completed by a previous run
+            journal_path: Optional journal location (defaults to `<output_path>.journal.sqlite`)
+            dedup_threshold: Skip chunks that are exact or near duplicates (MinHash similarity
+                at or above this threshold, e.g. 0.85) of an earlier chunk
+            pack_tokens: Pack consecutive small chunks into one request of up to this many
+                content tokens; pairs are still attributed to their own chunk
+            writer_options: Options for the dataset writer picked by the extension of output_path,
+                e.g. {'shard_bytes': 1 << 30, 'normalized': True} for JSONL
+
         Returns:
             List of QAPair objects representing the generated dataset
         """
+        return self._run_sync(
+            lambda: self.aget_datasets(
+                chunks,
+                language,
+                gen_prompt_path,
+                entries_per_chunk,
+                output_path,
+                max_concurrency,
+                resume,
+                journal_path,
+                dedup_threshold,
+                pack_tokens,
+                writer_options,
+            )
+        )
+
+    async def _get_dataset_batch_async(
+        self,
+        chunks: List[Chunk],
+        language: str = 'zhtw',
+        gen_prompt_path: Optional[Path] = None,
+        entries_per_chunk: int = 3,
+        output_path: Optional[Union[str, Path]] = None,
+        poll_interval: float = 30.0,
+        max_attempts: int = 3,
+        dedup_threshold: Optional[float] = None,
+        writer_options: Optional[Dict[str, Any]] = None,
+        state_path: Optional[Union[str, Path]] = None,
+    ) -> List[QAPair]:
+        """Internal async method for batch-job dataset generation."""
+        assert self.llm_provider in ('openai', 'azure') and not self.endpoints, \
+            "Batch jobs are only available for a single openai or azure endpoint"
+        gen_prompt = self._load_prompt(language, gen_prompt_path)
+        if dedup_threshold is not None:
+            from .filters.chunk_dedup import ChunkDeduplicator
+            deduplicator = ChunkDeduplicator(threshold=dedup_threshold)
+            chunks = list(deduplicator.filter(chunks))
+            deduplicator.log_stats()
+        qa_generator = QAGenerator(
+            await self._get_client(),
+            self.llm_model,
+            gen_prompt,
+            structured_output=self.structured_output,
+            max_output_tokens=self.max_output_tokens,
+        )
+        if state_path is None and output_path:
+            state_path = Path(f"{output_path}.batches.json")
+        runner = BatchJobRunner(
+            qa_generator,
+            entries_per_chunk=entries_per_chunk,
+            poll_interval=poll_interval,
+            max_attempts=max_attempts,
+            state_path=state_path,
+        )
         try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                nest_asyncio.apply()
-            return loop.run_until_complete(
-                self._get_dataset_async(
-                    chunks,
-                    language,
-                    gen_prompt_path,
-                    entries_per_chunk,
-                    output_path
-                )
+            dataset = await runner.generate(chunks)
+        finally:
+            runner.log_stats()
+            self.last_parse_stats = qa_generator.parse_stats
+            await self._release_client(qa_generator.client)
+
+        if output_path:
+            self.save_dataset(dataset, output_path, **(writer_options or {}))
+        return dataset
+
+    def get_datasets_batch(
+        self,
+        chunks: List[Chunk],
+        language: str = 'zhtw',
+        gen_prompt_path: Optional[Path] = None,
+        entries_per_chunk: int = 3,
+        output_path: Optional[Union[str, Path]] = None,
+        poll_interval: float = 30.0,
+        max_attempts: int = 3,
+        dedup_threshold: Optional[float] = None,
+        writer_options: Optional[Dict[str, Any]] = None,
+        state_path: Optional[Union[str, Path]] = None,
+    ) -> List[QAPair]:
+        """
+        Generate datasets from chunks with the provider's Batch API instead of interactive requests.
+
+        All prompts go into one batch job (split at 50,000 requests). Batch jobs are cheaper
+        and do not count against the interactive rate limits, but can take up to 24 hours.
+
+        Args:
+            chunks: List of text chunks to process
+            language: Language for prompt generation ('zhtw' or 'en')
+            gen_prompt_path: Optional custom prompt file path
+            entries_per_chunk: Number of QA pairs to generate per chunk
+            output_path: Optional path to save the dataset
+            poll_interval: Seconds between job status checks
+            max_attempts: Batch jobs per chunk; failed or unparseable requests are resubmitted
+                in a new batch until this many attempts were made
+            dedup_threshold: Skip chunks that are exact or near duplicates of an earlier chunk
+            writer_options: Options for the dataset writer picked by the extension of output_path
+            state_path: File keeping the ids of submitted jobs until their results are read, so a
+                restarted run re-attaches to them (defaults to `<output_path>.batches.json`)
+
+        Returns:
+            List of QAPair objects representing the generated dataset
+        """
+        return self._run_sync(
+            lambda: self._get_dataset_batch_async(
+                chunks,
+                language,
+                gen_prompt_path,
+                entries_per_chunk,
+                output_path,
+                poll_interval,
+                max_attempts,
+                dedup_threshold,
+                writer_options,
+                state_path,
             )
-        except RuntimeError:
-            return asyncio.run(
-                self._get_dataset_async(
-                    chunks,
-                    language,
-                    gen_prompt_path,
-                    entries_per_chunk,
-                    output_path
-                )
+        )
+
+    async def arun_pipeline(
+        self,
+        input_path: Union[str, Path],
+        output_path: Union[str, Path],
+        language: str = 'zhtw',
+        gen_prompt_path: Optional[Path] = None,
+        entries_per_chunk: int = 3,
+        chunk_size: int = 4096,
+        max_concurrency: int = 20,
+        resume: bool = False,
+        journal_path: Optional[Union[str, Path]] = None,
+        num_workers: int = 1,
+        chunk_strategy: Optional[ChunkStrategy] = None,
+        dedup_threshold: Optional[float] = None,
+        pack_tokens: Optional[int] = None,
+        writer_options: Optional[Dict[str, Any]] = None,
+        shard: Optional[Tuple[int, int]] = None,
+        file_timeout: Optional[float] = None,
+    ) -> int:
+        """Async version of run_pipeline."""
+        gen_prompt = self._load_prompt(language, gen_prompt_path)
+        chunk_generator = self._get_chunk_generator(
+            input_path, chunk_size, num_workers, file_timeout, chunk_strategy, shard
+        )
+        journal = self._open_journal(resume, output_path, journal_path)
+        dataset_generator = await self._get_dataset_generator(
+            gen_prompt, entries_per_chunk, max_concurrency, journal, pack_tokens
+        )
+
+        chunks = chunk_generator.astream(input_path)
+        deduplicator = None
+        if dedup_threshold is not None:
+            from .filters.chunk_dedup import ChunkDeduplicator  # numpy is only needed for dedup
+            deduplicator = ChunkDeduplicator(threshold=dedup_threshold)
+            chunks = deduplicator.afilter(chunks)
+
+        total_pairs = 0
+        try:
+            with get_writer(output_path, **(writer_options or {})) as writer:
+                # streamed responses hand each pair to the writer as soon as it is parsed
+                on_pair = (lambda qa_pair: writer.write([qa_pair])) if self.stream_responses else None
+                async for _, _, qa_pairs in dataset_generator.stream(chunks, on_pair=on_pair):
+                    if on_pair is None:
+                        writer.write(qa_pairs)
+                    # flush per chunk so a crash only loses what is still in flight (JSONL; columnar files need close())
+                    writer.flush()
+                    total_pairs += len(qa_pairs)
+        except IOError as e:
+            logger.error(f"Error writing to file {output_path}: {e}")
+            raise
+        finally:
+            self._finish_run(dataset_generator)
+            await self._release_client(dataset_generator.qa_generator.client)
+            if journal is not None:
+                journal.close()
+            if deduplicator is not None:
+                deduplicator.log_stats()
+
+        return total_pairs
+
+    def run_pipeline(
+        self,
+        input_path: Union[str, Path],
+        output_path: Union[str, Path],
+        language: str = 'zhtw',
+        gen_prompt_path: Optional[Path] = None,
+        entries_per_chunk: int = 3,
+        chunk_size: int = 4096,
+        max_concurrency: int = 20,
+        resume: bool = False,
+        journal_path: Optional[Union[str, Path]] = None,
+        num_workers: int = 1,
+        chunk_strategy: Optional[ChunkStrategy] = None,
+        dedup_threshold: Optional[float] = None,
+        pack_tokens: Optional[int] = None,
+        writer_options: Optional[Dict[str, Any]] = None,
+        shard: Optional[Tuple[int, int]] = None,
+        file_timeout: Optional[float] = None,
+    ) -> int:
+        """
+        Streaming convert -> chunk -> generate -> write pipeline.
+
+        Files are converted and chunked one at a time, chunks are sent to the LLM
+        as soon as a slot is free, and finished QA pairs are appended to the JSONL
+        output immediately. Memory stays bounded by the in-flight window instead of
+        by corpus size, and a crash keeps everything written so far.
+
+        Args:
+            input_path: File or directory to process
+            output_path: File the QA pairs are appended to; .jsonl(.gz/.zst), .parquet or .arrow
+            language: Language for prompt generation ('zhtw' or 'en')
+            gen_prompt_path: Optional custom prompt file path
+            entries_per_chunk: Number of QA pairs to generate per chunk
+            chunk_size: Size of text chunks
+            max_concurrency: Maximum number of chunks being generated at the same time
+            resume: Keep a checkpoint journal and skip chunks completed by a previous run;
+                their pairs are re-written from the journal without calling the LLM
+            journal_path: Optional journal location (defaults to `<output_path>.journal.sqlite`)
+            num_workers: Number of processes converting documents in parallel
+            chunk_strategy: Optional strategy overriding the default character-based splitting
+            dedup_threshold: Skip chunks that are exact or near duplicates of an earlier chunk
+            pack_tokens: Pack consecutive small chunks into one request of up to this many content tokens
+            writer_options: Options for the dataset writer picked by the extension of output_path
+            shard: (index, count) to only process the files hashed into that shard, so several
+                processes or machines can split one directory without coordination
+            file_timeout: With num_workers > 1, skip files whose conversion takes longer than this many seconds
+
+        Returns:
+            Number of QA pairs written
+        """
+        return self._run_sync(
+            lambda: self.arun_pipeline(
+                input_path,
+                output_path,
+                language,
+                gen_prompt_path,
+                entries_per_chunk,
+                chunk_size,
+                max_concurrency,
+                resume,
+                journal_path,
+                num_workers,
+                chunk_strategy,
+                dedup_threshold,
+                pack_tokens,
+                writer_options,
+                shard,
+                file_timeout,
             )
+        )
+
+    def filter_dataset(
+        self,
+        input_path: Union[str, Path],
+        output_path: Union[str, Path],
+        language: Optional[str] = None,
+        threshold: float = 0.8,
+        rejected_path: Optional[Union[str, Path]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Drop low-quality and near-duplicate QA pairs from a JSONL dataset (optionally .gz/.zst).
+
+        Args:
+            input_path: Generated dataset
+            output_path: Where the kept rows are written, unchanged
+            language: 'zhtw' or 'en' to also reject pairs mostly written in another script
+            threshold: Estimated similarity of instruction + output from which a pair is a duplicate
+            rejected_path: Optional JSONL of the rejected rows with a "reason" field
+
+        Returns:
+            Counts of seen, kept and rejected (by reason) rows
+        """
+        from .filters.qa_filter import QAFilter
+        stats = QAFilter(language=language, threshold=threshold).filter_jsonl(input_path, output_path, rejected_path)
+        return {'seen': stats.seen, 'kept': stats.kept, 'rejected': stats.rejected}
+
+    def save_dataset(self, dataset: List[QAPair], output_path: Union[str, Path], **writer_options):
+        """Save dataset with the writer matching the extension (.jsonl[.gz|.zst], .parquet, .arrow)."""
+        try:
+            with get_writer(output_path, **writer_options) as writer:
+                writer.write(dataset)
+        except IOError as e:
+            logger.error(f"Error writing to file {output_path}: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error occurred: {e}")
+            raise
 
     def save_to_jsonl(self, dataset: List[QAPair], output_path: Union[str, Path]):
         """Save dataset (list of QAPair) to a JSONL file."""
         try:
-            with Path(output_path).open('w', encoding='utf-8') as f:
-                for qa_pair in dataset:
-                    json_line = json.dumps(qa_pair.to_dict(), ensure_ascii=False)
-                    f.write(json_line + '\n')
+            with JsonlWriter(output_path) as writer:
+                writer.write(dataset)
         except IOError as e:
             logger.error(f"Error writing to file {output_path}: {e}")
             raise
         except Exception as e:
             logger.error(f"Unexpected error occurred: {e}")
-            raise
\ No newline at end of file
+            raise
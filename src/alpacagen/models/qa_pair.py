@@ -1,14 +1,96 @@
-## AlpacaGen
-from typing import Dict
+import sys
+import json
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 from dataclasses import dataclass
 
-@dataclass
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+@dataclass(slots=True, init=False, eq=False, repr=False)
 class Chunk:
-    content: str
+    document: str  ## text the chunk was cut from, or its content when span is None
+    span: Optional[Tuple[int, int]]  ## (start, end) offsets of the content in document
     source: str
-    idx: str  ## format: 01/17
+    index: int  ## 1-based position in its document
+    count: int  ## number of chunks in its document
+    label: Optional[str]  ## legacy idx kept verbatim when index/count do not reproduce it
+
+    def __init__(
+        self,
+        content: Optional[str],
+        source: str,
+        idx: Optional[str] = None,  ## legacy form, e.g. "01/17"
+        index: int = 1,
+        count: int = 1,
+        document: Optional[str] = None,
+        span: Optional[Tuple[int, int]] = None,
+    ):
+        self.label = None
+        if idx is not None:
+            idx = str(idx)
+            index, _, count = idx.partition('/')
+            try:
+                index, count = int(index), int(count or index)
+            except ValueError:
+                # e.g. "a/b": keep the label, position unknown
+                index, count = 1, 1
+                self.label = idx
+        if span is None:
+            self.document, self.span = content, None
+        else:
+            # all chunks of a document share its buffer; content is sliced out when it is read
+            assert document is not None, "span needs the document it points into"
+            self.document, self.span = document, (int(span[0]), int(span[1]))
+        # every chunk of a document shares one path string
+        self.source = sys.intern(str(source))
+        self.index = int(index)
+        self.count = int(count or index)
+        if idx is not None and self.label is None and self.idx != idx:
+            # e.g. "1/017", which the zero-padded form would not give back
+            self.label = idx
+
+    @property
+    def content(self) -> str:
+        if self.span is None:
+            return self.document
+        start, end = self.span
+        return self.document[start:end]
+
+    @content.setter
+    def content(self, content: str):
+        self.document, self.span = content, None
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Chunk):
+            return NotImplemented
+        return (self.content, self.source, self.idx) == (other.content, other.source, other.idx)
+
+    def __repr__(self) -> str:
+        span = f", span={self.span}" if self.span is not None else ""
+        return f"Chunk(content={self.content!r}, source={self.source!r}, index={self.index}, count={self.count}{span})"
 
-@dataclass
+    @property
+    def idx(self) -> str:
+        """ "01/17": the index zero-padded to the width of the count """
+        if self.label is not None:
+            return self.label
+        return f"{self.index:0{len(str(self.count))}d}/{self.count}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {
+            'content': self.content,
+            'source': self.source,
+            'idx': self.idx
+        }
+        if self.span is not None:
+            record['span'] = list(self.span)
+        return record
+
+    def to_json(self) -> str:
+        """ json.dumps(self.to_dict(), ensure_ascii=False) without the intermediate dict """
+        span = f', "span": [{self.span[0]}, {self.span[1]}]' if self.span is not None else ''
+        return f'{{"content": {_encode(self.content)}, "source": {_encode(self.source)}, "idx": {_encode(self.idx)}{span}}}'
+
+@dataclass(slots=True)
 class QAPair:
     instruction: str
     input: str
@@ -20,9 +102,22 @@ class QAPair:
             'instruction': str(self.instruction),
             'input': str(self.input),
             'output': str(self.output),
-            'source': {
-                'content': self.source.content,
-                'source': self.source.source,
-                'idx': self.source.idx
-            }
-        }
\ No newline at end of file
+            'source': self.source.to_dict()
+        }
+
+    def to_json(self, source_json: Optional[str] = None) -> str:
+        """ json.dumps(self.to_dict(), ensure_ascii=False), reusing `source_json` when given """
+        if source_json is None:
+            source_json = self.source.to_json()
+        return (
+            f'{{"instruction": {_encode(str(self.instruction))}, "input": {_encode(str(self.input))}, '
+            f'"output": {_encode(str(self.output))}, "source": {source_json}}}'
+        )
+
+def iter_json_lines(qa_pairs: Iterable[QAPair]) -> Iterator[str]:
+    """ QAPair.to_json for each pair; the chunk text is encoded once for consecutive pairs of a chunk """
+    source, source_json = None, None
+    for qa_pair in qa_pairs:
+        if qa_pair.source is not source:
+            source, source_json = qa_pair.source, qa_pair.source.to_json()
+        yield qa_pair.to_json(source_json)
@@ -0,0 +1,5 @@
+from .journal import ProgressJournal
+from .cache import ResponseCache
+from .conversion import ConversionCache
+
+__all__ = ['ProgressJournal', 'ResponseCache', 'ConversionCache']
\ No newline at end of file
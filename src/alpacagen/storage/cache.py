@@ -0,0 +1,83 @@
+import os
+import logging
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    Content-addressed on-disk store for LLM responses.
+    Each entry is a file named by its key; total size is capped and the least
+    recently used entries (by file mtime, refreshed on every hit) are evicted first.
+    """
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = 1 << 30):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for path in self.cache_dir.glob('*/*.txt'):
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.total_bytes += size
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.txt"
+
+    def get(self, key: str) -> Optional[str]:
+        if key not in self._index:
+            return None
+        path = self._path(key)
+        try:
+            text = path.read_text(encoding='utf-8')
+            os.utime(path)
+        except OSError:
+            self.total_bytes -= self._index.pop(key)
+            return None
+        self._index.move_to_end(key)
+        return text
+
+    def put(self, key: str, text: str):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f'.tmp{os.getpid()}')
+        tmp_path.write_text(text, encoding='utf-8')
+        os.replace(tmp_path, path)
+
+        self.total_bytes -= self._index.pop(key, 0)
+        self._index[key] = path.stat().st_size
+        self.total_bytes += self._index[key]
+        self._evict()
+
+    def delete(self, key: str):
+        size = self._index.pop(key, None)
+        if size is None:
+            return
+        self.total_bytes -= size
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
@@ -0,0 +1,80 @@
+import hashlib
+import sqlite3
+import logging
+from pathlib import Path
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+def file_digest(path: Union[str, Path]) -> str:
+    digest = hashlib.sha256()
+    with Path(path).open('rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ConversionCache:
+    """
+    Persistent cache of converted text per file.
+    An entry is valid while the file's path, size and mtime are unchanged and it was
+    produced by the same converter version. With `use_hash=True` a file whose
+    size/mtime changed but whose content hash did not (e.g. a fresh checkout) is still a hit.
+    """
+    def __init__(self, path: Union[str, Path], use_hash: bool = False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.use_hash = use_hash
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT, "
+            "converter_version TEXT, text TEXT)"
+        )
+        self.conn.commit()
+
+    def get(self, file: Union[str, Path], converter_version: str) -> Optional[str]:
+        file = Path(file)
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, sha256, converter_version, text FROM files WHERE path = ?",
+            (str(file.resolve()),),
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, sha256, version, text = row
+        if version != converter_version:
+            return None
+
+        stat = file.stat()
+        if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+            return text
+        if self.use_hash and stat.st_size == size and sha256 and file_digest(file) == sha256:
+            self.conn.execute(
+                "UPDATE files SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, str(file.resolve()))
+            )
+            self.conn.commit()
+            return text
+        return None
+
+    def put(self, file: Union[str, Path], converter_version: str, text: str):
+        file = Path(file)
+        stat = file.stat()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, converter_version, text) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                str(file.resolve()),
+                stat.st_size,
+                stat.st_mtime_ns,
+                file_digest(file) if self.use_hash else None,
+                converter_version,
+                text,
+            ),
+        )
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
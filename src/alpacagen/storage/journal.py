@@ -0,0 +1,68 @@
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from ..models.qa_pair import Chunk
+
+logger = logging.getLogger(__name__)
+
+class ProgressJournal:
+    """
+    Checkpoint journal for resumable generation runs.
+    Every completed chunk is stored in SQLite under a hash of its content, source,
+    prompt template and model, together with the QA pairs it produced.
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "key TEXT PRIMARY KEY, source TEXT, idx TEXT, pairs TEXT NOT NULL, created_at REAL)"
+        )
+        self.conn.commit()
+        self.hits = 0
+
+    @staticmethod
+    def default_path(output_path: Union[str, Path]) -> Path:
+        output_path = Path(output_path)
+        return output_path.with_name(output_path.name + '.journal.sqlite')
+
+    @staticmethod
+    def chunk_key(chunk: Chunk, prompt_template: str, llm_model: str, entries_per_chunk: int) -> str:
+        digest = hashlib.sha256()
+        for part in (chunk.content, chunk.source, chunk.idx, prompt_template, llm_model, str(entries_per_chunk)):
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict[str, str]]]:
+        row = self.conn.execute("SELECT pairs FROM chunks WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def record(self, key: str, chunk: Chunk, pairs: List[Dict[str, str]]):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO chunks (key, source, idx, pairs, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, str(chunk.source), chunk.idx, json.dumps(pairs, ensure_ascii=False), time.time()),
+        )
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,3 +1,3 @@
-from .chunk import ChunkStrategy, RecursiveChunkStrategy
+from .chunk import ChunkStrategy, RecursiveChunkStrategy, TokenChunkStrategy, OffsetChunkStrategy
 
-__all__ = ['ChunkStrategy', 'RecursiveChunkStrategy']
\ No newline at end of file
+__all__ = ['ChunkStrategy', 'RecursiveChunkStrategy', 'TokenChunkStrategy', 'OffsetChunkStrategy']
\ No newline at end of file
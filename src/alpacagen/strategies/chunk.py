@@ -1,7 +1,14 @@
-from typing import List, Union
+import re
+from typing import List, Optional, Sequence, Tuple, Union
 from pathlib import Path
 from abc import ABC, abstractmethod
 from ..models.qa_pair import Chunk
+from ..tokenizers import Tokenizer, HeuristicTokenizer, context_token_budget
+
+# a paragraph ends at a blank line, a sentence at terminal punctuation or a line break;
+# separators stay attached to the piece so joining pieces gives back the original text
+_PARAGRAPH = re.compile(r'.*?(?:\n[ \t]*\n\s*|\Z)', re.S)
+_SENTENCE = re.compile(r'.*?(?:[.!?](?=\s)|[。！？；]|\n|\Z)\s*', re.S)
 class ChunkStrategy(ABC):
     @abstractmethod
     def _split_text(self, text: str) -> List[str]:
@@ -10,12 +17,14 @@ class ChunkStrategy(ABC):
 
     def split(self, source: Union[str, Path], text: str) -> List[Chunk]:
         chunks = self._split_text(text)
+        source = str(source)
         return [
             Chunk(
                 content=chunk,
-                source=str(source),
-                idx=f"{str(n+1).zfill(len(str(len(chunks))))}/{len(chunks)}"
-            ) 
+                source=source,
+                index=n + 1,
+                count=len(chunks),
+            )
             for n, chunk in enumerate(chunks)
         ]
 
@@ -28,4 +37,178 @@ class RecursiveChunkStrategy(ChunkStrategy):
         )
     
     def _split_text(self, text: str) -> List[str]:
-        return self.splitter.split_text(text)
\ No newline at end of file
+        return self.splitter.split_text(text)
+
+# cut points from coarsest to finest; a chunk ends right after the last separator of the
+# coarsest kind that still fits, and only falls back to a hard cut when there is none
+OFFSET_SEPARATORS = (
+    ('\n\n',),
+    ('\n',),
+    ('。', '！', '？', '. ', '! ', '? '),
+    (' ',),
+)
+
+class OffsetChunkStrategy(ChunkStrategy):
+    """
+    Character-sized chunks kept as (start, end) offsets into the converted document.
+
+    Splits like RecursiveChunkStrategy (paragraphs, then lines, sentences and words) but
+    in one left-to-right pass: each chunk costs a few `str.rfind` calls over its own
+    window, so splitting is linear in the document size. No chunk text is copied;
+    every chunk points into the one document string, and its content is sliced out
+    when it is read (e.g. when the prompt is rendered). Chunks carry their span, so
+    the pairs generated from them reference the exact source text.
+    """
+    def __init__(
+        self,
+        chunk_size: int = 2048,
+        chunk_overlap: int = 128,
+        separators: Sequence[Tuple[str, ...]] = OFFSET_SEPARATORS,
+    ):
+        assert chunk_overlap < chunk_size, "chunk_overlap should be smaller than chunk_size"
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators
+
+    def _cut(self, text: str, floor: int, limit: int) -> int:
+        """ chunk end right after the best separator in [floor, limit), else limit """
+        for level in self.separators:
+            cut = -1
+            for separator in level:
+                found = text.rfind(separator, floor, limit)
+                if found != -1:
+                    cut = max(cut, found + len(separator))
+            if cut != -1:
+                return cut
+        return limit
+
+    def _next_start(self, text: str, start: int, end: int) -> int:
+        """ where the next chunk starts: at a word up to chunk_overlap characters back """
+        if not self.chunk_overlap:
+            return end
+        space = text.find(' ', max(end - self.chunk_overlap, start + 1), end)
+        return space + 1 if space != -1 else end
+
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        """ (start, end) of every chunk, without leading or trailing whitespace """
+        spans = []
+        start, end, length = 0, 0, len(text)
+        while start < length:
+            # a chunk has to reach past the previous one, or it could be nothing but overlap
+            floor = max(start + 1, end)
+            end = length if start + self.chunk_size >= length else self._cut(text, floor, start + self.chunk_size)
+            first, last = start, end
+            while first < last and text[first].isspace():
+                first += 1
+            while last > first and text[last - 1].isspace():
+                last -= 1
+            if first < last:
+                spans.append((first, last))
+            if end >= length:
+                break
+            start = self._next_start(text, start, end)
+        return spans
+
+    def _split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.spans(text)]
+
+    def split(self, source: Union[str, Path], text: str) -> List[Chunk]:
+        spans = self.spans(text)
+        source = str(source)
+        return [
+            Chunk(
+                content=None,
+                source=source,
+                index=n + 1,
+                count=len(spans),
+                document=text,
+                span=span,
+            )
+            for n, span in enumerate(spans)
+        ]
+
+class TokenChunkStrategy(ChunkStrategy):
+    """
+    Pack paragraphs (then sentences, then character windows for anything longer)
+    into chunks of at most `max_tokens` tokens as measured by `tokenizer`.
+    Every piece is counted once, so splitting stays linear in the document size.
+    """
+    def __init__(self, max_tokens: int = 2048, overlap_tokens: int = 0, tokenizer: Optional[Tokenizer] = None):
+        assert overlap_tokens < max_tokens, "overlap_tokens should be smaller than max_tokens"
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.tokenizer = tokenizer or HeuristicTokenizer()
+
+    @classmethod
+    def for_model(
+        cls,
+        context_window: int,
+        prompt_template: str,
+        max_tokens: int = 1024,
+        tokenizer: Optional[Tokenizer] = None,
+        overlap_tokens: int = 0,
+    ) -> 'TokenChunkStrategy':
+        """ size chunks to what is left of the context after the prompt template and the completion """
+        return cls(
+            max_tokens=context_token_budget(context_window, prompt_template, max_tokens, tokenizer),
+            overlap_tokens=overlap_tokens,
+            tokenizer=tokenizer,
+        )
+
+    def _hard_split(self, text: str, tokens: int) -> List[tuple]:
+        """ character windows for a single sentence longer than the budget """
+        pieces = []
+        chars_per_token = max(1, len(text) // max(tokens, 1))
+        start = 0
+        while start < len(text):
+            size = max(1, self.max_tokens * chars_per_token)
+            while True:
+                piece = text[start:start + size]
+                count = self.tokenizer.count(piece)
+                if count <= self.max_tokens or size == 1:
+                    break
+                size = max(1, size * self.max_tokens // count)
+            pieces.append((piece, count))
+            start += len(piece)
+        return pieces
+
+    def _pieces(self, text: str) -> List[tuple]:
+        pieces = []
+        for paragraph in _PARAGRAPH.findall(text):
+            if not paragraph:
+                continue
+            tokens = self.tokenizer.count(paragraph)
+            if tokens <= self.max_tokens:
+                pieces.append((paragraph, tokens))
+                continue
+            for sentence in _SENTENCE.findall(paragraph):
+                if not sentence:
+                    continue
+                tokens = self.tokenizer.count(sentence)
+                if tokens <= self.max_tokens:
+                    pieces.append((sentence, tokens))
+                else:
+                    pieces.extend(self._hard_split(sentence, tokens))
+        return pieces
+
+    def _split_text(self, text: str) -> List[str]:
+        chunks = []
+        current: List[tuple] = []
+        current_tokens = 0
+        for piece, tokens in self._pieces(text):
+            if current and current_tokens + tokens > self.max_tokens:
+                chunks.append(''.join(p for p, _ in current).strip())
+                # carry trailing pieces over as overlap, as long as the new piece still fits
+                overlap, overlap_tokens = [], 0
+                for previous, previous_tokens in reversed(current):
+                    if overlap_tokens + previous_tokens > self.overlap_tokens \
+                            or overlap_tokens + previous_tokens + tokens > self.max_tokens:
+                        break
+                    overlap.insert(0, (previous, previous_tokens))
+                    overlap_tokens += previous_tokens
+                current, current_tokens = overlap, overlap_tokens
+            current.append((piece, tokens))
+            current_tokens += tokens
+        if current:
+            chunks.append(''.join(p for p, _ in current).strip())
+        return [chunk for chunk in chunks if chunk]
@@ -0,0 +1,3 @@
+from .stub_server import StubOpenAIServer
+
+__all__ = ['StubOpenAIServer']
@@ -0,0 +1,396 @@
+import json
+import time
+import random
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+class _Handler(BaseHTTPRequestHandler):
+    server: '_StubHTTPServer'
+    # keep-alive, so tests can see whether clients reuse their connections
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.stub.connection_opened()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length)
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            return parse_multipart(content_type, raw)
+        return json.loads(raw or b'{}')
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self._read_body()
+        path = self.path.split('?')[0].removeprefix('/v1')
+        if path in stub.batch_routes:
+            self._send_json(*stub.batch_routes[path](body))
+            return
+        stub.record(self.path, body)
+        status, payload, *headers = stub.answer(path, body)
+        if body.get('stream') and status == 200:
+            self._send_stream(payload)
+        else:
+            self._send_json(status, payload, *headers)
+
+    def _send_stream(self, payload: Dict[str, Any]):
+        """ the answer as server-sent events of `stream_chunk_chars` characters each """
+        stub = self.server.stub
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        # the stream has no length, its end is the end of the connection
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event in stub.stream_events(payload):
+                if stub.stream_delay:
+                    time.sleep(stub.stream_delay)
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            stub.stream_cancelled()
+
+    def do_GET(self):
+        stub = self.server.stub
+        parts = self.path.split('?')[0].removeprefix('/v1').strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'batches':
+            self._send_json(*stub.retrieve_batch(parts[1]))
+        elif len(parts) == 3 and parts[0] == 'files' and parts[2] == 'content' and parts[1] in stub.files:
+            content = stub.files[parts[1]]['content']
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'not_found'}})
+
+    def do_DELETE(self):
+        stub = self.server.stub
+        parts = self.path.split('?')[0].removeprefix('/v1').strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'files':
+            self._send_json(*stub.delete_file(parts[1]))
+        else:
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'not_found'}})
+
+def parse_multipart(content_type: str, raw: bytes) -> Dict[str, Any]:
+    """ multipart/form-data body -> {field name: str, or bytes for file fields} """
+    message = BytesParser(policy=HTTP).parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + raw)
+    fields = {}
+    for part in message.iter_parts():
+        payload = part.get_payload(decode=True)
+        fields[part.get_param('name', header='content-disposition')] = (
+            payload if part.get_filename() else payload.decode('utf-8')
+        )
+    return fields
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    stub: 'StubOpenAIServer'
+
+class StubOpenAIServer:
+    """
+    Local OpenAI-compatible server for tests and benchmarks, answering with canned QA entries.
+
+    Implements `/v1/completions` and `/v1/chat/completions` (with or without
+    `response_format`, see `structured_output`). Use as a context manager and point
+    a client at `url`; every request body is kept in `requests`.
+
+    Faults are injected per request: `latency` (+ up to `latency_jitter`) seconds of delay,
+    then a 500 with probability `error_rate`, a 429 with `rate_limit_rate` or an answer the
+    parser cannot use with `malformed_rate`. `counters` tallies what was served.
+
+    The Batch API is covered too: `/v1/files` uploads and deletes, `/v1/batches` jobs
+    and `/v1/files/{id}/content` downloads. A job answers every line of its request
+    file (with the same fault injection) when it is created, but reports
+    `in_progress` for the first `batch_polls` retrievals. The first `batch_poll_errors`
+    retrievals fail with a 500.
+
+    Requests with `"stream": true` are answered as server-sent events of
+    `stream_chunk_chars` characters, `stream_delay` seconds apart; streams the
+    client hangs up on are counted in `cancelled_streams`.
+
+    Connections are kept alive (HTTP/1.1); `connections` counts the TCP connections accepted.
+    """
+    def __init__(
+        self,
+        entries_per_response: int = 3,
+        structured_output: bool = True,
+        port: int = 0,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        retry_after_ms: int = 50,
+        seed: Optional[int] = None,
+        batch_polls: int = 1,
+        batch_poll_errors: int = 0,
+        stream_chunk_chars: int = 8,
+        stream_delay: float = 0.0,
+    ):
+        self.entries_per_response = entries_per_response
+        self.structured_output = structured_output
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.retry_after_ms = retry_after_ms
+        self.batch_polls = batch_polls
+        self.batch_poll_errors = batch_poll_errors
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_delay = stream_delay
+        self.cancelled_streams = 0
+        self.connections = 0
+        self.counters = {'requests': 0, 'errors': 0, 'rate_limited': 0, 'malformed': 0}
+        self.requests: List[Tuple[str, Dict[str, Any]]] = []
+        self.routes = {
+            '/completions': self._completions,
+            '/chat/completions': self._chat_completions,
+        }
+        self.batch_routes = {
+            '/files': self._upload_file,
+            '/batches': self._create_batch,
+        }
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.deleted_files: List[str] = []
+        self._file_ids = 0
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = _StubHTTPServer(('127.0.0.1', port), _Handler)
+        self._httpd.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def record(self, path: str, body: Dict[str, Any]):
+        with self._lock:
+            self.requests.append((path, body))
+            self.counters['requests'] += 1
+
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections += 1
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def inject_fault(self) -> Optional[Tuple[int, Dict[str, Any], Dict[str, str]]]:
+        """ sleep the configured latency, then maybe replace the answer with an error """
+        if self.latency or self.latency_jitter:
+            with self._lock:
+                delay = self.latency + self._random.uniform(0, self.latency_jitter)
+            time.sleep(delay)
+        if self._roll(self.error_rate):
+            self._count('errors')
+            return 500, {'error': {'message': 'Injected server error', 'type': 'server_error'}}, {}
+        if self._roll(self.rate_limit_rate):
+            self._count('rate_limited')
+            return 429, {'error': {'message': 'Injected rate limit', 'type': 'rate_limit_exceeded'}}, {
+                'retry-after-ms': str(self.retry_after_ms),
+            }
+        return None
+
+    def answer(self, path: str, body: Dict[str, Any]) -> Tuple:
+        """ (status, payload[, headers]) of one inference request, after fault injection """
+        route = self.routes.get(path)
+        if route is None:
+            return 404, {'error': {'message': f'Unknown path {path}', 'type': 'not_found'}}
+        fault = self.inject_fault()
+        return fault or route(body)
+
+    def _store_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        with self._lock:
+            self._file_ids += 1
+            file_id = f"file-{self._file_ids}"
+            self.files[file_id] = {'content': content, 'object': {
+                'id': file_id,
+                'object': 'file',
+                'bytes': len(content),
+                'created_at': int(time.time()),
+                'filename': filename,
+                'purpose': purpose,
+                'status': 'processed',
+            }}
+        return self.files[file_id]['object']
+
+    def _upload_file(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        return 200, self._store_file(body['file'], 'upload.jsonl', body.get('purpose', 'batch'))
+
+    def _create_batch(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        request_file = self.files.get(body.get('input_file_id'))
+        if request_file is None:
+            return 404, {'error': {'message': 'Unknown input file', 'type': 'invalid_request_error'}}
+        outputs, errors = [], []
+        for n, line in enumerate(request_file['content'].decode('utf-8').splitlines()):
+            request = json.loads(line)
+            self.record(request['url'], request['body'])
+            status, payload, *_ = self.answer(request['url'].removeprefix('/v1'), request['body'])
+            (outputs if status == 200 else errors).append(json.dumps({
+                'id': f"batch_req_{n}",
+                'custom_id': request['custom_id'],
+                'response': {'status_code': status, 'request_id': f"req_{n}", 'body': payload},
+                'error': None,
+            }))
+        with self._lock:
+            batch_id = f"batch_{len(self.batches) + 1}"
+        output_file = self._store_file(''.join(line + '\n' for line in outputs).encode(), f'{batch_id}_output.jsonl', 'batch_output')
+        error_file = self._store_file(''.join(line + '\n' for line in errors).encode(), f'{batch_id}_error.jsonl', 'batch_output')
+        batch = {
+            'id': batch_id,
+            'object': 'batch',
+            'endpoint': body['endpoint'],
+            'input_file_id': body['input_file_id'],
+            'completion_window': body.get('completion_window', '24h'),
+            'created_at': int(time.time()),
+            'status': 'in_progress',
+            'output_file_id': None,
+            'error_file_id': None,
+            'request_counts': {'total': len(outputs) + len(errors), 'completed': 0, 'failed': 0},
+        }
+        with self._lock:
+            self.batches[batch_id] = {
+                'batch': batch,
+                'polls_left': self.batch_polls,
+                'result': {
+                    'status': 'completed',
+                    'output_file_id': output_file['id'] if outputs else None,
+                    'error_file_id': error_file['id'] if errors else None,
+                    'request_counts': {'total': len(outputs) + len(errors), 'completed': len(outputs), 'failed': len(errors)},
+                },
+            }
+        return 200, batch
+
+    def delete_file(self, file_id: str) -> Tuple[int, Dict[str, Any]]:
+        with self._lock:
+            if self.files.pop(file_id, None) is None:
+                return 404, {'error': {'message': f'Unknown file {file_id}', 'type': 'not_found'}}
+            self.deleted_files.append(file_id)
+        return 200, {'id': file_id, 'object': 'file', 'deleted': True}
+
+    def retrieve_batch(self, batch_id: str) -> Tuple[int, Dict[str, Any]]:
+        with self._lock:
+            job = self.batches.get(batch_id)
+            if job is None:
+                return 404, {'error': {'message': f'Unknown batch {batch_id}', 'type': 'not_found'}}
+            if self.batch_poll_errors > 0:
+                self.batch_poll_errors -= 1
+                return 500, {'error': {'message': 'Injected server error', 'type': 'server_error'}}
+            if job['polls_left'] > 0:
+                job['polls_left'] -= 1
+            else:
+                job['batch'].update(job['result'])
+            return 200, dict(job['batch'])
+
+    def stream_events(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """ a completion payload -> the chunk events streaming it piece by piece """
+        choice = payload['choices'][0]
+        chat = payload['object'] == 'chat.completion'
+        text = choice['message']['content'] if chat else choice['text']
+        pieces = [text[i:i + self.stream_chunk_chars] for i in range(0, len(text), self.stream_chunk_chars)]
+        events = []
+        for n, piece in enumerate(pieces):
+            finish_reason = 'stop' if n == len(pieces) - 1 else None
+            events.append({
+                'id': payload['id'],
+                'object': 'chat.completion.chunk' if chat else 'text_completion',
+                'created': payload['created'],
+                'model': payload['model'],
+                'choices': [
+                    {'index': 0, 'delta': {'content': piece}, 'finish_reason': finish_reason} if chat else
+                    {'index': 0, 'text': piece, 'finish_reason': finish_reason, 'logprobs': None}
+                ],
+            })
+        return events
+
+    def stream_cancelled(self):
+        with self._lock:
+            self.cancelled_streams += 1
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return [path for path, _ in self.requests]
+
+    def make_entries(self, prompt: str) -> List[Dict[str, str]]:
+        topic = prompt.strip().splitlines()[0][:40] if prompt.strip() else ''
+        return [
+            {'instruction': f'Question {n + 1} about {topic}', 'input': '', 'output': f'Answer {n + 1}'}
+            for n in range(self.entries_per_response)
+        ]
+
+    def completion_text(self, prompt: str) -> str:
+        if self._roll(self.malformed_rate):
+            self._count('malformed')
+            # prose around a truncated object, as when a model runs out of tokens
+            return 'Sure! Here are the questions:\n{"instruction": "Question 1", "output": "Answ'
+        return '\n'.join(json.dumps(entry, ensure_ascii=False) for entry in self.make_entries(prompt))
+
+    def _completions(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        return 200, {
+            'id': 'cmpl-stub',
+            'object': 'text_completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'text': self.completion_text(body.get('prompt', '')), 'finish_reason': 'stop', 'logprobs': None}],
+        }
+
+    def _chat_completions(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        prompt = body['messages'][-1]['content']
+        if body.get('response_format'):
+            if not self.structured_output:
+                return 400, {'error': {'message': 'response_format is not supported', 'type': 'invalid_request_error'}}
+            content = json.dumps({'entries': self.make_entries(prompt)}, ensure_ascii=False)
+        else:
+            content = self.completion_text(prompt)
+        return 200, {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        }
+
+    def start(self) -> 'StubOpenAIServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> 'StubOpenAIServer':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
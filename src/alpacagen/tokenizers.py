@@ -0,0 +1,61 @@
+## AlpacaGen
+from abc import ABC, abstractmethod
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate without a tokenizer.
+    CJK characters are roughly one token each, other text about four characters per token.
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+class Tokenizer(ABC):
+    @abstractmethod
+    def count(self, text: str) -> int:
+        pass
+
+class HeuristicTokenizer(Tokenizer):
+    """ dependency-free estimate, see estimate_tokens """
+    def count(self, text: str) -> int:
+        return estimate_tokens(text)
+
+class TiktokenTokenizer(Tokenizer):
+    """ exact counts for OpenAI models, requires `tiktoken` """
+    def __init__(self, model: str = 'gpt-4o', encoding: str = None):
+        try:
+            import tiktoken
+        except ImportError as e:
+            raise ImportError("TiktokenTokenizer requires tiktoken: pip install tiktoken") from e
+        self.encoding = tiktoken.get_encoding(encoding) if encoding else tiktoken.encoding_for_model(model)
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+class HuggingFaceTokenizer(Tokenizer):
+    """ counts with a transformers tokenizer, given as an instance or a model name """
+    def __init__(self, tokenizer):
+        if isinstance(tokenizer, str):
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+        self.tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+def context_token_budget(
+    context_window: int,
+    prompt_template: str,
+    max_tokens: int = 1024,
+    tokenizer: Tokenizer = None,
+    entries_per_chunk: int = 3,
+) -> int:
+    """ tokens left for chunk text once the rendered prompt template and the completion are accounted for """
+    tokenizer = tokenizer or HeuristicTokenizer()
+    template_tokens = tokenizer.count(prompt_template.format(text='', entries_per_chunk=entries_per_chunk))
+    budget = context_window - template_tokens - max_tokens
+    if budget <= 0:
+        raise ValueError(
+            f"Context window {context_window} is too small for the prompt template "
+            f"({template_tokens} tokens) plus max_tokens {max_tokens}"
+        )
+    return budget
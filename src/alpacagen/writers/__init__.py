@@ -0,0 +1,16 @@
+from pathlib import Path
+from typing import Union
+from .base import DatasetWriter
+from .jsonl import JsonlWriter
+from .arrow import ParquetWriter, ArrowWriter
+
+def get_writer(output_path: Union[str, Path], **options) -> DatasetWriter:
+    """ writer picked by file extension: .parquet, .arrow/.feather, anything else is JSONL (.gz/.zst compressed) """
+    suffix = Path(output_path).suffix
+    if suffix == '.parquet':
+        return ParquetWriter(output_path, **options)
+    if suffix in ('.arrow', '.feather'):
+        return ArrowWriter(output_path, **options)
+    return JsonlWriter(output_path, **options)
+
+__all__ = ['DatasetWriter', 'JsonlWriter', 'ParquetWriter', 'ArrowWriter', 'get_writer']
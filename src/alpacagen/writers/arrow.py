@@ -0,0 +1,116 @@
+from abc import abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+from ..models.qa_pair import QAPair
+from .base import DatasetWriter, split_suffix
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Parquet/Arrow output requires pyarrow: pip install alpacagen[parquet]") from e
+    return pyarrow
+
+class _ColumnarWriter(DatasetWriter):
+    """
+    Normalized columnar output: a pairs table (instruction, input, output, chunk_id)
+    and a `<stem>.chunks` table (chunk_id, source, idx, content) holding each chunk once.
+    Rows are buffered into batches of `batch_size` before they are written.
+    """
+    suffix = ''
+
+    def __init__(self, output_path: Union[str, Path], batch_size: int = 65536):
+        super().__init__()
+        self.pa = _require_pyarrow()
+        stem, suffix, _ = split_suffix(output_path)
+        self.pairs_path = Path(output_path)
+        self.chunks_path = stem.with_name(stem.name + '.chunks' + (suffix or self.suffix))
+        self.batch_size = batch_size
+        self.pairs_schema = self.pa.schema([
+            ('instruction', self.pa.string()),
+            ('input', self.pa.string()),
+            ('output', self.pa.string()),
+            ('chunk_id', self.pa.int64()),
+        ])
+        self.chunks_schema = self.pa.schema([
+            ('chunk_id', self.pa.int64()),
+            ('source', self.pa.string()),
+            ('idx', self.pa.string()),
+            ('content', self.pa.string()),
+        ])
+        self._pairs: Dict[str, List] = {name: [] for name in self.pairs_schema.names}
+        self._chunks: Dict[str, List] = {name: [] for name in self.chunks_schema.names}
+        self._pairs_writer = None
+        self._chunks_writer = None
+        self._closed = False
+
+    @abstractmethod
+    def _open(self, path: Path, schema):
+        """ open a writer for one table at `path` """
+
+    def write(self, qa_pairs: Iterable[QAPair]):
+        for qa_pair in qa_pairs:
+            chunk_id, is_new = self.chunk_id(qa_pair.source)
+            if is_new:
+                chunk = qa_pair.source
+                self._chunks['chunk_id'].append(chunk_id)
+                self._chunks['source'].append(str(chunk.source))
+                self._chunks['idx'].append(chunk.idx)
+                self._chunks['content'].append(chunk.content)
+            self._pairs['instruction'].append(str(qa_pair.instruction))
+            self._pairs['input'].append(str(qa_pair.input))
+            self._pairs['output'].append(str(qa_pair.output))
+            self._pairs['chunk_id'].append(chunk_id)
+            self.pairs_written += 1
+        if len(self._pairs['chunk_id']) >= self.batch_size:
+            self._write_batches()
+
+    def _write_batches(self):
+        if self._pairs_writer is None:
+            self.pairs_path.parent.mkdir(parents=True, exist_ok=True)
+            self._pairs_writer = self._open(self.pairs_path, self.pairs_schema)
+            self._chunks_writer = self._open(self.chunks_path, self.chunks_schema)
+            self.paths = [self.pairs_path, self.chunks_path]
+        for writer, columns, schema in (
+            (self._pairs_writer, self._pairs, self.pairs_schema),
+            (self._chunks_writer, self._chunks, self.chunks_schema),
+        ):
+            if columns[schema.names[0]]:
+                writer.write_batch(self.pa.RecordBatch.from_pydict(columns, schema=schema))
+                for values in columns.values():
+                    values.clear()
+
+    def flush(self):
+        # the files are unreadable without the footer close() writes, so writing a small
+        # row group per flush would only bloat them
+        pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._write_batches()
+        for writer in (self._pairs_writer, self._chunks_writer):
+            if writer is not None:
+                writer.close()
+        self._pairs_writer = self._chunks_writer = None
+
+class ParquetWriter(_ColumnarWriter):
+    """ Parquet files (zstd-compressed columns), one row group per batch """
+    suffix = '.parquet'
+
+    def __init__(self, output_path: Union[str, Path], batch_size: int = 65536, compression: Optional[str] = 'zstd'):
+        super().__init__(output_path, batch_size)
+        self.compression = compression
+
+    def _open(self, path: Path, schema):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(str(path), schema, compression=self.compression)
+
+class ArrowWriter(_ColumnarWriter):
+    """ Arrow IPC (Feather v2) files, uncompressed so loaders can memory-map them """
+    suffix = '.arrow'
+
+    def _open(self, path: Path, schema):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(str(path), schema)
@@ -0,0 +1,59 @@
+import hashlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from ..models.qa_pair import QAPair, Chunk
+
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+def split_suffix(path: Union[str, Path]) -> Tuple[Path, str, Optional[str]]:
+    """ 'out/data.jsonl.zst' -> (Path('out/data'), '.jsonl', 'zstd') """
+    path = Path(path)
+    compression = None
+    for name, suffix in COMPRESSION_SUFFIXES.items():
+        if path.suffix == suffix:
+            compression = name
+            path = path.with_suffix('')
+    return path.with_suffix(''), path.suffix, compression
+
+class DatasetWriter(ABC):
+    """
+    Incremental dataset writer, used as a context manager:
+
+        with get_writer('out/data.parquet') as writer:
+            writer.write(qa_pairs)
+
+    Normalized writers store each chunk's text once and let pairs refer to it by
+    `chunk_id`; `paths` lists every file written.
+    """
+    def __init__(self):
+        self.paths: List[Path] = []
+        self.pairs_written = 0
+        self._chunk_ids: Dict[Tuple[str, str, bytes], int] = {}
+
+    def chunk_id(self, chunk: Chunk) -> Tuple[int, bool]:
+        """ stable id of a chunk within this output, and whether it is new """
+        # keyed by a digest so the writer does not keep every chunk's text alive
+        key = (str(chunk.source), chunk.idx, hashlib.blake2b(chunk.content.encode('utf-8'), digest_size=16).digest())
+        chunk_id = self._chunk_ids.get(key)
+        if chunk_id is not None:
+            return chunk_id, False
+        chunk_id = self._chunk_ids[key] = len(self._chunk_ids)
+        return chunk_id, True
+
+    @abstractmethod
+    def write(self, qa_pairs: Iterable[QAPair]):
+        pass
+
+    def flush(self):
+        """ push buffered records to disk, e.g. after each chunk of a streaming run """
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,148 @@
+import gzip
+import json
+import logging
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Optional, Union
+from ..models.qa_pair import QAPair, iter_json_lines
+from .base import COMPRESSION_SUFFIXES, DatasetWriter, split_suffix
+
+logger = logging.getLogger(__name__)
+
+def _open_compressed(path: Path, compression: Optional[str], level: Optional[int]) -> BinaryIO:
+    if compression is None:
+        return path.open('wb', buffering=1 << 20)
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=level if level is not None else 6)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("zstd compression requires zstandard: pip install zstandard") from e
+        compressor = zstandard.ZstdCompressor(level=level if level is not None else 3)
+        return compressor.stream_writer(path.open('wb'), closefd=True)
+    raise ValueError(f"Unknown compression {compression!r}, expected one of {list(COMPRESSION_SUFFIXES)}")
+
+class ShardedFile:
+    """
+    Byte sink that rolls over to a new shard once `shard_bytes` of uncompressed data
+    were written: data-00000.jsonl.zst, data-00001.jsonl.zst, ...
+    Without `shard_bytes` everything goes to `path` as is.
+    """
+    def __init__(
+        self,
+        path: Union[str, Path],
+        compression: Optional[str] = None,
+        shard_bytes: Optional[int] = None,
+        level: Optional[int] = None,
+    ):
+        self.path = Path(path)
+        self.compression = compression
+        self.shard_bytes = shard_bytes
+        self.level = level
+        self.paths: List[Path] = []
+        self._file: Optional[BinaryIO] = None
+        self._written = 0
+
+    def _next_path(self) -> Path:
+        if self.shard_bytes is None:
+            return self.path
+        stem, suffix, _ = split_suffix(self.path)
+        suffix += COMPRESSION_SUFFIXES[self.compression] if self.compression else ''
+        return stem.with_name(f"{stem.name}-{len(self.paths):05d}{suffix}")
+
+    def write(self, data: bytes):
+        if self._file is not None and self.shard_bytes is not None and self._written >= self.shard_bytes:
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            path = self._next_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = _open_compressed(path, self.compression, self.level)
+            self.paths.append(path)
+            self._written = 0
+        self._file.write(data)
+        self._written += len(data)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if not self.paths:
+            # an empty dataset still produces its (empty) output file
+            self.write(b'')
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class JsonlWriter(DatasetWriter):
+    """
+    JSON Lines output, optionally gzip/zstd compressed and split into size-based shards.
+
+    By default every line is `QAPair.to_dict()`, the same records `save_to_jsonl` writes.
+    With `normalized=True` pair lines carry a `chunk_id` instead of the chunk, and each
+    chunk is written once to a `<stem>.chunks.jsonl` sidecar.
+    """
+    def __init__(
+        self,
+        output_path: Union[str, Path],
+        compression: Optional[str] = None,
+        shard_bytes: Optional[int] = None,
+        normalized: bool = False,
+        level: Optional[int] = None,
+    ):
+        super().__init__()
+        stem, suffix, inferred = split_suffix(output_path)
+        compression = compression or inferred
+        self.normalized = normalized
+        self.pairs = ShardedFile(output_path, compression, shard_bytes, level)
+        self.chunks = ShardedFile(
+            stem.with_name(stem.name + '.chunks' + (suffix or '.jsonl') + COMPRESSION_SUFFIXES.get(compression, '')),
+            compression,
+            shard_bytes,
+            level,
+        ) if normalized else None
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def write(self, qa_pairs: Iterable[QAPair]):
+        if not self.normalized:
+            lines = list(iter_json_lines(qa_pairs))
+            if lines:
+                self.pairs.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                self.pairs_written += len(lines)
+            return
+
+        lines, chunk_lines = [], []
+        for qa_pair in qa_pairs:
+            chunk_id, is_new = self.chunk_id(qa_pair.source)
+            if is_new:
+                chunk = qa_pair.source
+                chunk_lines.append(self._encode({
+                    'chunk_id': chunk_id,
+                    'source': chunk.source,
+                    'idx': chunk.idx,
+                    'content': chunk.content,
+                }))
+            lines.append(self._encode({
+                'instruction': str(qa_pair.instruction),
+                'input': str(qa_pair.input),
+                'output': str(qa_pair.output),
+                'chunk_id': chunk_id,
+            }))
+        # one encode + write per batch instead of per line
+        if chunk_lines:
+            self.chunks.write(('\n'.join(chunk_lines) + '\n').encode('utf-8'))
+        if lines:
+            self.pairs.write(('\n'.join(lines) + '\n').encode('utf-8'))
+            self.pairs_written += len(lines)
+
+    def flush(self):
+        self.pairs.flush()
+        if self.chunks is not None:
+            self.chunks.flush()
+
+    def close(self):
+        self.pairs.close()
+        if self.chunks is not None:
+            self.chunks.close()
+        self.paths = self.pairs.paths + (self.chunks.paths if self.chunks is not None else [])
@@ -1,3 +1,11 @@
+import re
+import time
+import random
+import sys
+import gzip
+import subprocess
+import json
+import asyncio
 import pytest
 from pathlib import Path
 from alpacagen import (
@@ -5,8 +13,21 @@ from alpacagen import (
     QAPair,
     Chunk,
     RecursiveChunkStrategy,
+    TokenChunkStrategy,
+    OffsetChunkStrategy,
     MarkItDownConverter
 )
+from alpacagen.generators import SlidingWindowScheduler, OpenAIClient
+from alpacagen.generators.client import BaseLLMClient
+from alpacagen.generators import ChunkGenerator, HuggingFaceClient, QAGenerator, QADatasetGenerator
+from alpacagen.converters.text import TextConverter
+from alpacagen.generators import CachedLLMClient, ClientPool, Endpoint, BatchJobRunner
+from alpacagen.storage import ResponseCache, ConversionCache
+from alpacagen.testing import StubOpenAIServer
+from alpacagen.writers import get_writer
+from alpacagen.cli import main as cli_main, merge_outputs, shard_output_path
+from alpacagen import instrumentation
+from alpacagen.generators.ratelimit import RateLimiter, parse_retry_after
 
 # Test data
 SAMPLE_TEXT = """# Test Document
@@ -26,6 +47,26 @@ def sample_text_file(tmp_path):
     file_path.write_text(SAMPLE_TEXT)
     return file_path
 
+class FakeLLMClient(BaseLLMClient):
+    """Answers every prompt with one valid entry and counts the calls."""
+    def __init__(self, llm_model: str = 'fake-model'):
+        self.llm_model = llm_model
+        self.calls = 0
+        self.closed = 0
+
+    async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
+        self.calls += 1
+        return '{"instruction": "Summarize the content", "input": "", "output": "Summary"}'
+
+    async def aclose(self):
+        self.closed += 1
+
+@pytest.fixture
+def fake_llm_client(mocker):
+    client = FakeLLMClient()
+    mocker.patch.object(AlpacaGen, '_get_client', mocker.AsyncMock(return_value=client))
+    return client
+
 @pytest.fixture
 def mock_openai_client(mocker):
     mock_client = mocker.Mock()
@@ -67,6 +108,227 @@ class TestQAPair:
         assert result["output"] == "Test output"
         assert "source" in result
 
+    def test_compact_chunk_keeps_legacy_idx_and_serialization(self):
+        legacy = Chunk(content="Test content", source="docs/manual.pdf", idx="03/17")
+        chunk = Chunk(content="Test content", source="".join(["docs/", "manual.pdf"]), index=3, count=17)
+        assert chunk == legacy and chunk.idx == "03/17"
+        assert chunk.source is legacy.source
+        assert not hasattr(chunk, '__dict__')
+
+        qa_pair = QAPair(instruction="問題", input="", output='say "hi"\n', source=chunk)
+        assert qa_pair.to_json() == json.dumps(qa_pair.to_dict(), ensure_ascii=False)
+
+    def test_legacy_idx_that_is_not_numeric_round_trips(self):
+        for idx in ("intro/appendix", "01/04", "7"):
+            chunk = Chunk(content="Test content", source="doc.txt", idx=idx)
+            assert chunk.idx == chunk.to_dict()["idx"] == json.loads(chunk.to_json())["idx"] == idx
+        assert Chunk(content="x", source="doc.txt", idx="a/b") != Chunk(content="x", source="doc.txt", idx="c/d")
+
+class TestResponseParsing:
+    def test_recovers_fenced_pretty_printed_array(self):
+        response = """Here are the questions:
+```json
+[
+  {
+    "instruction": "What does {x} mean?",
+    "input": "",
+    "output": "A placeholder"
+  },
+  {"instruction": "Second", "input": "", "output": "Answer",}
+]
+```
+Let me know if you need more."""
+        entries = QAGenerator.parsing_response(response)
+        assert [entry['instruction'] for entry in entries] == ["What does {x} mean?", "Second"]
+
+    def test_incremental_feed_matches_single_pass(self):
+        from alpacagen.generators.parsing import JsonObjectExtractor, extract_json_objects
+        response = 'noise { not json\n{"instruction": "a", "input": "", "output": "b \\" }"}\n{"entries": [{"instruction": "c", "output": "d"}]}'
+        extractor = JsonObjectExtractor()
+        streamed = []
+        for ch in response:
+            streamed.extend(extractor.feed(ch))
+        streamed.extend(extractor.close())
+        assert streamed == extract_json_objects(response)
+        assert [entry['instruction'] for entry in QAGenerator.parsing_response(response)] == ["a", "c"]
+
+    def test_broken_object_is_not_rescanned_per_nesting_level(self):
+        from alpacagen.generators.parsing import extract_json_objects
+        depth = 500
+        response = '{"x": ' * depth + '{"instruction": "a", "output": "b",}' + (' oops' + ' ' * 400 + '}') * depth + ' {"instruction": "c"}'
+        started = time.perf_counter()
+        objects = extract_json_objects(response)
+        assert time.perf_counter() - started < 1.0
+        assert objects == [{"instruction": "a", "output": "b"}, {"instruction": "c"}]
+
+    @pytest.mark.asyncio
+    async def test_parse_stats(self):
+        client = FakeLLMClient()
+        qa_generator = QAGenerator(client, 'fake-model', "{text} {entries_per_chunk}")
+        chunk = Chunk(content="Test content", source="Test source", idx="01/01")
+        pairs = await qa_generator.generate(chunk, 1)
+
+        assert len(pairs) == 1 and pairs[0].source is chunk
+        assert qa_generator.parse_stats.recovery_rate == 1.0
+        assert qa_generator.parse_stats.parse_retries == 0
+
+class TestStructuredOutput:
+    @pytest.mark.asyncio
+    async def test_structured_generation_against_stub(self):
+        chunk = Chunk(content="Test content", source="Test source", idx="01/01")
+        with StubOpenAIServer(entries_per_response=2) as server:
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            qa_generator = QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}", structured_output=True)
+            pairs = await qa_generator.generate(chunk, 2)
+
+        assert [pair.output for pair in pairs] == ["Answer 1", "Answer 2"]
+        assert server.paths() == ['/v1/chat/completions']
+        assert server.requests[0][1]['response_format']['type'] == 'json_schema'
+        assert qa_generator.parse_stats.structured_responses == 1
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_text_when_unsupported(self):
+        chunk = Chunk(content="Test content", source="Test source", idx="01/01")
+        with StubOpenAIServer(entries_per_response=2, structured_output=False) as server:
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            qa_generator = QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}", structured_output=True)
+            first = await qa_generator.generate(chunk, 2)
+            second = await qa_generator.generate(chunk, 2)
+
+        assert len(first) == len(second) == 2
+        assert server.paths() == ['/v1/chat/completions', '/v1/completions', '/v1/completions']
+        assert qa_generator.structured_output is False
+
+    @pytest.mark.asyncio
+    async def test_other_bad_requests_fall_back_for_one_request_only(self):
+        class OversizedOnceClient(FakeLLMClient):
+            supports_structured_output = True
+
+            async def get_structured_response(self, prompt, schema, max_tokens=1024):
+                if 'oversized' in prompt:
+                    error = RuntimeError("This model's maximum context length is 8192 tokens")
+                    error.status_code = 400
+                    raise error
+                return '{"entries": [{"instruction": "Q", "input": "", "output": "structured"}]}'
+
+        qa_generator = QAGenerator(OversizedOnceClient(), 'fake-model', "{text} {entries_per_chunk}", structured_output=True)
+        oversized = await qa_generator.generate(Chunk(content="oversized chunk", source="a.txt"), 1)
+        normal = await qa_generator.generate(Chunk(content="normal chunk", source="b.txt"), 1)
+
+        assert [pair.output for pair in oversized] == ["Summary"]
+        assert [pair.output for pair in normal] == ["structured"]
+        assert qa_generator.structured_output is True
+
+    @pytest.mark.asyncio
+    async def test_first_try_parses_are_counted_per_path(self):
+        class MixedClient(FakeLLMClient):
+            supports_structured_output = True
+            text_calls = 0
+
+            async def get_structured_response(self, prompt, schema, max_tokens=1024):
+                if 'oversized' in prompt:
+                    error = RuntimeError("This model's maximum context length is 8192 tokens")
+                    error.status_code = 400
+                    raise error
+                return '{"entries": [{"instruction": "Q", "input": "", "output": "structured"}]}'
+
+            async def get_response(self, prompt, max_tokens=1024):
+                self.text_calls += 1
+                return "no pairs here" if self.text_calls == 1 else await super().get_response(prompt, max_tokens)
+
+        qa_generator = QAGenerator(MixedClient(), 'fake-model', "{text} {entries_per_chunk}", structured_output=True)
+        await qa_generator.generate(Chunk(content="oversized chunk", source="a.txt"), 1)
+        await qa_generator.generate(Chunk(content="normal chunk", source="b.txt"), 1)
+
+        stats = qa_generator.parse_stats
+        assert (stats.structured_first_tries, stats.structured_first_try_parsed, stats.structured_parse_retries) == (1, 1, 0)
+        assert (stats.text_first_tries, stats.text_first_try_parsed, stats.text_parse_retries) == (1, 0, 1)
+        assert stats.parse_retries == 1
+        assert stats.retries_avoided == 1.0
+
+class TestStubServerFaults:
+    @pytest.mark.asyncio
+    async def test_injected_faults_are_counted(self):
+        chunk = Chunk(content="Test content", source="Test source", idx="01/01")
+        with StubOpenAIServer(malformed_rate=1.0, seed=0) as server:
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            qa_generator = QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}")
+            assert await qa_generator.generate(chunk, 3) is None
+        assert server.counters == {'requests': 3, 'errors': 0, 'rate_limited': 0, 'malformed': 3}
+        assert qa_generator.parse_stats.parse_retries == 3
+
+        with StubOpenAIServer(rate_limit_rate=1.0, retry_after_ms=1) as server:
+            client = OpenAIClient(
+                api_key='test-key',
+                base_url=server.url,
+                rate_limiter=RateLimiter(backoff_base=0.001),
+                max_rate_limit_retries=2,
+            )
+            with pytest.raises(Exception) as error:
+                await client.get_response("prompt")
+        assert getattr(error.value, 'status_code', None) == 429
+        assert server.counters['rate_limited'] == 3
+
+class PackingLLMClient(BaseLLMClient):
+    """Answers packed prompts with one entry per passage, except passages mentioning 'skip'."""
+    def __init__(self):
+        self.llm_model = 'fake-model'
+        self.prompts = []
+        self.max_tokens = []
+
+    async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
+        self.prompts.append(prompt)
+        self.max_tokens.append(max_tokens)
+        passages = re.findall(r'\[passage (\d+)\]\n(\S+)', prompt)
+        if not passages:
+            return json.dumps({"instruction": "Q", "input": "", "output": prompt.split()[0]})
+        return '\n'.join(
+            json.dumps({"instruction": "Q", "input": "", "output": content, "chunk_id": int(chunk_id)})
+            for chunk_id, content in passages if 'skip' not in content
+        )
+
+class TestPromptPacking:
+    def test_pairs_are_attributed_to_their_chunk(self):
+        client = PackingLLMClient()
+        chunks = [Chunk(content=f"text{i}", source="faq.txt", idx=f"{i + 1:02d}/05") for i in range(4)]
+        chunks.append(Chunk(content="skip" + "x" * 400, source="faq.txt", idx="05/05"))
+        dataset_generator = QADatasetGenerator(
+            QAGenerator(client, 'fake-model', "{text}"),
+            entries_per_chunk=1,
+            pack_tokens=64,
+        )
+        pairs = asyncio.run(dataset_generator.generate(chunks))
+
+        # four small chunks share one request, the large one is sent on its own
+        assert [pair.source.idx for pair in pairs] == ["01/05", "02/05", "03/05", "04/05", "05/05"]
+        assert [pair.output for pair in pairs[:4]] == ["text0", "text1", "text2", "text3"]
+        assert len(client.prompts) == 2
+        assert dataset_generator.qa_generator.pack_stats.requests_saved == 3
+
+    def test_missing_chunks_fall_back_to_single_requests(self):
+        client = PackingLLMClient()
+        chunks = [Chunk(content=content, source="faq.txt", idx=f"0{i + 1}/02") for i, content in enumerate(["keep", "skip"])]
+        qa_generator = QAGenerator(client, 'fake-model', "{text}")
+        results = asyncio.run(qa_generator.generate_packed(chunks, 1))
+
+        assert [pair.output for pair in results[0]] == ["keep"]
+        assert [pair.output for pair in results[1]] == ["skip"]
+        assert qa_generator.pack_stats.fallbacks == 1
+
+    def test_packs_fit_the_model_output_limit(self):
+        client = PackingLLMClient()
+        chunks = [Chunk(content=f"text{i}", source="faq.txt", index=i + 1, count=6) for i in range(6)]
+        dataset_generator = QADatasetGenerator(
+            QAGenerator(client, 'fake-model', "{text}", max_output_tokens=2048),
+            entries_per_chunk=2,
+            pack_tokens=1000,
+        )
+        asyncio.run(dataset_generator.generate(chunks))
+
+        # 2048 tokens hold 8 entries at 256 each, so 4 chunks of 2 entries per pack
+        assert [len(re.findall(r"\[passage \d+\]\n", prompt)) for prompt in client.prompts] == [4, 2]
+        assert client.max_tokens == [2048, 1024]
+
 class TestChunkStrategy:
     def test_recursive_chunk_strategy(self):
         strategy = RecursiveChunkStrategy(chunk_size=100, chunk_overlap=20)
@@ -76,6 +338,49 @@ class TestChunkStrategy:
         assert all(isinstance(chunk, Chunk) for chunk in chunks)
         assert all(len(chunk.content) <= 100 for chunk in chunks)
 
+    def test_token_chunk_strategy_respects_budget(self):
+        strategy = TokenChunkStrategy(max_tokens=40, overlap_tokens=10)
+        text = SAMPLE_TEXT + "\n\n" + "這是一段繁體中文的測試內容。" * 20 + "\n\n" + "x" * 600
+        chunks = strategy.split("test.txt", text)
+
+        assert len(chunks) > 1
+        assert all(strategy.tokenizer.count(chunk.content) <= 40 for chunk in chunks)
+        assert "Section 2" in "".join(chunk.content for chunk in chunks)
+
+    def test_token_budget_from_model_context(self):
+        template = "Write {entries_per_chunk} questions about:\n{text}"
+        strategy = TokenChunkStrategy.for_model(context_window=2048, prompt_template=template, max_tokens=1024)
+        assert 1000 < strategy.max_tokens < 1024
+        with pytest.raises(ValueError):
+            TokenChunkStrategy.for_model(context_window=1000, prompt_template=template, max_tokens=1024)
+
+class TestOffsetChunkStrategy:
+    def test_chunks_are_spans_of_one_document(self):
+        text = SAMPLE_TEXT + "\n\n" + "這是一段繁體中文的測試內容。" * 20 + "\n\n" + "x" * 300
+        strategy = OffsetChunkStrategy(chunk_size=100, chunk_overlap=20)
+        chunks = strategy.split("test.txt", text)
+
+        assert len(chunks) > 3
+        assert all(chunk.document is text for chunk in chunks)
+        assert all(0 < len(chunk.content) <= 100 and chunk.content == chunk.content.strip() for chunk in chunks)
+        assert [text[start:end] for start, end in strategy.spans(text)] == [chunk.content for chunk in chunks]
+        assert chunks[0].content.startswith("# Test Document") and chunks[0].content.endswith("paragraphs.")
+        assert any(chunk.content.endswith("。") for chunk in chunks)
+        # every non-blank character is in some chunk, and chunks move strictly forward
+        covered = set()
+        for start, end in strategy.spans(text):
+            covered.update(range(start, end))
+        assert all(i in covered for i, char in enumerate(text) if not char.isspace())
+        assert all(a.span[1] < b.span[1] for a, b in zip(chunks, chunks[1:]))
+
+    def test_span_is_serialized_with_the_chunk(self):
+        chunk = OffsetChunkStrategy(chunk_size=100, chunk_overlap=0).split("test.txt", SAMPLE_TEXT)[1]
+        start, end = chunk.span
+
+        assert chunk.to_dict() == {"content": SAMPLE_TEXT[start:end], "source": "test.txt", "idx": chunk.idx, "span": [start, end]}
+        assert chunk.to_json() == json.dumps(chunk.to_dict(), ensure_ascii=False)
+        assert chunk == Chunk(content=SAMPLE_TEXT[start:end], source="test.txt", index=chunk.index, count=chunk.count)
+
 class TestMarkItDownConverter:
     def test_converter_with_text_file(self, sample_text_file):
         converter = MarkItDownConverter()
@@ -86,6 +391,754 @@ class TestMarkItDownConverter:
         assert "Section 1" in result
         assert "Section 2" in result
 
+class TestSlidingWindowScheduler:
+    @pytest.mark.asyncio
+    async def test_slow_task_does_not_block_other_slots(self):
+        async def work(delay):
+            await asyncio.sleep(delay)
+            return delay
+
+        scheduler = SlidingWindowScheduler(max_concurrency=2, show_progress=False)
+        order = [index async for index, _, _ in scheduler.run(work, [0.2, 0.01, 0.01, 0.01])]
+
+        # the three short tasks share one slot while the slow one holds the other
+        assert order == [1, 2, 3, 0]
+        assert scheduler.stats.completed == 4
+        assert scheduler.stats.max_in_flight == 2
+        assert scheduler.stats.in_flight == 0
+        assert scheduler.stats.p95_latency >= scheduler.stats.p50_latency > 0
+
+    @pytest.mark.asyncio
+    async def test_failed_task_is_isolated(self):
+        async def work(item):
+            if item == 'bad':
+                raise ValueError(item)
+            return item
+
+        scheduler = SlidingWindowScheduler(max_concurrency=3, show_progress=False)
+        results = {index: result async for index, _, result in scheduler.run(work, ['a', 'bad', 'c'])}
+
+        assert results == {0: 'a', 1: None, 2: 'c'}
+        assert scheduler.stats.failed == 1
+
+class TestRateLimiter:
+    def test_parse_retry_after_headers(self):
+        assert parse_retry_after({'retry-after': '3'}) == 3.0
+        assert parse_retry_after({'retry-after-ms': '250'}) == 0.25
+        assert parse_retry_after({'x-ratelimit-reset-requests': '1m30s', 'x-ratelimit-reset-tokens': '20ms'}) == 90.0
+        assert parse_retry_after({}) is None
+
+    def test_concurrency_shrinks_on_429_and_recovers(self):
+        limiter = RateLimiter(max_concurrency=8, recover_after=2)
+        limiter.on_rate_limited()
+        limiter.on_rate_limited()
+        assert limiter.concurrency_limit == 2
+        for _ in range(4):
+            limiter.on_success()
+        assert limiter.concurrency_limit == 4
+
+    def test_one_overload_cuts_the_limit_once(self):
+        limiter = RateLimiter(max_concurrency=32)
+        started_at = time.monotonic()
+        for _ in range(5):
+            limiter.on_rate_limited(started_at=started_at)
+        assert limiter.concurrency_limit == 16 and limiter.rate_limited == 5
+        # a request sent after the cut that still gets a 429 cuts again
+        limiter.on_rate_limited(started_at=time.monotonic())
+        assert limiter.concurrency_limit == 8
+
+    @pytest.mark.asyncio
+    async def test_client_backs_off_on_429(self, mocker):
+        rate_limit_error = Exception("rate limited")
+        rate_limit_error.status_code = 429
+        rate_limit_error.response = mocker.Mock(headers={'retry-after-ms': '10'})
+        raw = mocker.Mock(headers={})
+        raw.parse.return_value.choices = [mocker.Mock(text="ok")]
+
+        limiter = RateLimiter(backoff_base=0.01)
+        client = OpenAIClient(api_key='test-key', rate_limiter=limiter)
+        create = mocker.AsyncMock(side_effect=[rate_limit_error, raw])
+        mocker.patch.object(client.client.completions.with_raw_response, 'create', create)
+
+        assert await client.get_response("prompt", max_tokens=8) == "ok"
+        assert create.await_count == 2
+        assert limiter.rate_limited == 1
+        assert limiter.in_flight == 0
+
+class EndpointClient(BaseLLMClient):
+    """Answers after `latency` seconds, or fails with `status_code` when set."""
+    def __init__(self, latency: float = 0.01, status_code: int = None):
+        self.llm_model = 'fake-model'
+        self.latency = latency
+        self.status_code = status_code
+        self.calls = 0
+
+    async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.status_code is not None:
+            error = RuntimeError(f"HTTP {self.status_code}")
+            error.status_code = self.status_code
+            raise error
+        return prompt
+
+class TestClientPool:
+    def test_least_outstanding_spreads_concurrent_requests(self):
+        clients = [EndpointClient(latency=0.05) for _ in range(4)]
+        pool = ClientPool(clients)
+
+        async def run():
+            started = asyncio.get_running_loop().time()
+            await asyncio.gather(*(pool.get_response(f"prompt {n}") for n in range(40)))
+            return asyncio.get_running_loop().time() - started
+
+        elapsed = asyncio.run(run())
+        assert [client.calls for client in clients] == [10, 10, 10, 10]
+        # 40 requests at 50ms spread over 4 endpoints run 4-wide
+        assert elapsed < 0.05 * 40 / 2
+
+    def test_failing_endpoint_is_taken_out_of_rotation(self):
+        broken, healthy = EndpointClient(status_code=503), EndpointClient()
+        pool = ClientPool([Endpoint(broken, name='broken'), Endpoint(healthy, weight=2, name='healthy')],
+                          routing='weighted', failure_threshold=2, recovery_time=60)
+
+        async def run():
+            return [await pool.get_response(f"prompt {n}") for n in range(10)]
+
+        assert asyncio.run(run()) == [f"prompt {n}" for n in range(10)]
+        stats = {endpoint['name']: endpoint for endpoint in pool.stats()}
+        assert stats['broken']['state'] == 'open' and broken.calls == 2
+        assert stats['healthy']['successes'] == 10
+
+    def test_bad_requests_are_not_failed_over(self):
+        clients = [EndpointClient(status_code=400), EndpointClient()]
+        pool = ClientPool(clients)
+        with pytest.raises(RuntimeError):
+            asyncio.run(pool.get_response("prompt"))
+        assert clients[1].calls == 0 and pool.endpoints[0].breaker.state == 'closed'
+
+    def test_waits_when_every_endpoint_is_rate_limited(self):
+        with StubOpenAIServer(rate_limit_rate=0.7, retry_after_ms=20, seed=1) as first, \
+                StubOpenAIServer(rate_limit_rate=0.7, retry_after_ms=20, seed=2) as second:
+            clients = [
+                OpenAIClient(api_key='test-key', base_url=server.url, max_rate_limit_retries=0)
+                for server in (first, second)
+            ]
+            pool = ClientPool(clients)
+
+            async def run():
+                try:
+                    return [await pool.get_response(f"prompt {n}") for n in range(6)]
+                finally:
+                    await pool.aclose()
+
+            assert len(asyncio.run(run())) == 6
+        assert first.counters['rate_limited'] + second.counters['rate_limited'] > 0
+        # every 429 reached the endpoint's own limiter, not just the pool stats
+        assert [client.rate_limiter.rate_limited for client in clients] == \
+            [first.counters['rate_limited'], second.counters['rate_limited']]
+
+class TestResponseCache:
+    @pytest.mark.asyncio
+    async def test_cached_client_hits_and_bypass(self, tmp_path):
+        inner = FakeLLMClient()
+        client = CachedLLMClient(inner, cache_dir=tmp_path / "cache")
+
+        first = await client.get_response("prompt", max_tokens=16)
+        second = await client.get_response("prompt", max_tokens=16)
+        await client.get_response("prompt", max_tokens=32)
+
+        assert first == second
+        assert (client.hits, client.misses, inner.calls) == (1, 2, 2)
+        assert client.llm_model == 'fake-model'
+
+        client.bypass = True
+        await client.get_response("prompt", max_tokens=16)
+        assert inner.calls == 3
+
+    @pytest.mark.asyncio
+    async def test_unparseable_answers_are_not_replayed(self, tmp_path):
+        class MalformedOnceClient(FakeLLMClient):
+            async def get_response(self, prompt: str, max_tokens: int = 1024) -> str:
+                answer = await super().get_response(prompt, max_tokens)
+                return "Sorry, I cannot help with that." if self.calls == 1 else answer
+
+        inner = MalformedOnceClient()
+        client = CachedLLMClient(inner, cache_dir=tmp_path / "cache")
+        chunk = Chunk(content=SAMPLE_TEXT, source="test.txt")
+
+        first = await QAGenerator(client, 'fake-model', "{text} {entries_per_chunk}").generate(chunk, 1)
+        again = await QAGenerator(client, 'fake-model', "{text} {entries_per_chunk}").generate(chunk, 1)
+
+        assert [pair.output for pair in first] == [pair.output for pair in again] == ["Summary"]
+        # the retry asked the model again, the second run was answered by the cache
+        assert inner.calls == 2 and client.hits == 1
+        assert len(client.cache) == 1
+
+    def test_lru_eviction_respects_size_cap(self, tmp_path):
+        cache = ResponseCache(tmp_path / "cache", max_bytes=250)
+        cache.put('a' * 64, 'x' * 100)
+        cache.put('b' * 64, 'y' * 100)
+        assert cache.get('a' * 64) == 'x' * 100  # 'a' is now most recently used
+        cache.put('c' * 64, 'z' * 100)
+
+        assert 'b' * 64 not in cache
+        assert 'a' * 64 in cache and 'c' * 64 in cache
+        assert cache.total_bytes <= 250
+        # index is rebuilt from disk
+        assert len(ResponseCache(tmp_path / "cache", max_bytes=250)) == 2
+
+class PlainTextConverter(TextConverter):
+    """Reads text files directly; 'corrupt' files raise and 'hang' files never finish in time."""
+    def convert(self, input_path):
+        input_path = Path(input_path)
+        if 'corrupt' in input_path.name:
+            raise ValueError("corrupt file")
+        if 'hang' in input_path.name:
+            import time
+            time.sleep(30)
+        return input_path.read_text(encoding='utf-8')
+
+class TestChunkGenerator:
+    def test_parallel_conversion_is_ordered_and_isolates_errors(self, tmp_path):
+        for n in range(6):
+            (tmp_path / f"doc_{n}.txt").write_text(f"document {n}\n" + SAMPLE_TEXT)
+        (tmp_path / "doc_2_corrupt.txt").write_text("x")
+        (tmp_path / "doc_3_hang.txt").write_text("x")
+        strategy = RecursiveChunkStrategy(chunk_size=100, chunk_overlap=20)
+
+        serial = ChunkGenerator(PlainTextConverter(), strategy)
+        good_files = [f for f in serial.list_files(tmp_path) if 'corrupt' not in f.name and 'hang' not in f.name]
+        expected = [chunk for f in good_files for chunk in serial.chunk_file(f)]
+
+        parallel = ChunkGenerator(PlainTextConverter(), strategy, num_workers=3, file_timeout=2)
+        chunks = parallel.generate(tmp_path)
+
+        assert [(c.source, c.idx, c.content) for c in chunks] == [(c.source, c.idx, c.content) for c in expected]
+        assert sorted(f.name for f in parallel.failed_files) == ["doc_2_corrupt.txt", "doc_3_hang.txt"]
+
+    def test_serial_conversion_skips_failing_files(self, tmp_path):
+        (tmp_path / "doc_0.txt").write_text(SAMPLE_TEXT)
+        (tmp_path / "doc_1_corrupt.txt").write_text("x")
+        (tmp_path / "doc_2.txt").write_text("document 2")
+        chunk_generator = ChunkGenerator(PlainTextConverter(), RecursiveChunkStrategy(chunk_size=100, chunk_overlap=20))
+
+        chunks = chunk_generator.generate(tmp_path)
+
+        assert {Path(chunk.source).name for chunk in chunks} == {"doc_0.txt", "doc_2.txt"}
+        assert [f.name for f in chunk_generator.failed_files] == ["doc_1_corrupt.txt"]
+
+    def test_conversion_cache_only_converts_changed_files(self, tmp_path, mocker):
+        docs = tmp_path / "docs"
+        docs.mkdir()
+        for n in range(3):
+            (docs / f"doc_{n}.txt").write_text(f"document {n}")
+        cache = ConversionCache(tmp_path / "conversion.sqlite")
+        strategy = RecursiveChunkStrategy(chunk_size=100, chunk_overlap=20)
+        converter = PlainTextConverter()
+        convert = mocker.spy(converter, 'convert')
+
+        first = ChunkGenerator(converter, strategy, conversion_cache=cache)
+        first.generate(docs)
+        (docs / "doc_1.txt").write_text("document 1, edited")
+        second = ChunkGenerator(converter, strategy, conversion_cache=cache)
+        chunks = second.generate(docs)
+
+        assert convert.call_count == 4
+        assert (second.cache_hits, second.cache_misses) == (2, 1)
+        assert "document 1, edited" in [chunk.content for chunk in chunks]
+
+        mocker.patch.object(PlainTextConverter, 'version', 'v2')
+        third = ChunkGenerator(converter, strategy, conversion_cache=cache)
+        third.generate(docs)
+        assert third.cache_hits == 0
+
+class FakePipeline:
+    """Mimics a chat text-generation pipeline and records the batch sizes it was called with."""
+    tokenizer = None
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, messages, max_new_tokens, batch_size):
+        self.batch_sizes.append(batch_size)
+        return [
+            [{"generated_text": conversation + [{"role": "assistant", "content": f"echo {conversation[0]['content']}"}]}]
+            for conversation in messages
+        ]
+
+class TestHuggingFaceClient:
+    @pytest.mark.asyncio
+    async def test_concurrent_prompts_are_batched(self):
+        pipeline = FakePipeline()
+        client = HuggingFaceClient('fake-model', max_batch_size=4, max_wait_ms=50, pipeline=pipeline)
+
+        responses = await asyncio.gather(*[client.get_response(f"p{n}", max_tokens=16) for n in range(6)])
+        await client.aclose()
+
+        assert responses == [f"echo p{n}" for n in range(6)]
+        assert pipeline.batch_sizes == [4, 2]
+        assert client.stats.batches == 2
+        assert client.stats.mean_batch_size == 3
+        assert client.stats.generated_tokens > 0
+
+    @pytest.mark.asyncio
+    async def test_malformed_outputs_fail_requests_instead_of_hanging(self):
+        class MalformedPipeline(FakePipeline):
+            def __call__(self, messages, max_new_tokens, batch_size):
+                outputs = super().__call__(messages, max_new_tokens, batch_size)
+                if batch_size < 3:
+                    return outputs
+                # the first output lacks generated_text and the last one is missing
+                return [[{"text": "?"}]] + outputs[1:-1]
+
+        client = HuggingFaceClient('fake-model', max_batch_size=3, max_wait_ms=50, pipeline=MalformedPipeline())
+        responses = await asyncio.wait_for(
+            asyncio.gather(*[client.get_response(f"p{n}", max_tokens=16) for n in range(3)], return_exceptions=True),
+            timeout=5,
+        )
+        follow_up = await asyncio.wait_for(client.get_response("p3", max_tokens=16), timeout=5)
+        await client.aclose()
+
+        assert isinstance(responses[0], KeyError) and responses[1] == "echo p1"
+        assert isinstance(responses[2], RuntimeError)
+        assert follow_up == "echo p3"
+
+class TestChunkDeduplicator:
+    def test_exact_and_near_duplicates_are_dropped(self):
+        from alpacagen.filters import ChunkDeduplicator
+        manual = " ".join(f"Step {n}: configure the server option number {n} before rebooting." for n in range(40))
+        revised = manual.replace("Step 7:", "Step seven:")
+        chunks = [
+            Chunk(content=manual, source="v1/manual.pdf", idx="1/1"),
+            Chunk(content=manual + "  ", source="copy/manual.pdf", idx="1/1"),
+            Chunk(content=revised, source="v2/manual.pdf", idx="1/1"),
+            Chunk(content=SAMPLE_TEXT, source="test.txt", idx="1/1"),
+        ]
+        deduplicator = ChunkDeduplicator(threshold=0.8)
+        kept = list(deduplicator.filter(chunks))
+
+        assert [chunk.source for chunk in kept] == ["v1/manual.pdf", "test.txt"]
+        assert deduplicator.stats.exact_duplicates == 1
+        assert deduplicator.stats.near_duplicates == 1
+        assert deduplicator.stats.llm_calls_saved == 2
+
+class TestQAFilter:
+    def test_rules_and_near_duplicates(self):
+        from alpacagen.filters import QAFilter
+        answer = "The server reads its configuration from /etc/app.conf at startup and reloads it on SIGHUP."
+        rows = [
+            ("How does the server load its configuration?", "", answer),
+            ("How does the server load its configuration ?", "", answer + " "),
+            ("伺服器如何載入設定？", "", "伺服器在啟動時讀取設定檔，並在收到訊號時重新載入。"),
+            ("Q?", "", "It is read once at startup."),
+            ("Which file holds the server configuration and when is it read?", "", "Which file holds the server configuration and when is it read?"),
+            ("Repeat the warning", "", "warning " * 40),
+            ("What is logged?", "", "  "),
+        ]
+        qa_filter = QAFilter(language='en')
+        assert qa_filter.check(rows) == [None, 'duplicate', 'language', 'too_short', 'echo', 'degenerate', 'empty']
+        assert qa_filter.stats.kept == 1 and qa_filter.stats.rejected['duplicate'] == 1
+
+    def test_filter_jsonl_across_batches(self, tmp_path):
+        from alpacagen.filters import QAFilter
+        rng = random.Random(0)
+        words = ["cache", "page", "index", "flush", "replica", "lock", "commit", "segment", "buffer", "quorum", "shard", "ledger"]
+        records = [
+            {"instruction": f"What does section {i} describe?", "input": "", "output": " ".join(rng.choices(words, k=30))}
+            for i in range(30)
+        ]
+        copies = [{**record, "instruction": record["instruction"].upper()} for record in records[:10]]
+        with gzip.open(tmp_path / "data.jsonl.gz", "wt", encoding="utf-8") as f:
+            for record in records + copies:
+                f.write(json.dumps(record) + "\n")
+
+        qa_filter = QAFilter(batch_size=8)
+        stats = qa_filter.filter_jsonl(tmp_path / "data.jsonl.gz", tmp_path / "clean.jsonl", tmp_path / "rejected.jsonl")
+
+        assert [json.loads(line) for line in (tmp_path / "clean.jsonl").open()] == records
+        rejected = [json.loads(line) for line in (tmp_path / "rejected.jsonl").open()]
+        assert {record["reason"] for record in rejected} == {"duplicate"} and len(rejected) == 10
+        assert (stats.seen, stats.kept) == (40, 30)
+
+    def test_signature_matrix_matches_single_signatures(self):
+        from alpacagen.filters import MinHasher
+        import numpy as np
+        texts = ["", "abc", SAMPLE_TEXT, "short text here", SAMPLE_TEXT[:40], "x"]
+        hasher = MinHasher(num_perm=64)
+        matrix, valid = hasher.signature_matrix(texts)
+        for row, is_valid, text in zip(matrix, valid, texts):
+            signature = hasher.signature(text)
+            assert is_valid == (signature is not None)
+            if signature is not None:
+                assert np.array_equal(row, signature)
+
+def _qa_pairs(num_chunks: int, pairs_per_chunk: int):
+    chunks = [Chunk(content=f"chunk {i} " + "text " * 50, source="doc.txt", idx=f"{i + 1:02d}/{num_chunks:02d}") for i in range(num_chunks)]
+    return [
+        QAPair(instruction=f"Q{i}-{j}", input="", output=f"A{i}-{j}", source=chunk)
+        for i, chunk in enumerate(chunks) for j in range(pairs_per_chunk)
+    ]
+
+class TestDatasetWriters:
+    def test_sharded_zstd_jsonl_stores_each_chunk_once(self, tmp_path):
+        zstandard = pytest.importorskip("zstandard")
+        qa_pairs = _qa_pairs(num_chunks=4, pairs_per_chunk=5)
+        with get_writer(tmp_path / "data.jsonl.zst", normalized=True, shard_bytes=512) as writer:
+            writer.write(qa_pairs[:10])
+            writer.write(qa_pairs[10:])
+
+        def read(paths):
+            return [
+                json.loads(line)
+                for path in paths
+                for line in zstandard.ZstdDecompressor().stream_reader(path.open('rb')).read().decode().splitlines()
+            ]
+
+        pair_paths = sorted(tmp_path.glob("data-*.jsonl.zst"))
+        chunk_paths = sorted(tmp_path.glob("data.chunks-*.jsonl.zst"))
+        assert len(pair_paths) > 1
+        pairs, chunks = read(pair_paths), read(chunk_paths)
+        assert [pair["instruction"] for pair in pairs] == [qa_pair.instruction for qa_pair in qa_pairs]
+        assert len(chunks) == 4
+        by_id = {chunk["chunk_id"]: chunk for chunk in chunks}
+        assert by_id[pairs[7]["chunk_id"]]["content"] == qa_pairs[7].source.content
+
+    def test_default_jsonl_matches_save_to_jsonl_records(self, tmp_path):
+        qa_pairs = _qa_pairs(num_chunks=2, pairs_per_chunk=2)
+        with get_writer(tmp_path / "data.jsonl.gz") as writer:
+            writer.write(qa_pairs)
+        with gzip.open(tmp_path / "data.jsonl.gz", 'rt', encoding='utf-8') as f:
+            assert [json.loads(line) for line in f] == [qa_pair.to_dict() for qa_pair in qa_pairs]
+
+    def test_parquet_tables_are_normalized(self, tmp_path):
+        pq = pytest.importorskip("pyarrow.parquet")
+        qa_pairs = _qa_pairs(num_chunks=3, pairs_per_chunk=4)
+        with get_writer(tmp_path / "data.parquet", batch_size=5) as writer:
+            writer.write(qa_pairs)
+
+        pairs = pq.read_table(tmp_path / "data.parquet")
+        chunks = pq.read_table(tmp_path / "data.chunks.parquet")
+        assert pairs.num_rows == 12 and chunks.num_rows == 3
+        assert pairs.column("chunk_id").to_pylist() == [0] * 4 + [1] * 4 + [2] * 4
+
+    def test_columnar_flush_keeps_rows_buffered(self, tmp_path):
+        pq = pytest.importorskip("pyarrow.parquet")
+        qa_pairs = _qa_pairs(num_chunks=2, pairs_per_chunk=3)
+        with get_writer(tmp_path / "data.parquet") as writer:
+            for qa_pair in qa_pairs:
+                writer.write([qa_pair])
+                writer.flush()
+
+        pairs = pq.ParquetFile(tmp_path / "data.parquet")
+        assert pairs.metadata.num_row_groups == 1 and pairs.metadata.num_rows == 6
+
+class TestStreamedResponses:
+    @pytest.mark.asyncio
+    async def test_stream_is_cancelled_once_enough_pairs_are_parsed(self):
+        chunk = Chunk(content="Streaming passage", source="doc.txt")
+        with StubOpenAIServer(entries_per_response=8, stream_delay=0.005) as server:
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            qa_generator = QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}", stream_responses=True)
+            seen = []
+            pairs = await qa_generator.generate(chunk, 2, on_pair=seen.append)
+            for _ in range(50):
+                if server.cancelled_streams:
+                    break
+                await asyncio.sleep(0.01)
+
+        assert [pair.output for pair in pairs] == ["Answer 1", "Answer 2"]
+        assert seen == pairs
+        assert server.cancelled_streams == 1
+        stats = qa_generator.stream_stats
+        assert stats.early_stops == 1 and stats.first_pairs == 1
+        assert 0 < stats.streamed_tokens and stats.tokens_saved == qa_generator.max_tokens - stats.streamed_tokens
+
+    @pytest.mark.asyncio
+    async def test_on_pair_errors_are_not_taken_for_a_broken_stream(self):
+        chunk = Chunk(content="Streaming passage", source="doc.txt")
+        written = []
+
+        def write(qa_pair):
+            if written:
+                raise OSError("No space left on device")
+            written.append(qa_pair)
+
+        with StubOpenAIServer(entries_per_response=3) as server:
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            qa_generator = QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}", stream_responses=True)
+            with pytest.raises(OSError, match="No space left"):
+                await qa_generator.generate(chunk, 3, on_pair=write)
+
+        assert len(written) == 1 and len(server.requests) == 1
+
+    def test_pipeline_writes_streamed_pairs_and_caches_them(self, tmp_path):
+        docs = tmp_path / "docs"
+        docs.mkdir()
+        for n in range(3):
+            (docs / f"doc{n}.txt").write_text(f"Document number {n}.")
+        with StubOpenAIServer(entries_per_response=5) as server:
+            ag = AlpacaGen(
+                llm_provider='openai', api_key='test-key', base_url=server.url,
+                stream_responses=True, cache_dir=tmp_path / "cache",
+            )
+            first = ag.run_pipeline(docs, tmp_path / "first.jsonl", language='en', entries_per_chunk=2)
+            requests = len(server.requests)
+            second = ag.run_pipeline(docs, tmp_path / "second.jsonl", language='en', entries_per_chunk=2)
+
+        assert first == second == 6
+        assert requests == 3 and len(server.requests) == 3
+        assert all(body['stream'] for _, body in server.requests)
+        lines = (tmp_path / "first.jsonl").read_text().splitlines()
+        assert sorted(lines) == sorted((tmp_path / "second.jsonl").read_text().splitlines())
+
+class StreamingClient(FakeLLMClient):
+    """Streams `entries` QA entries, one JSON line per piece."""
+    supports_streaming = True
+
+    def __init__(self, entries: int = 4):
+        super().__init__()
+        self.entries = entries
+
+    async def stream_response(self, prompt: str, max_tokens: int = 1024):
+        self.calls += 1
+        for n in range(self.entries):
+            await asyncio.sleep(0)
+            yield json.dumps({"instruction": f"Q{n}", "input": "", "output": f"A{n}"}) + "\n"
+
+class TestStreamedCaching:
+    @pytest.mark.asyncio
+    async def test_only_complete_or_sufficient_streams_are_cached(self, tmp_path):
+        inner = StreamingClient(entries=4)
+        client = CachedLLMClient(inner, cache_dir=tmp_path / "cache")
+
+        # a consumer that goes away after one piece (cancelled run, failing writer) leaves nothing behind
+        stream = client.stream_response("prompt", max_tokens=16)
+        await stream.__anext__()
+        await stream.aclose()
+        assert len(client.cache) == 0
+
+        qa_generator = QAGenerator(client, 'fake-model', "{text} {entries_per_chunk}", stream_responses=True)
+        chunk = Chunk(content="passage", source="doc.txt")
+        first = await qa_generator.generate(chunk, 2)
+        again = await qa_generator.generate(chunk, 2)
+
+        assert [pair.output for pair in first] == [pair.output for pair in again] == ["A0", "A1"]
+        # the early-stopped answer was kept on purpose and replayed without a new request
+        assert inner.calls == 2 and client.hits == 1
+
+    @pytest.mark.asyncio
+    async def test_client_pool_streams_with_failover(self):
+        with StubOpenAIServer(error_rate=1.0) as broken, StubOpenAIServer(entries_per_response=4) as healthy:
+            pool = ClientPool([
+                Endpoint(OpenAIClient(api_key='test-key', base_url=broken.url), name='broken'),
+                Endpoint(OpenAIClient(api_key='test-key', base_url=healthy.url), name='healthy'),
+            ], routing='weighted')
+            qa_generator = QAGenerator(pool, 'gpt-4o', "{text} {entries_per_chunk}", stream_responses=True)
+            pairs = await qa_generator.generate(Chunk(content="passage", source="doc.txt"), 2)
+            await pool.aclose()
+
+        assert pool.supports_streaming and qa_generator.stream_responses
+        assert len(pairs) == 2 and qa_generator.stream_stats.streams == 1
+        assert all(body['stream'] for _, body in healthy.requests)
+        assert broken.counters['errors'] == 1
+
+class TestBatchJobs:
+    @pytest.mark.asyncio
+    async def test_results_map_back_to_chunks_by_custom_id(self):
+        chunks = [Chunk(content=f"Passage {n}", source="doc.txt", index=n + 1, count=3) for n in range(3)]
+        with StubOpenAIServer(entries_per_response=2, batch_polls=2) as server:
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            qa_generator = QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}")
+            runner = BatchJobRunner(qa_generator, entries_per_chunk=2, poll_interval=0.01)
+            results = await runner.run(chunks)
+
+        assert [[pair.source for pair in pairs] for pairs in results] == [[chunk, chunk] for chunk in chunks]
+        assert results[1][0].instruction == "Question 1 about Passage 1 2"
+        assert server.paths() == ['/v1/chat/completions'] * 3
+        assert runner.stats.jobs == 1 and runner.stats.succeeded == 3
+
+    @pytest.mark.asyncio
+    async def test_only_failed_items_go_into_the_retry_batch(self):
+        chunks = [Chunk(content=f"Passage {n}", source="doc.txt", index=n + 1, count=20) for n in range(20)]
+        with StubOpenAIServer(entries_per_response=2, error_rate=0.3, malformed_rate=0.2, seed=1) as server:
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            qa_generator = QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}")
+            runner = BatchJobRunner(qa_generator, entries_per_chunk=2, poll_interval=0.01, max_attempts=10)
+            results = await runner.run(chunks)
+            jobs = list(server.batches)
+
+        assert all(pairs and pairs[0].source is chunk for pairs, chunk in zip(results, chunks))
+        assert runner.stats.jobs == len(jobs) > 1
+        assert runner.stats.requests == 20 + runner.stats.retried
+        assert server.counters['requests'] == runner.stats.requests
+        assert runner.stats.gave_up == 0
+
+    @pytest.mark.asyncio
+    async def test_null_content_goes_into_the_retry_batch(self):
+        chunks = [Chunk(content=f"Passage {n}", source="doc.txt", index=n + 1, count=2) for n in range(2)]
+        with StubOpenAIServer(entries_per_response=2) as server:
+            answer = server.routes['/chat/completions']
+            refused = []
+
+            def refuse_once(body):
+                status, payload = answer(body)
+                if not refused:
+                    refused.append(body)
+                    payload['choices'][0]['message']['content'] = None
+                    payload['choices'][0]['finish_reason'] = 'content_filter'
+                return status, payload
+
+            server.routes['/chat/completions'] = refuse_once
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            runner = BatchJobRunner(QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}"), entries_per_chunk=2, poll_interval=0.01)
+            results = await runner.run(chunks)
+
+        assert all(results)
+        assert runner.stats.failed_requests == 1 and runner.stats.retried == 1 and runner.stats.jobs == 2
+        assert runner._parse_line({'custom_id': 'chunk-0', 'response': {'status_code': 200, 'body': {'choices': []}}}, chunks[0]) == []
+
+    @pytest.mark.asyncio
+    async def test_poll_errors_are_retried_and_input_files_deleted(self):
+        chunks = [Chunk(content=f"Passage {n}", source="doc.txt", index=n + 1, count=2) for n in range(2)]
+        with StubOpenAIServer(entries_per_response=2, batch_poll_errors=2) as server:
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            runner = BatchJobRunner(QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}"), entries_per_chunk=2, poll_interval=0.01)
+            results = await runner.run(chunks)
+            input_file_id = next(iter(server.batches.values()))['batch']['input_file_id']
+
+        assert all(results) and runner.stats.poll_errors == 2
+        assert server.deleted_files == [input_file_id]
+
+    @pytest.mark.asyncio
+    async def test_restarted_run_reattaches_to_submitted_jobs(self, tmp_path):
+        chunks = [Chunk(content=f"Passage {n}", source="doc.txt", index=n + 1, count=3) for n in range(3)]
+        state_path = tmp_path / "out.jsonl.batches.json"
+        with StubOpenAIServer(entries_per_response=2) as server:
+            client = OpenAIClient(api_key='test-key', base_url=server.url)
+            qa_generator = QAGenerator(client, 'gpt-4o', "{text} {entries_per_chunk}")
+            # a run that submitted its job and then died
+            crashed = BatchJobRunner(qa_generator, entries_per_chunk=2, state_path=state_path)
+            await crashed._submit({f"chunk-{index}": chunk for index, chunk in enumerate(chunks)})
+            runner = BatchJobRunner(qa_generator, entries_per_chunk=2, poll_interval=0.01, state_path=state_path)
+            results = await runner.run(chunks)
+
+        assert all(results) and len(server.batches) == 1
+        assert runner.stats.reattached == 1 and runner.stats.jobs == 0
+        assert not state_path.exists()
+
+class TestCli:
+    def test_shards_partition_files_deterministically(self, tmp_path):
+        for n in range(20):
+            (tmp_path / f"dir{n % 3}").mkdir(exist_ok=True)
+            (tmp_path / f"dir{n % 3}" / f"doc{n}.txt").write_text(f"document {n}")
+        files = ChunkGenerator.list_files(tmp_path)
+        shards = [ChunkGenerator.shard_files(tmp_path, files, index, 4) for index in range(4)]
+
+        assert sorted(file for shard in shards for file in shard) == files
+        assert sum(len(shard) for shard in shards) == len(files)
+        # the split only depends on relative paths, not on where the directory lives
+        moved = tmp_path.rename(tmp_path.with_name(tmp_path.name + "-moved"))
+        assert [
+            [file.relative_to(moved) for file in ChunkGenerator.shard_files(moved, ChunkGenerator.list_files(moved), index, 4)]
+            for index in range(4)
+        ] == [[file.relative_to(tmp_path) for file in shard] for shard in shards]
+
+    def test_merge_concatenates_gzip_shards_in_order(self, tmp_path):
+        qa_pairs = _qa_pairs(num_chunks=4, pairs_per_chunk=2)
+        shards = [shard_output_path(tmp_path, index, 2, '.jsonl.gz') for index in range(2)]
+        for shard, pairs in zip(shards, (qa_pairs[:3], qa_pairs[3:])):
+            with get_writer(shard) as writer:
+                writer.write(pairs)
+
+        assert merge_outputs(shards, tmp_path / "dataset.jsonl.gz") == len(qa_pairs)
+        with gzip.open(tmp_path / "dataset.jsonl.gz", 'rt', encoding='utf-8') as f:
+            assert [json.loads(line) for line in f] == [qa_pair.to_dict() for qa_pair in qa_pairs]
+        with pytest.raises(ValueError):
+            merge_outputs([tmp_path / "a.parquet"], tmp_path / "b.parquet")
+
+    def test_merge_counts_zstd_records_and_rejects_a_lone_shard_index(self, tmp_path, capsys):
+        pytest.importorskip("zstandard")
+        qa_pairs = _qa_pairs(num_chunks=3, pairs_per_chunk=2)
+        shards = [shard_output_path(tmp_path, index, 2, '.jsonl.zst') for index in range(2)]
+        for shard, pairs in zip(shards, (qa_pairs[:2], qa_pairs[2:])):
+            with get_writer(shard) as writer:
+                writer.write(pairs)
+
+        assert merge_outputs(shards, tmp_path / "dataset.jsonl.zst") == len(qa_pairs)
+        with pytest.raises(SystemExit) as exit_info:
+            cli_main(['run', str(tmp_path), str(tmp_path / "out.jsonl"), '--shard-index', '1'])
+        assert exit_info.value.code == 2
+        assert "--shard-index needs --num-shards > 1" in capsys.readouterr().err
+
+    def test_launch_runs_shards_against_stub_server(self, tmp_path, monkeypatch):
+        docs = tmp_path / "docs"
+        docs.mkdir()
+        for n in range(4):
+            (docs / f"doc{n}.txt").write_text(f"Document number {n}.")
+        monkeypatch.setenv("ALPACAGEN_API_KEY", "test-key")
+        with StubOpenAIServer(entries_per_response=2) as server:
+            status = cli_main([
+                "launch", str(docs), str(tmp_path / "out"), "--num-shards", "2", "--processes", "2",
+                "--base-url", server.url, "--language", "en", "--entries-per-chunk", "2",
+            ])
+        assert status == 0
+        assert len(list((tmp_path / "out").glob("shard-*-of-00002.jsonl"))) == 2
+        records = [json.loads(line) for line in (tmp_path / "out" / "dataset.jsonl").read_text().splitlines()]
+        assert len(records) == 8
+
+    def test_failed_launch_only_suggests_resume_when_journaled(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.setenv("ALPACAGEN_API_KEY", "test-key")
+        for extra, hint in (([], "rerun to retry them; add --resume"), (["--resume"], "rerun with --resume")):
+            status = cli_main(["launch", str(tmp_path / "missing"), str(tmp_path / "out"), "--num-shards", "1", *extra])
+            assert status == 1
+            err = capsys.readouterr().err
+            assert "needs --num-shards" not in err
+            assert hint in err
+
+class TestAlpacaGenSession:
+    @pytest.mark.asyncio
+    async def test_session_reuses_one_connection_pool(self, sample_text_file):
+        with StubOpenAIServer(entries_per_response=1) as server:
+            async with AlpacaGen(llm_provider='openai', api_key='test-key', base_url=server.url, max_connections=2) as ag:
+                client = ag._session_client
+                chunks = await ag.aget_chunks(sample_text_file) * 4
+                for _ in range(3):
+                    dataset = await ag.aget_datasets(chunks, language='en', entries_per_chunk=1, max_concurrency=4)
+                    assert len(dataset) == len(chunks)
+                assert ag._session_client is client
+            assert ag._session_client is None
+            assert client.client.is_closed()
+        assert server.counters['requests'] == 3 * len(chunks)
+        assert server.connections <= 2
+
+    def test_sync_session_in_a_worker_thread(self, sample_text_file):
+        import threading
+        results, errors = [], []
+
+        def work(server):
+            try:
+                with AlpacaGen(llm_provider='openai', api_key='test-key', base_url=server.url, max_connections=2) as ag:
+                    chunks = ag.get_chunks(input_path=sample_text_file)
+                    for _ in range(2):
+                        results.append(len(ag.get_datasets(chunks, language='en', entries_per_chunk=1)))
+            except Exception as e:
+                errors.append(e)
+
+        with StubOpenAIServer(entries_per_response=1) as server:
+            # no event loop can be set up implicitly in a thread, each call used to get a new one
+            worker = threading.Thread(target=work, args=(server,))
+            worker.start()
+            worker.join()
+        assert errors == [] and len(results) == 2 and results[0] > 0
+        assert server.connections <= 2
+
+    def test_clients_made_for_one_call_are_closed(self, sample_text_file, fake_llm_client):
+        ag = AlpacaGen(llm_provider='openai', api_key='test-key')
+        chunks = ag.get_chunks(input_path=sample_text_file)
+        ag.get_datasets(chunks, language='en')
+        assert fake_llm_client.closed == 1
+
 class TestAlpacaGen:
     @pytest.mark.asyncio
     async def test_generate_single_file(self, sample_text_file, mock_openai_client, tmp_path):
@@ -111,6 +1164,71 @@ class TestAlpacaGen:
         assert all(isinstance(entry, QAPair) for entry in dataset)
         assert output_file.exists()
 
+    def test_run_pipeline_streams_to_jsonl(self, tmp_path, fake_llm_client):
+        docs = tmp_path / "docs"
+        docs.mkdir()
+        for n in range(3):
+            (docs / f"doc_{n}.txt").write_text(SAMPLE_TEXT)
+        output_file = tmp_path / "output.jsonl"
+
+        ag = AlpacaGen(llm_provider='openai', api_key='test-key')
+        written = ag.run_pipeline(docs, output_file, language='en', entries_per_chunk=1, max_concurrency=2)
+
+        lines = output_file.read_text(encoding='utf-8').splitlines()
+        assert written == len(lines) == fake_llm_client.calls == 3
+        assert ag.last_run_stats.completed == 3
+        assert ag.last_run_stats.max_in_flight <= 2
+
+    def test_resume_skips_completed_chunks(self, sample_text_file, tmp_path, fake_llm_client):
+        output_file = tmp_path / "output.jsonl"
+        ag = AlpacaGen(llm_provider='openai', api_key='test-key')
+        chunks = ag.get_chunks(input_path=sample_text_file)
+
+        first = ag.get_datasets(chunks, language='en', output_path=output_file, resume=True)
+        calls_after_first_run = fake_llm_client.calls
+        second = ag.get_datasets(chunks, language='en', output_path=output_file, resume=True)
+
+        assert calls_after_first_run == len(chunks)
+        assert fake_llm_client.calls == calls_after_first_run
+        assert [pair.to_dict() for pair in second] == [pair.to_dict() for pair in first]
+        assert (tmp_path / "output.jsonl.journal.sqlite").exists()
+
+    def test_instrumentation_summary_and_spans(self, sample_text_file, tmp_path, fake_llm_client):
+        exporter = instrumentation.InMemorySpanExporter()
+        ag = AlpacaGen(llm_provider='openai')
+        instrumentation.enable(exporter=exporter)
+        try:
+            ag.run_pipeline(sample_text_file, tmp_path / "output.jsonl", language='en')
+            ag.dump_metrics(tmp_path / "metrics.prom")
+            summary = ag.metrics_summary()
+        finally:
+            instrumentation.disable()
+
+        assert {span.name for span in exporter.spans} >= {'convert', 'chunk', 'generate', 'parse'}
+        parse_span = next(span for span in exporter.spans if span.name == 'parse')
+        assert parse_span.parent_id in {span.span_id for span in exporter.spans if span.name == 'generate'}
+        assert 'convert' in summary and str(sample_text_file) in summary
+        prometheus = (tmp_path / "metrics.prom").read_text()
+        assert 'alpacagen_convert_seconds_count 1' in prometheus
+        assert 'alpacagen_qa_pairs_total 1' in prometheus
+
+    def test_disabled_instrumentation_is_a_no_op(self):
+        assert not instrumentation.metrics.enabled
+        instrumentation.metrics.reset()
+        with instrumentation.metrics.span('convert') as span:
+            span.set(chunks=1)
+        instrumentation.metrics.count('chunks')
+        assert 'convert' not in instrumentation.metrics.timers
+
+    def test_import_does_not_load_heavy_backends(self):
+        probe = (
+            "import sys, alpacagen; "
+            "alpacagen.AlpacaGen(llm_provider='openai', api_key='test-key'); "
+            "print(sorted(m for m in ('torch', 'transformers', 'markitdown', 'numpy') if m in sys.modules))"
+        )
+        output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True).stdout
+        assert output.strip().splitlines()[-1] == '[]'
+
     def test_invalid_language(self):
         ag = AlpacaGen(
             llm_provider='azure',